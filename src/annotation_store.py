@@ -0,0 +1,263 @@
+import numpy as np
+
+import biocio
+
+MISSING = -1
+# infons kept in their own columns, all other infon values go to the flat infon_values array in layout order
+COLUMN_KEYS = ("type", "identifier")
+ANNOTATION_DTYPE = np.dtype(
+    [
+        ("offset", np.int64),
+        ("length", np.int64),
+        ("type", np.int32),
+        ("identifier", np.int32),
+        ("tool", np.int32),
+        ("id", np.int32),
+        ("text", np.int32),
+        ("layout", np.int32),
+        ("infon_start", np.int32),
+        ("location_start", np.int32),
+    ]
+)
+LOCATION_DTYPE = np.dtype([("offset", np.int64), ("length", np.int64)])
+
+
+class StringTable:
+    # interned infon values, texts and infon key layouts shared by the annotation arrays of a batch, id 0 is None
+    def __init__(self):
+        self.ids = {None: 0}
+        self.values = [None]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, id: int):
+        return self.values[id]
+
+    def intern(self, value):
+        id = self.ids.get(value)
+        if id is None:
+            id = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return id
+
+    def lookup(self, value):
+        return self.ids.get(value, MISSING)
+
+    def decode(self, ids: np.ndarray):
+        unique, inverse = np.unique(ids, return_inverse=True)
+        values = np.array([self.values[id] if id != MISSING else None for id in unique.tolist()], dtype=object)
+        return values[inverse.reshape(-1)]
+
+
+class AnnotationBuilder:
+    def __init__(self, strings: StringTable, tool: str = None):
+        self.strings = strings
+        self.tool = strings.intern(tool) if tool is not None else MISSING
+        self.rows = []
+        self.infon_values = []
+        self.locations = []
+
+    def append(self, id: str, text: str, infons, locations):
+        intern = self.strings.intern
+        keys = []
+        type = identifier = MISSING
+        infon_start = len(self.infon_values)
+        for key, value in infons:
+            keys.append(key)
+            if key == "type":
+                type = intern(value)
+            elif key == "identifier":
+                identifier = intern(value)
+            else:
+                self.infon_values.append(intern(value))
+        location_start = len(self.locations)
+        self.locations.extend(locations)
+        offset, length = self.locations[location_start] if len(self.locations) > location_start else (MISSING, MISSING)
+        self.rows.append(
+            (
+                offset,
+                length,
+                type,
+                identifier,
+                self.tool,
+                intern(id),
+                intern(text),
+                intern(tuple(keys)),
+                infon_start,
+                location_start,
+            )
+        )
+
+    def build(self):
+        return AnnotationArray(
+            self.strings,
+            np.array(self.rows, dtype=ANNOTATION_DTYPE),
+            np.array(self.infon_values, dtype=np.int32),
+            np.array(self.locations, dtype=LOCATION_DTYPE),
+        )
+
+
+class AnnotationArray:
+    """The annotations of a passage as columns of interned ids, convertible to and from BioC annotations losslessly.
+
+    Iterating or indexing yields ``biocio.BioCAnnotation`` objects, so the BioC writers serialize it like a list of
+    annotations. ``tool`` records which tool the identifier was taken from and is not part of the BioC output.
+    """
+
+    __slots__ = ("strings", "records", "infon_values", "locations")
+
+    def __init__(self, strings: StringTable, records: np.ndarray, infon_values: np.ndarray, locations: np.ndarray):
+        self.strings = strings
+        self.records = records
+        self.infon_values = infon_values
+        self.locations = locations
+
+    @classmethod
+    def from_annotations(cls, annotations, strings: StringTable, tool: str = None):
+        builder = AnnotationBuilder(strings, tool)
+        for annotation in annotations:
+            builder.append(
+                annotation.id,
+                annotation.text,
+                annotation.infons.items(),
+                [(location.offset, location.length) for location in annotation.locations],
+            )
+        return builder.build()
+
+    @classmethod
+    def concatenate(cls, arrays: list, strings: StringTable):
+        # the arrays must share the string table
+        records = [array.records.copy() for array in arrays]
+        infon_start = location_start = 0
+        for array, array_records in zip(arrays, records):
+            array_records["infon_start"] += infon_start
+            array_records["location_start"] += location_start
+            infon_start += len(array.infon_values)
+            location_start += len(array.locations)
+        return cls(
+            strings,
+            np.concatenate(records) if records else np.empty(0, ANNOTATION_DTYPE),
+            np.concatenate([array.infon_values for array in arrays]) if arrays else np.empty(0, np.int32),
+            np.concatenate([array.locations for array in arrays]) if arrays else np.empty(0, LOCATION_DTYPE),
+        )
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, position: int):
+        position = range(len(self))[position]
+        return next(self.iter_annotations(self.records[position : position + 1], position))
+
+    def __iter__(self):
+        return self.iter_annotations(self.records, 0)
+
+    def iter_annotations(self, records: np.ndarray, start: int):
+        values = self.strings.values
+        infon_values = self.infon_values.tolist()
+        locations = self.locations.tolist()
+        location_ends = np.append(self.records["location_start"][1:], len(self.locations))[start:].tolist()
+        for row, location_end in zip(records.tolist(), location_ends):
+            _, _, type, identifier, _, id, text, layout, infon_start, location_start = row
+            annotation = biocio.BioCAnnotation()
+            annotation.id = values[id]
+            annotation.text = values[text]
+            for key in values[layout]:
+                if key == "type":
+                    annotation.infons[key] = values[type]
+                elif key == "identifier":
+                    annotation.infons[key] = values[identifier]
+                else:
+                    annotation.infons[key] = values[infon_values[infon_start]]
+                    infon_start += 1
+            annotation.locations = [
+                biocio.BioCLocation(offset, length) for offset, length in locations[location_start:location_end]
+            ]
+            yield annotation
+
+    def reintern(self, strings: StringTable):
+        # the same annotations with their ids translated to another table, which only gains the strings used here
+        columns = ("type", "identifier", "tool", "id", "text", "layout")
+        used = np.unique(np.concatenate([self.records[column] for column in columns] + [self.infon_values]))
+        used = used[used != MISSING]
+        new_ids = np.array([strings.intern(self.strings[id]) for id in used.tolist()] + [MISSING], dtype=np.int32)
+
+        def translate(ids: np.ndarray):
+            return np.where(ids == MISSING, MISSING, new_ids[np.searchsorted(used, ids)])
+
+        records = self.records.copy()
+        for column in columns:
+            records[column] = translate(records[column])
+        return AnnotationArray(strings, records, translate(self.infon_values), self.locations)
+
+    def to_annotations(self):
+        return list(self)
+
+    @property
+    def nbytes(self):
+        return self.records.nbytes + self.infon_values.nbytes + self.locations.nbytes
+
+    def spans(self):
+        # offset and length of the first location packed into one sortable key
+        return self.records["offset"] << 32 | self.records["length"]
+
+    def values(self, key: str):
+        if key in COLUMN_KEYS:
+            return self.records[key]
+        values = np.full(len(self), MISSING, dtype=np.int32)
+        layouts = self.records["layout"]
+        for layout in np.unique(layouts).tolist():
+            keys = [k for k in self.strings[layout] if k not in COLUMN_KEYS]
+            if key in keys:
+                mask = layouts == layout
+                values[mask] = self.infon_values[self.records["infon_start"][mask] + keys.index(key)]
+        return values
+
+    def has(self, key: str):
+        return self.values(key) != MISSING
+
+    def equals(self, key: str, value: str):
+        id = self.strings.lookup(value)
+        if id == MISSING:
+            return np.zeros(len(self), dtype=bool)
+        return self.values(key) == id
+
+    def matching(self, key: str, predicate):
+        values = self.values(key)
+        ids = [id for id in np.unique(values).tolist() if id != MISSING and predicate(self.strings[id])]
+        return np.isin(values, ids)
+
+    def change_layouts(self, positions: np.ndarray, change):
+        layouts = self.records["layout"]
+        for layout in np.unique(layouts[positions]).tolist():
+            selected = positions[layouts[positions] == layout]
+            layouts[selected] = self.strings.intern(change(self.strings[layout]))
+
+    def set_identifiers(self, positions, identifiers: np.ndarray, tool: str = None):
+        positions = np.asarray(positions, dtype=np.intp)
+        # like assigning to the infons dict, a new identifier key goes after the existing ones
+        added = positions[self.records["identifier"][positions] == MISSING]
+        self.change_layouts(added, lambda keys: keys + ("identifier",))
+        self.records["identifier"][positions] = identifiers
+        self.records["tool"][positions] = self.strings.intern(tool) if tool is not None else MISSING
+
+    def clear_identifiers(self, mask: np.ndarray):
+        positions = np.flatnonzero(mask & (self.records["identifier"] != MISSING))
+        self.change_layouts(positions, lambda keys: tuple(key for key in keys if key != "identifier"))
+        self.records["identifier"][positions] = MISSING
+        self.records["tool"][positions] = MISSING
+
+
+def get_string_table(containers):
+    # the table of the containers that already hold arrays, which share one table when parsed together
+    for container in containers:
+        if isinstance(container.annotations, AnnotationArray):
+            return container.annotations.strings
+    return StringTable()
+
+
+def as_annotation_array(container, strings: StringTable, tool: str = None):
+    # passages parsed by biocio with a string table already hold arrays, others are converted in place
+    if not isinstance(container.annotations, AnnotationArray):
+        container.annotations = AnnotationArray.from_annotations(container.annotations, strings, tool)
+    return container.annotations
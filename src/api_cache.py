@@ -0,0 +1,98 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+# an eviction frees space down to this fraction of the size bound, so the next puts do not evict again right away
+EVICT_TARGET = 0.9
+
+
+class ResponseCache:
+    # one gzipped raw API response per request, addressed by a hash of its PMIDs and the request parameters
+    def __init__(self, cache_dir: Path, params: dict, max_bytes: int = None):
+        self.cache_dir = Path(cache_dir)
+        self.params = params
+        self.max_bytes = max_bytes
+        # the total size of the cache, scanned once by the first put() that has to check the bound
+        self.bytes = None
+
+    def key(self, pmids: list):
+        pmids = sorted(int(pmid) for pmid in pmids)
+        return hashlib.sha256(json.dumps({"pmids": pmids, **self.params}, sort_keys=True).encode()).hexdigest()
+
+    def path(self, pmids: list):
+        key = self.key(pmids)
+        return self.cache_dir / key[:2] / f"{key}.xml.gz"
+
+    def __contains__(self, pmids: list):
+        return self.path(pmids).exists()
+
+    def get(self, pmids: list):
+        path = self.path(pmids)
+        try:
+            with gzip.open(path, "rt") as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return text
+
+    def put(self, pmids: list, text: str):
+        path = self.path(pmids)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with gzip.open(tmp_path, "wt", compresslevel=6) as f:
+            f.write(text)
+        size = tmp_path.stat().st_size
+        try:
+            size -= path.stat().st_size
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+        if self.max_bytes is None:
+            return
+        if self.bytes is None:
+            self.bytes = sum(size for _, size, _ in self.scan())
+        else:
+            self.bytes += size
+        if self.bytes > self.max_bytes:
+            self.evict()
+
+    def scan(self):
+        # (mtime, size, path) of every cached response
+        entries = []
+        if not self.cache_dir.exists():
+            return entries
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".xml.gz"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def iter_responses(self):
+        for _, _, path in self.scan():
+            with gzip.open(path, "rt") as f:
+                yield f.read()
+
+    def evict(self):
+        if self.max_bytes is None:
+            return 0
+        entries = self.scan()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        if total > self.max_bytes:
+            # least recently used first, since get() and put() both bump the mtime
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes * EVICT_TARGET:
+                    break
+                os.unlink(path)
+                total -= size
+                evicted += 1
+            logging.info(f"Evicted {evicted} responses from {self.cache_dir}, {total / 1e9:.1f} GB left")
+        self.bytes = total
+        return evicted
@@ -0,0 +1,56 @@
+import argparse
+import io
+import itertools
+import time
+from pathlib import Path
+
+from bioc import biocxml
+
+import biocio
+
+
+def time_it(function, inputs: list):
+    start = time.perf_counter()
+    outputs = [function(x) for x in inputs]
+    return time.perf_counter() - start, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare BioC XML parse and serialize speed of biocio and bioc")
+    parser.add_argument(
+        "--bioc_dir", help="directory of BioC XML files", default="/data/rgd-knowledge-graph/pubtator3/local/merged/"
+    )
+    parser.add_argument("--suffix", help="file suffix", default=".bioc")
+    parser.add_argument("--limit", help="number of files", type=int, default=1000)
+    args = parser.parse_args()
+
+    paths = list(itertools.islice(Path(args.bioc_dir).glob(f"*{args.suffix}"), args.limit))
+    files = [path.read_bytes() for path in paths]
+    print(f"Read {len(files)} files, {sum(map(len, files)) / 1e6:.1f} MB")
+
+    bioc_parse, bioc_collections = time_it(lambda data: biocxml.load(io.BytesIO(data)), files)
+    biocio_parse, biocio_collections = time_it(lambda data: biocio.load(io.BytesIO(data)), files)
+    annotations_parse, _ = time_it(lambda data: biocio.load(io.BytesIO(data), annotations_only=True), files)
+    iterparse_parse, _ = time_it(lambda data: list(biocio.iterparse(io.BytesIO(data), annotations_only=True)), files)
+    bioc_dump, expected = time_it(biocxml.dumps, bioc_collections)
+    biocio_dump, actual = time_it(biocio.dumps, biocio_collections)
+
+    mismatched = [path for path, a, b in zip(paths, actual, expected) if a != b]
+    for path in mismatched[:10]:
+        print(f"Output differs from bioc for {path}")
+    print(f"{len(files) - len(mismatched)} of {len(files)} files serialized byte-identically to bioc")
+
+    for name, seconds, baseline in [
+        ("bioc load", bioc_parse, bioc_parse),
+        ("biocio load", biocio_parse, bioc_parse),
+        ("biocio load annotations only", annotations_parse, bioc_parse),
+        ("biocio iterparse annotations only", iterparse_parse, bioc_parse),
+        ("bioc dumps", bioc_dump, bioc_dump),
+        ("biocio dumps", biocio_dump, bioc_dump),
+    ]:
+        per_file = seconds / max(len(files), 1) * 1000
+        print(f"{name:<36}{seconds:8.2f}s {per_file:8.3f} ms/file {baseline / seconds:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
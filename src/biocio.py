@@ -0,0 +1,395 @@
+import datetime
+import re
+
+from lxml import etree
+
+import annotation_store
+
+TEXT_ESCAPES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", "\r": "&#13;"})
+ATTRIBUTE_ESCAPES = str.maketrans(
+    {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#9;"}
+)
+XML_DECLARATION = re.compile(rb"""<\?xml[^>]*?encoding=["']([A-Za-z0-9._-]+)["']""")
+INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]")
+
+
+# lightweight stand-ins for the bioc classes with the same attribute names, so code written against
+# bioc objects works with either and the writer below serializes both
+
+
+class BioCLocation:
+    __slots__ = ("offset", "length")
+
+    def __init__(self, offset: int, length: int):
+        self.offset = offset
+        self.length = length
+
+
+class BioCNode:
+    __slots__ = ("refid", "role")
+
+    def __init__(self, refid: str, role: str):
+        self.refid = refid
+        self.role = role
+
+
+class BioCAnnotation:
+    __slots__ = ("id", "infons", "locations", "text")
+
+    def __init__(self):
+        self.id = ""
+        self.infons = {}
+        self.locations = []
+        self.text = None
+
+
+class BioCRelation:
+    __slots__ = ("id", "infons", "nodes")
+
+    def __init__(self):
+        self.id = ""
+        self.infons = {}
+        self.nodes = []
+
+
+class BioCSentence:
+    __slots__ = ("offset", "infons", "text", "annotations", "relations")
+
+    def __init__(self):
+        self.offset = -1
+        self.infons = {}
+        self.text = None
+        self.annotations = []
+        self.relations = []
+
+
+class BioCPassage:
+    __slots__ = ("offset", "infons", "text", "sentences", "annotations", "relations")
+
+    def __init__(self):
+        self.offset = -1
+        self.infons = {}
+        self.text = None
+        self.sentences = []
+        self.annotations = []
+        self.relations = []
+
+
+class BioCDocument:
+    __slots__ = ("id", "infons", "passages", "annotations", "relations")
+
+    def __init__(self):
+        self.id = ""
+        self.infons = {}
+        self.passages = []
+        self.annotations = []
+        self.relations = []
+
+
+class BioCCollection:
+    __slots__ = ("source", "date", "key", "infons", "documents", "encoding", "standalone", "version")
+
+    def __init__(self):
+        self.source = ""
+        self.date = datetime.date.today().strftime("%Y-%m-%d")
+        self.key = ""
+        self.infons = {}
+        self.documents = []
+        self.encoding = "utf-8"
+        self.standalone = True
+        self.version = "1.0"
+
+    @classmethod
+    def of_documents(cls, *documents):
+        collection = cls()
+        collection.documents.extend(documents)
+        return collection
+
+
+# reading
+
+
+# like bioc, element texts that are present but empty read as "" while infon values keep None
+
+
+def parse_annotation(elem):
+    annotation = BioCAnnotation()
+    annotation.id = elem.get("id")
+    for child in elem:
+        tag = child.tag
+        if tag == "infon":
+            annotation.infons[child.get("key")] = child.text
+        elif tag == "location":
+            annotation.locations.append(BioCLocation(int(child.get("offset")), int(child.get("length"))))
+        elif tag == "text":
+            annotation.text = child.text or ""
+    return annotation
+
+
+def append_annotation(builder, elem):
+    infons = {}
+    locations = []
+    text = None
+    for child in elem:
+        tag = child.tag
+        if tag == "infon":
+            infons[child.get("key")] = child.text
+        elif tag == "location":
+            locations.append((int(child.get("offset")), int(child.get("length"))))
+        elif tag == "text":
+            text = child.text or ""
+    builder.append(elem.get("id"), text, infons.items(), locations)
+
+
+def parse_relation(elem):
+    relation = BioCRelation()
+    if "id" in elem.attrib:
+        relation.id = elem.get("id")
+    for child in elem:
+        tag = child.tag
+        if tag == "infon":
+            relation.infons[child.get("key")] = child.text
+        elif tag == "node":
+            relation.nodes.append(BioCNode(child.get("refid"), child.get("role")))
+    return relation
+
+
+def parse_container(elem, container, annotations_only: bool, strings=None):
+    # passages and sentences share their layout
+    builder = annotation_store.AnnotationBuilder(strings) if strings is not None else None
+    for child in elem:
+        tag = child.tag
+        if tag == "annotation":
+            if builder is not None:
+                append_annotation(builder, child)
+            else:
+                container.annotations.append(parse_annotation(child))
+        elif tag == "relation":
+            container.relations.append(parse_relation(child))
+        elif tag == "infon":
+            container.infons[child.get("key")] = child.text
+        elif tag == "offset":
+            container.offset = int(child.text)
+        elif tag == "text":
+            if not annotations_only:
+                container.text = child.text or ""
+        elif tag == "sentence":
+            sentence = BioCSentence()
+            parse_container(child, sentence, annotations_only, strings)
+            container.sentences.append(sentence)
+    if builder is not None:
+        container.annotations = builder.build()
+    return container
+
+
+def parse_document(elem, annotations_only: bool = False, strings=None):
+    document = BioCDocument()
+    for child in elem:
+        tag = child.tag
+        if tag == "passage":
+            document.passages.append(parse_container(child, BioCPassage(), annotations_only, strings))
+        elif tag == "annotation":
+            document.annotations.append(parse_annotation(child))
+        elif tag == "relation":
+            document.relations.append(parse_relation(child))
+        elif tag == "id":
+            document.id = child.text or ""
+        elif tag == "infon":
+            document.infons[child.get("key")] = child.text
+    return document
+
+
+def parse_collection_info(root, collection: BioCCollection):
+    collection.source = root.findtext("source")
+    collection.date = root.findtext("date")
+    collection.key = root.findtext("key")
+    collection.infons = {child.get("key"): child.text for child in root.iterchildren("infon")}
+    docinfo = root.getroottree().docinfo
+    collection.encoding = docinfo.encoding
+    collection.standalone = docinfo.standalone
+    collection.version = docinfo.xml_version
+
+
+def sniff_encoding(source):
+    if hasattr(source, "read"):
+        position = source.tell()
+        head = source.read(256)
+        source.seek(position)
+    else:
+        with open(source, "rb") as f:
+            head = f.read(256)
+    match = XML_DECLARATION.match(head)
+    return match.group(1).decode() if match else "UTF-8"
+
+
+def iterparse(source, annotations_only: bool = False, collection: BioCCollection = None, strings=None):
+    """Yield the documents of a BioC XML file one at a time, dropping each from the tree once parsed.
+
+    With ``annotations_only`` the passage and sentence texts are skipped. When ``collection`` is given, it
+    receives the collection information (source, date, key, infons and XML declaration). With a ``strings``
+    table the passage and sentence annotations are read into ``annotation_store.AnnotationArray`` columns.
+    """
+    # libxml2 only reports the declared encoding once the whole file has been parsed
+    encoding = sniff_encoding(source) if collection is not None else None
+    root = None
+    context = etree.iterparse(source, events=("end",), tag="document")
+    for _, elem in context:
+        if root is None:
+            root = elem.getparent()
+            if collection is not None:
+                parse_collection_info(root, collection)
+                collection.encoding = encoding
+        yield parse_document(elem, annotations_only, strings)
+        elem.clear()
+        while elem.getprevious() is not None:
+            del root[0]
+    if root is None and collection is not None:
+        parse_collection_info(context.root, collection)
+
+
+def load(source, annotations_only: bool = False, strings=None):
+    """Parse a BioC XML file (path or binary file object) into a collection."""
+    collection = BioCCollection()
+    tree = etree.parse(source)
+    root = tree.getroot()
+    parse_collection_info(root, collection)
+    collection.documents = [parse_document(elem, annotations_only, strings) for elem in root.iterchildren("document")]
+    return collection
+
+
+def loads(s: str | bytes, annotations_only: bool = False, strings=None):
+    root = etree.fromstring(s.encode() if isinstance(s, str) else s)
+    collection = BioCCollection()
+    parse_collection_info(root, collection)
+    collection.documents = [parse_document(elem, annotations_only, strings) for elem in root.iterchildren("document")]
+    return collection
+
+
+# writing, byte-identical to bioc.biocxml.dumps with pretty printing
+
+
+def write_element(out: list, indent: str, tag: str, text):
+    if text is None:
+        out.append(f"{indent}<{tag}/>\n")
+    else:
+        out.append(f"{indent}<{tag}>{text.translate(TEXT_ESCAPES)}</{tag}>\n")
+
+
+def write_infons(out: list, indent: str, infons: dict):
+    for key, value in infons.items():
+        key = str(key).translate(ATTRIBUTE_ESCAPES)
+        out.append(f'{indent}<infon key="{key}">{str(value).translate(TEXT_ESCAPES)}</infon>\n')
+
+
+def write_annotation(out: list, indent: str, annotation):
+    out.append(f'{indent}<annotation id="{annotation.id.translate(ATTRIBUTE_ESCAPES)}">\n')
+    child_indent = indent + "  "
+    write_infons(out, child_indent, annotation.infons)
+    for location in annotation.locations:
+        out.append(f'{child_indent}<location offset="{location.offset}" length="{location.length}"/>\n')
+    write_element(out, child_indent, "text", annotation.text)
+    out.append(f"{indent}</annotation>\n")
+
+
+def write_relation(out: list, indent: str, relation):
+    start = f'{indent}<relation id="{relation.id.translate(ATTRIBUTE_ESCAPES)}"'
+    if not relation.infons and not relation.nodes:
+        out.append(f"{start}/>\n")
+        return
+    out.append(f"{start}>\n")
+    child_indent = indent + "  "
+    write_infons(out, child_indent, relation.infons)
+    for node in relation.nodes:
+        out.append(
+            f'{child_indent}<node refid="{node.refid.translate(ATTRIBUTE_ESCAPES)}"'
+            f' role="{node.role.translate(ATTRIBUTE_ESCAPES)}"/>\n'
+        )
+    out.append(f"{indent}</relation>\n")
+
+
+def write_container(out: list, indent: str, tag: str, container, sentences: bool):
+    out.append(f"{indent}<{tag}>\n")
+    child_indent = indent + "  "
+    write_infons(out, child_indent, container.infons)
+    out.append(f"{child_indent}<offset>{container.offset}</offset>\n")
+    if container.text:
+        write_element(out, child_indent, "text", container.text)
+    if sentences:
+        for sentence in container.sentences:
+            write_container(out, child_indent, "sentence", sentence, False)
+    for annotation in container.annotations:
+        write_annotation(out, child_indent, annotation)
+    for relation in container.relations:
+        write_relation(out, child_indent, relation)
+    out.append(f"{indent}</{tag}>\n")
+
+
+def write_document(out: list, indent: str, document):
+    out.append(f"{indent}<document>\n")
+    child_indent = indent + "  "
+    write_element(out, child_indent, "id", document.id)
+    write_infons(out, child_indent, document.infons)
+    for passage in document.passages:
+        write_container(out, child_indent, "passage", passage, True)
+    for annotation in document.annotations:
+        write_annotation(out, child_indent, annotation)
+    for relation in document.relations:
+        write_relation(out, child_indent, relation)
+    out.append(f"{indent}</document>\n")
+
+
+def get_declaration(collection):
+    if collection.standalone is None:
+        return ""
+    standalone = "yes" if collection.standalone else "no"
+    return f"<?xml version='1.0' encoding='{collection.encoding}' standalone='{standalone}'?>\n"
+
+
+def get_collection_info(collection):
+    out = []
+    write_element(out, "  ", "source", collection.source)
+    write_element(out, "  ", "date", collection.date)
+    write_element(out, "  ", "key", collection.key)
+    write_infons(out, "  ", collection.infons)
+    return "".join(out)
+
+
+def dumps_document(document):
+    out = []
+    write_document(out, "  ", document)
+    s = "".join(out)
+    if INVALID_XML_CHARS.search(s):
+        raise ValueError(f"Document {document.id} contains characters that are not allowed in XML")
+    return s
+
+
+def dumps(collection):
+    """Serialize a collection (of these or of bioc objects) exactly like ``bioc.biocxml.dumps``."""
+    if collection.encoding.lower().replace("-", "") != "utf8":
+        raise ValueError(f"Unsupported encoding {collection.encoding}")
+    documents = "".join(dumps_document(document) for document in collection.documents)
+    return f"{get_declaration(collection)}<collection>\n{get_collection_info(collection)}{documents}</collection>\n"
+
+
+def dump(collection, fp):
+    fp.write(dumps(collection))
+
+
+class BioCXMLWriter:
+    """Write a collection one document at a time, producing the same bytes as ``dump`` of the whole collection."""
+
+    def __init__(self, fp, collection):
+        self.fp = fp
+        self.fp.write(f"{get_declaration(collection)}<collection>\n{get_collection_info(collection)}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write_document(self, document):
+        self.fp.write(dumps_document(document))
+
+    def close(self):
+        self.fp.write("</collection>\n")
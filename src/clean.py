@@ -1,33 +1,53 @@
-import glob
+import argparse
 import logging
 from pathlib import Path
 
-from bioc import biocxml
+from lxml import etree
 
-from xml.etree import ElementTree as ET
-from tqdm import tqdm
+import biocio
+from runner import get_max_workers, run_per_file
+
+
+def clean_file(path: Path):
+    pmid = path.stem
+    try:
+        collection = biocio.load(path)
+    except etree.XMLSyntaxError:
+        logging.error(f"Error parsing {path}")
+        path.unlink()
+        raise
+
+    edited = False
+    for document in collection.documents:
+        if not document.id:
+            logging.error(f"Empty id in {path}")
+            document.id = pmid
+            edited = True
+    if edited:
+        tmp_path = path.with_suffix(".bioc.tmp")
+        with open(tmp_path, "w") as f:
+            biocio.dump(collection, f)
+        tmp_path.replace(path)
+        return path
 
 
 def main():
-    for file in tqdm(glob.glob("/data/rgd-knowledge-graph/pubtator3/local/aioner/*.bioc")):
-        path = Path(file)
-        pmid = path.stem
-        try:
-            with open(path, "r") as f:
-                collection = biocxml.load(f)
-        except ET.ParseError:
-            logging.error(f"Error parsing {file}")
-            path.unlink()
-
-        edited = False
-        for document in collection.documents:
-            if not document.id:
-                logging.error(f"Empty id in {file}")
-                document.id = pmid
-                edited = True
-        if edited:
-            with open(path, "w") as f:
-                biocxml.dump(collection, f)
+    parser = argparse.ArgumentParser(description="Remove unparsable AIONER outputs and fill in empty document ids")
+    parser.add_argument(
+        "--aioner_dir", help="AIONER output directory", default="/data/rgd-knowledge-graph/pubtator3/local/aioner/"
+    )
+    parser.add_argument("--max_workers", help="worker processes", type=int, default=get_max_workers())
+    args = parser.parse_args()
+
+    aioner_path = Path(args.aioner_dir)
+    report = run_per_file(
+        clean_file,
+        list(aioner_path.glob("*.bioc")),
+        max_workers=args.max_workers,
+        error_report=aioner_path.parent / "clean_errors.tsv",
+        description="clean",
+    )
+    logging.info(f"Fixed {sum(path is not None for path in report.results)} documents")
 
 
 if __name__ == "__main__":
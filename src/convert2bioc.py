@@ -1,73 +1,95 @@
-import logging
+import argparse
 from pathlib import Path
 
-from bioc import biocxml, pubtator, BioCCollection
+from bioc import pubtator
 from bioc.tools.pubtator2bioc import pubtator2bioc
 
-from tqdm import tqdm
+import biocio
+import merge
+from annotation_store import StringTable
+from ledger import get_pmid
+from runner import get_max_workers, run_per_file
+
+
+def get_bioc_path(pubtator_file: Path, bioc_path: Path):
+    return bioc_path / pubtator_file.name.replace(".pubtator", ".bioc")
+
+
+def convert_file(pubtator_file: Path, merged_path: Path, bioc_path: Path):
+    # the output is the whole merged document with the relations added, so the document has to be read once; it
+    # is read from the document cache when merge wrote one, which avoids parsing XML, and the relations are only
+    # resolved through the entity index
+    pmid = get_pmid(pubtator_file.name)
+    collection = merge.load_merged(merged_path, pmid, StringTable())
+    index = merge.load_entity_index(merge.get_entity_index_path(merged_path, pmid))
+    attach_relations(collection.documents[0], pubtator_file, index)
+    return write_bioc(collection, get_bioc_path(pubtator_file, bioc_path))
+
+
+def resolve_relations(pubtator_file: Path, index: dict):
+    # the BioREx relations between concepts of the document, with their roles set to "type|identifier"
+    with open(pubtator_file) as f:
+        doc = pubtator.load(f)[0]
+
+    doc = pubtator2bioc(doc)
+
+    relations = []
+    for relation in doc.relations:
+        role1 = index.get(relation.nodes[0].refid)
+        role2 = index.get(relation.nodes[1].refid)
+        if role1 is None or role2 is None:
+            continue
+        relation.infons["role1"] = role1
+        relation.infons["role2"] = role2
+        relations.append(relation)
+    return relations
+
+
+def attach_relations(document, pubtator_file: Path, index: dict = None):
+    # replaces the relations of the merged document with the BioREx relations between its concepts
+    if index is None:
+        index = merge.build_entity_index(biocio.BioCCollection.of_documents(document))
+    document.relations = resolve_relations(pubtator_file, index)
+    return document
+
+
+def write_bioc(collection, bioc_file: Path):
+    return write_text(bioc_file, biocio.dumps(collection))
+
+
+def write_text(path: Path, text: str):
+    tmp_path = path.with_suffix(".bioc.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    tmp_path.replace(path)
+    return path
 
 
 def main():
-    local_path = Path("/data/rgd-knowledge-graph/pubtator3/local/")
+    parser = argparse.ArgumentParser(description="Add the BioREx relations to the merged BioC documents")
+    parser.add_argument("--local_dir", help="local directory", default="/data/rgd-knowledge-graph/pubtator3/local/")
+    parser.add_argument("--max_workers", help="worker processes", type=int, default=get_max_workers())
+    args = parser.parse_args()
+
+    local_path = Path(args.local_dir)
     merged_path = local_path / "merged"
     biorex_path = local_path / "biorex"
 
     bioc_path = local_path / "pubtator3"
     bioc_path.mkdir(exist_ok=True)
 
-    pubator_files = list(biorex_path.glob("*.pubtator"))
-
-    for pubtator_file in tqdm(pubator_files):
-        logging.info(f"Converting {pubtator_file}")
-        with open(pubtator_file) as f:
-            doc = pubtator.load(f)[0]
-
-        doc = pubtator2bioc(doc)
-
-        merged_file = merged_path / Path(pubtator_file).name.replace(".pubtator", ".bioc")
-        with open(merged_file, "r") as f:
-            collection = biocxml.load(f)
-        document = collection.documents[0]
-
-        role_lookup = {}
-        for passage in document.passages:
-            for annotation in passage.annotations:
-                role_lookup[annotation.text] = annotation.infons["type"] + "|"
-                if "identifier" in annotation.infons:
-                    identifier = annotation.infons["identifier"]
-                    if identifier == "-":
-                        continue
-                    role_lookup[annotation.text] += identifier
-                    role_lookup[identifier] = annotation.infons["type"] + "|" + identifier
-
-        document.relations = []
-
-        for relation in doc.relations:
-            refid = relation.nodes[0].refid
-            if refid in role_lookup:
-                concept_id = role_lookup[refid]
-            else:
-                continue
-            a, b = concept_id.split("|")
-            if not a or not b:
-                continue
-            relation.infons["role1"] = concept_id
-
-            refid = relation.nodes[1].refid
-            if refid in role_lookup:
-                concept_id = role_lookup[refid]
-            else:
-                continue
-            a, b = concept_id.split("|")
-            if not a or not b:
-                continue
-            relation.infons["role2"] = concept_id
-
-            document.relations.append(relation)
-
-        bioc_file = bioc_path / Path(pubtator_file).name.replace(".pubtator", ".bioc")
-        with open(bioc_file, "w") as f:
-            biocxml.dump(collection, f)
+    run_per_file(
+        convert_file,
+        list(biorex_path.glob("*.pubtator")),
+        args=(merged_path, bioc_path),
+        get_output=lambda pubtator_file: get_bioc_path(pubtator_file, bioc_path),
+        get_dependencies=lambda pubtator_file: [
+            merge.get_merged_base(merged_path, get_pmid(pubtator_file.name)) or pubtator_file
+        ],
+        max_workers=args.max_workers,
+        error_report=local_path / "convert2bioc_errors.tsv",
+        description="convert2bioc",
+    )
 
 
 if __name__ == "__main__":
@@ -1,34 +1,52 @@
-import logging
+import argparse
 from pathlib import Path
 
-from bioc import biocxml
+import biocio
 from bioc2pubtator import bioc2pubtator
+from runner import get_max_workers, run_per_file
 
-from tqdm import tqdm
+
+def get_pubtator_path(bioc_file: Path, pubtator_path: Path):
+    return pubtator_path / bioc_file.name.replace(".bioc", ".pubtator")
+
+
+def convert_file(bioc_file: Path, pubtator_path: Path):
+    return write_pubtator(biocio.load(bioc_file), get_pubtator_path(bioc_file, pubtator_path))
+
+
+def write_pubtator(collection, pubtator_file: Path):
+    assert len(collection.documents) == 1
+    for doc in collection.documents:
+        pubdoc = bioc2pubtator(doc)
+        tmp_path = pubtator_file.with_suffix(".pubtator.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(str(pubdoc))
+        tmp_path.replace(pubtator_file)
+    return pubtator_file
 
 
 def main():
-    local_path = Path("/data/rgd-knowledge-graph/pubtator3/local/")
+    parser = argparse.ArgumentParser(description="Convert the merged BioC documents to PubTator for BioREx")
+    parser.add_argument("--local_dir", help="local directory", default="/data/rgd-knowledge-graph/pubtator3/local/")
+    parser.add_argument("--max_workers", help="worker processes", type=int, default=get_max_workers())
+    args = parser.parse_args()
+
+    local_path = Path(args.local_dir)
     merged_path = local_path / "merged"
     merged_path.mkdir(exist_ok=True)
 
     pubtator_path = local_path / "pubtator"
     pubtator_path.mkdir(exist_ok=True)
 
-    bioc_paths = list(merged_path.glob("*.bioc"))
-
-
-    for bioc_file in tqdm(bioc_paths):
-        logging.info(f"Converting {bioc_file}")
-        with open(bioc_file) as f:
-            collection = biocxml.load(f)
-        pubtator_file = pubtator_path / Path(bioc_file).name.replace(".bioc", ".pubtator")
-
-        assert len(collection.documents) == 1
-        for doc in collection.documents:
-            pubdoc = bioc2pubtator(doc)
-            with open(pubtator_file, "w") as f:
-                f.write(str(pubdoc))
+    run_per_file(
+        convert_file,
+        list(merged_path.glob("*.bioc")),
+        args=(pubtator_path,),
+        get_output=lambda bioc_file: get_pubtator_path(bioc_file, pubtator_path),
+        max_workers=args.max_workers,
+        error_report=local_path / "convert2pubtator_errors.tsv",
+        description="convert2pubtator",
+    )
 
 
 if __name__ == "__main__":
@@ -1,71 +1,97 @@
+import argparse
 import logging
-import pandas as pd
-import bioc
-
+from contextlib import contextmanager
+from functools import partial
 from pathlib import Path
-from tqdm import tqdm
+
+import numpy as np
+
+import biocio
+from annotation_store import StringTable, as_annotation_array, get_string_table
+from dataset import DatasetWriter, read_dataset_pmids
+from emitter import emit_document
+from ledger import Ledger, get_pmid, get_stage
+from runner import get_max_workers, run_per_file
 
 
-def process_document_from_pubtator3_local(local_bioconcepts2pubtator3_path, local_relation2pubtator3_path, document):
+def process_document_from_pubtator3_local(
+    local_bioconcepts2pubtator3_path,
+    local_relation2pubtator3_path,
+    document,
+    bioconcepts_writer: DatasetWriter = None,
+    relation_writer: DatasetWriter = None,
+):
     pmid = document.id
-    annotations = []
-    for passage in document.passages:
-        for annotation in passage.annotations:
-            annotations.append(
-                {
-                    "PMID": pmid,
-                    "Type": annotation.infons["type"],
-                    "Concept ID": annotation.infons.get("identifier"),
-                    "Mentions": annotation.text,
-                    "Resource": "PubTator3",
-                }
-            )
-    if not annotations:
-        (local_bioconcepts2pubtator3_path / f"{pmid}.tsv").touch()
-        return
-    annotation_df = pd.DataFrame(annotations)
-    annotation_df = (
-        annotation_df.groupby(["PMID", "Type", "Concept ID", "Resource"])["Mentions"]
-        .apply(lambda x: "|".join(set(x)))
-        .reset_index()
+    strings = get_string_table(document.passages)
+    return emit_document(
+        local_bioconcepts2pubtator3_path / f"{pmid}.tsv",
+        local_relation2pubtator3_path / f"{pmid}.tsv",
+        pmid,
+        [(pmid, as_annotation_array(passage, strings)) for passage in document.passages],
+        document.relations,
+        bioconcepts_writer,
+        relation_writer,
     )
-    annotation_df.to_csv(local_bioconcepts2pubtator3_path / f"{pmid}.tsv", sep="\t", index=False)
-    relations = []
-    relation_type_map = {
-        "Association": "associate",
-        "Bind": "interact",
-        "Cause": "cause",
-        "Comparison": "compare",
-        "Cotreatment": "cotreat",
-        "Drug_Interaction": "drug_interact",
-        "Inhibit": "inhibit",
-        "Interact": "interact",
-        "Negative_Correlation": "negative_correlate",
-        "Positive_Correlation": "positive_correlate",
-        "Prevent": "prevent",
-        "Stimulate": "stimulate",
-        "Treatment": "treat",
-    }
-    for relation in document.relations:
-        try:
-            relations.append(
-                {
-                    "PMID": pmid,
-                    "Type": relation_type_map[relation.infons["type"]],
-                    "1st": relation.infons["role1"],
-                    "2nd": relation.infons["role2"],
-                }
-            )
-        except KeyError as e:
-            logging.error(pmid)
-            raise e
-    if not relations:
-        return
-    df = pd.DataFrame(relations)
-    df.to_csv(local_relation2pubtator3_path / f"{pmid}.tsv", sep="\t", index=False)
+
+
+@contextmanager
+def open_dataset_writers(dataset_dir: Path):
+    # one pair of writers per chunk of files, each writing its own part files
+    writers = (
+        DatasetWriter(dataset_dir, "bioconcepts2pubtator3", "local"),
+        DatasetWriter(dataset_dir, "relation2pubtator3", "local"),
+    )
+    try:
+        yield writers
+    finally:
+        for writer in writers:
+            writer.close()
+
+
+def get_pending_dataset_files(paths: list, dataset_dir: Path):
+    # the dataset is only appended to, so the files of PMIDs already in it are skipped like up to date TSVs
+    in_dataset = read_dataset_pmids(dataset_dir, "bioconcepts2pubtator3", ["local"])
+    pmids = np.array([-1 if (pmid := get_pmid(path.name)) is None else pmid for path in paths], dtype=np.int64)
+    pending = [path for path, done in zip(paths, in_dataset.isin(pmids)) if not done]
+    logging.info(f"Skipped {len(paths) - len(pending)} files already in {dataset_dir}")
+    return pending
+
+
+def convert_file(bioc_file: Path, local_bioconcepts2pubtator3_path, local_relation2pubtator3_path, writers=()):
+    # only annotations and relations are converted, so the passage texts are not kept
+    return [
+        process_document_from_pubtator3_local(
+            local_bioconcepts2pubtator3_path, local_relation2pubtator3_path, document, *writers
+        )
+        for document in biocio.iterparse(bioc_file, annotations_only=True, strings=StringTable())
+    ]
+
+
+def record_outputs(ledger_path: Path, local_bioconcepts2pubtator3_path, local_relation2pubtator3_path, results):
+    stages = (get_stage(local_bioconcepts2pubtator3_path), get_stage(local_relation2pubtator3_path))
+    records = [record for file_records in results for record in file_records]
+    with Ledger(ledger_path) as ledger:
+        for stage, stage_records in zip(stages, zip(*records)):
+            ledger.record(stage, [record for record in stage_records if record[1] is not None])
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--output_format",
+        help="per-PMID TSV files or a partitioned Parquet dataset",
+        choices=["tsv", "parquet"],
+        default="tsv",
+    )
+    parser.add_argument(
+        "--dataset_dir", help="dataset directory", default="/data/rgd-knowledge-graph/pubtator3/dataset"
+    )
+    parser.add_argument(
+        "--ledger", help="per-PMID stage ledger", default="/data/rgd-knowledge-graph/pubtator3/ledger.sqlite"
+    )
+    parser.add_argument("--max_workers", help="worker processes", type=int, default=get_max_workers())
+    args = parser.parse_args()
+
     local_pubtator3_path = Path("/data/rgd-knowledge-graph/pubtator3/local/pubtator3")
     local_bioconcepts2pubtator3_path = Path("/data/rgd-knowledge-graph/pubtator3/local/bioconcepts2pubtator3")
     local_bioconcepts2pubtator3_path.mkdir(exist_ok=True)
@@ -74,11 +100,21 @@ def main():
 
     local_pubtator3_files = list(local_pubtator3_path.glob("*.bioc"))
 
-    for bioc_file in tqdm(local_pubtator3_files):
-        with open(bioc_file) as f:
-            collection = bioc.load(f)
-            for document in collection.documents:
-                process_document_from_pubtator3_local(local_bioconcepts2pubtator3_path, local_relation2pubtator3_path, document)
+    parquet = args.output_format == "parquet"
+    if parquet:
+        local_pubtator3_files = get_pending_dataset_files(local_pubtator3_files, args.dataset_dir)
+    report = run_per_file(
+        convert_file,
+        local_pubtator3_files,
+        args=(local_bioconcepts2pubtator3_path, local_relation2pubtator3_path),
+        get_output=None if parquet else lambda bioc_file: local_bioconcepts2pubtator3_path / f"{bioc_file.stem}.tsv",
+        open_chunk=partial(open_dataset_writers, args.dataset_dir) if parquet else None,
+        max_workers=args.max_workers,
+        error_report=local_pubtator3_path.parent / "convert2tsv_errors.tsv",
+        description="convert2tsv",
+    )
+    if not parquet:
+        record_outputs(args.ledger, local_bioconcepts2pubtator3_path, local_relation2pubtator3_path, report.results)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+import os
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from pmidset import PMIDSet
+
+SCHEMAS = {
+    "bioconcepts2pubtator3": pa.schema(
+        [
+            ("PMID", pa.uint32()),
+            ("Type", pa.string()),
+            ("Concept ID", pa.string()),
+            ("Mentions", pa.string()),
+            ("Resource", pa.string()),
+        ]
+    ),
+    "relation2pubtator3": pa.schema(
+        [
+            ("PMID", pa.uint32()),
+            ("Type", pa.string()),
+            ("1st", pa.string()),
+            ("2nd", pa.string()),
+        ]
+    ),
+}
+PARTITIONING = ds.partitioning(pa.schema([("source", pa.string()), ("pmid_bucket", pa.uint32())]), flavor="hive")
+PMID_BUCKET_SIZE = 1_000_000
+
+
+class DatasetWriter:
+    # rows are buffered and appended as row groups to one part file per PMID bucket; part files are
+    # hidden until close() so readers never see a partially written file
+    def __init__(self, root: Path, table: str, source: str, row_group_size: int = 100_000):
+        self.root = Path(root)
+        self.table = table
+        self.source = source
+        self.schema = SCHEMAS[table]
+        self.row_group_size = row_group_size
+        self.columns = {name: [] for name in self.schema.names}
+        self.writers = {}
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write_rows(self, rows):
+        width = len(self.columns)
+        for row in rows:
+            row = list(row)
+            row[0] = int(row[0])
+            row += [None] * (width - len(row))
+            for column, value in zip(self.columns.values(), row):
+                column.append(value)
+            self.rows += 1
+        if self.rows >= self.row_group_size:
+            self.flush()
+
+    def write_lines(self, data: bytes):
+        self.write_rows([value or None for value in line.split("\t")] for line in data.decode().splitlines())
+
+    def write_df(self, df: pd.DataFrame):
+        df = df.reindex(columns=self.schema.names)
+        self.write_rows(df.astype(object).where(df.notnull(), None).itertuples(index=False))
+
+    def write_empty(self, pmid: int):
+        # marks a PMID as processed without contributing any annotations
+        self.write_rows([[pmid] + [None] * (len(self.schema) - 1)])
+
+    def flush(self):
+        if not self.rows:
+            return
+        table = pa.table(self.columns, schema=self.schema)
+        self.columns = {name: [] for name in self.schema.names}
+        self.rows = 0
+        buckets = table["PMID"].to_numpy() // PMID_BUCKET_SIZE
+        for bucket in np.unique(buckets):
+            bucket_table = table.filter(buckets == bucket)
+            self.get_writer(int(bucket)).write_table(bucket_table, row_group_size=self.row_group_size)
+
+    def get_writer(self, bucket: int):
+        if bucket not in self.writers:
+            partition_path = self.root / self.table / f"source={self.source}" / f"pmid_bucket={bucket}"
+            partition_path.mkdir(parents=True, exist_ok=True)
+            path = partition_path / f".part-{uuid.uuid4().hex}.parquet"
+            self.writers[bucket] = (path, pq.ParquetWriter(path, self.schema))
+        return self.writers[bucket][1]
+
+    def close(self):
+        self.flush()
+        for path, writer in self.writers.values():
+            writer.close()
+            os.replace(path, path.with_name(path.name[1:]))
+        self.writers = {}
+
+
+def get_dataset(root: Path, table: str):
+    path = Path(root) / table
+    path.mkdir(parents=True, exist_ok=True)
+    schema = pa.unify_schemas([SCHEMAS[table], PARTITIONING.schema])
+    return ds.dataset(path, schema=schema, format="parquet", partitioning=PARTITIONING)
+
+
+def get_filter(sources: list[str] = None, pmids=None, buckets: list[int] = None):
+    expression = ds.field("Type").is_valid()
+    if sources is not None:
+        expression &= ds.field("source").isin(sources)
+    if buckets is not None:
+        expression &= ds.field("pmid_bucket").isin(pa.array(buckets, pa.uint32()))
+    if pmids is not None:
+        pmids = np.asarray(PMIDSet(pmids))
+        buckets = np.unique(pmids // PMID_BUCKET_SIZE)
+        expression &= ds.field("pmid_bucket").isin(pa.array(buckets, pa.uint32()))
+        expression &= ds.field("PMID").isin(pa.array(pmids, pa.uint32()))
+    return expression
+
+
+def read_dataset(root: Path, table: str, sources: list[str] = None, pmids=None, columns: list[str] = None):
+    dataset = get_dataset(root, table)
+    columns = columns or SCHEMAS[table].names
+    return dataset.to_table(columns=columns, filter=get_filter(sources, pmids)).to_pandas()
+
+
+def iter_dataset_batches(
+    root: Path,
+    table: str,
+    sources: list[str] = None,
+    pmids=None,
+    columns: list[str] = None,
+    batch_size: int = 10**6,
+    buckets: list[int] = None,
+):
+    dataset = get_dataset(root, table)
+    columns = columns or SCHEMAS[table].names
+    expression = get_filter(sources, pmids, buckets)
+    for record_batch in dataset.to_batches(columns=columns, filter=expression, batch_size=batch_size):
+        if record_batch.num_rows:
+            yield record_batch.to_pandas()
+
+
+def get_partitions(root: Path, table: str):
+    # the (source, pmid_bucket) partitions of a table, every row of a PMID is in one of them
+    partitions = []
+    for source_path in sorted((Path(root) / table).glob("source=*")):
+        buckets = [int(path.name.split("=", 1)[1]) for path in source_path.glob("pmid_bucket=*")]
+        partitions.extend((source_path.name.split("=", 1)[1], bucket) for bucket in sorted(buckets))
+    return partitions
+
+
+def read_dataset_pmids(root: Path, table: str, sources: list[str] = None):
+    dataset = get_dataset(root, table)
+    expression = ds.field("source").isin(sources) if sources is not None else None
+    pmids = dataset.to_table(columns=["PMID"], filter=expression)["PMID"].to_numpy()
+    return PMIDSet(pmids)
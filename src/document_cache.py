@@ -0,0 +1,50 @@
+import os
+import pickle
+from pathlib import Path
+
+from annotation_store import AnnotationArray, StringTable
+
+
+def iter_containers(collection):
+    for document in collection.documents:
+        for passage in document.passages:
+            yield passage
+            yield from passage.sentences
+
+
+def dumps(collection):
+    # the annotation arrays are stored with a table of only the strings this collection uses
+    strings = StringTable()
+    annotations = []
+    for container in iter_containers(collection):
+        annotations.append(container.annotations)
+        if isinstance(container.annotations, AnnotationArray):
+            container.annotations = container.annotations.reintern(strings)
+    try:
+        return pickle.dumps(collection, protocol=pickle.HIGHEST_PROTOCOL)
+    finally:
+        for container, container_annotations in zip(iter_containers(collection), annotations):
+            container.annotations = container_annotations
+
+
+def loads(data: bytes, strings: StringTable = None):
+    """Load a collection written by ``dump``, with its annotation arrays moved to ``strings`` if given."""
+    collection = pickle.loads(data)
+    if strings is not None:
+        for container in iter_containers(collection):
+            if isinstance(container.annotations, AnnotationArray):
+                container.annotations = container.annotations.reintern(strings)
+    return collection
+
+
+def dump(collection, path: Path):
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(dumps(collection))
+    os.replace(tmp_path, path)
+
+
+def load(path: Path, strings: StringTable = None):
+    with open(path, "rb") as f:
+        return loads(f.read(), strings)
@@ -0,0 +1,100 @@
+import csv
+import logging
+from pathlib import Path
+
+BIOCONCEPTS_HEADER = ("PMID", "Type", "Concept ID", "Resource", "Mentions")
+RELATION_HEADER = ("PMID", "Type", "1st", "2nd")
+RESOURCE = "PubTator3"
+RELATION_TYPE_MAP = {
+    "Association": "associate",
+    "Bind": "interact",
+    "Cause": "cause",
+    "Comparison": "compare",
+    "Cotreatment": "cotreat",
+    "Drug_Interaction": "drug_interact",
+    "Inhibit": "inhibit",
+    "Interact": "interact",
+    "Negative_Correlation": "negative_correlate",
+    "Positive_Correlation": "positive_correlate",
+    "Prevent": "prevent",
+    "Stimulate": "stimulate",
+    "Treatment": "treat",
+}
+
+
+def aggregate_mentions(segments):
+    """Group the annotations of ``(pmid, AnnotationArray)`` segments into bioconcepts rows.
+
+    Rows are sorted by PMID, type and concept ID and hold the distinct mention texts in first-seen order;
+    annotations without a type or concept ID are dropped, like the pandas groupby this replaces.
+    """
+    groups = {}
+    for pmid, annotations in segments:
+        values = annotations.strings.values
+        records = annotations.records
+        for type, identifier, text in zip(
+            records["type"].tolist(), records["identifier"].tolist(), records["text"].tolist()
+        ):
+            # ids below 1 are a missing infon or None
+            if type > 0 and identifier > 0 and text > 0:
+                groups.setdefault((pmid, values[type], values[identifier]), {})[values[text]] = None
+    return [
+        (pmid, type, identifier, RESOURCE, "|".join(mentions))
+        for (pmid, type, identifier), mentions in sorted(groups.items())
+    ]
+
+
+def get_relation_rows(pmid, relations):
+    rows = []
+    for relation in relations:
+        try:
+            infons = relation.infons
+            rows.append((pmid, RELATION_TYPE_MAP[infons["type"]], infons["role1"], infons["role2"]))
+        except KeyError as e:
+            logging.error(pmid)
+            raise e
+    return rows
+
+
+def write_tsv(path: Path, header: tuple, rows: list):
+    # the dialect pandas.DataFrame.to_csv(sep="\t", index=False) writes, in a single write call
+    with open(path, "w", newline="", encoding="utf-8", buffering=2**16) as f:
+        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def emit_document(
+    bioconcepts_path: Path,
+    relation_path: Path,
+    pmid,
+    segments: list,
+    relations,
+    bioconcepts_writer=None,
+    relation_writer=None,
+):
+    """Write the bioconcepts and relation rows of one document and return its ledger records.
+
+    Rows go to the per-PMID TSV files, or to the dataset writers if given, which batch the rows of all documents
+    of a chunk into one part file.
+    """
+    if not any(len(annotations) for _, annotations in segments):
+        if bioconcepts_writer is not None:
+            bioconcepts_writer.write_empty(pmid)
+        else:
+            bioconcepts_path.touch()
+        return (pmid, bioconcepts_path, None), (pmid, None, None)
+    rows = aggregate_mentions(segments)
+    if bioconcepts_writer is not None:
+        # the dataset schema has the mentions before the resource
+        bioconcepts_writer.write_rows((row[0], row[1], row[2], row[4], row[3]) for row in rows)
+    else:
+        write_tsv(bioconcepts_path, BIOCONCEPTS_HEADER, rows)
+    rows = get_relation_rows(pmid, relations)
+    if not rows:
+        return (pmid, bioconcepts_path, None), (pmid, None, None)
+    if relation_writer is not None:
+        relation_writer.write_rows(rows)
+    else:
+        write_tsv(relation_path, RELATION_HEADER, rows)
+    return (pmid, bioconcepts_path, None), (pmid, relation_path, None)
@@ -0,0 +1,130 @@
+import argparse
+from functools import partial
+from pathlib import Path
+
+import merge
+from annotation_store import StringTable
+from convert2bioc import attach_relations, get_bioc_path, write_bioc
+from convert2pubtator import write_pubtator
+from convert2tsv import (
+    get_pending_dataset_files,
+    open_dataset_writers,
+    process_document_from_pubtator3_local,
+    record_outputs,
+)
+from ledger import get_pmid
+from runner import get_max_workers, run_per_file
+
+# the post-NER stages without the BioC XML round trips between them: `export` merges the tool outputs into the
+# binary document cache and writes the PubTator input of BioREx straight from the merged documents, `finish`
+# attaches the BioREx relations to the cached documents and emits the TSVs; BioC XML is only written on request
+
+
+def get_pubtator_path(pubtator_path: Path, pmid: int):
+    return pubtator_path / f"{pmid}.pubtator"
+
+
+def export_pubtator(pubtator_path: Path, pmid: int, collection):
+    write_pubtator(collection, get_pubtator_path(pubtator_path, pmid))
+
+
+def finish_file(
+    pubtator_file: Path,
+    merged_path: Path,
+    bioc_path: Path,
+    local_bioconcepts2pubtator3_path: Path,
+    local_relation2pubtator3_path: Path,
+    writers=(),
+):
+    pmid = get_pmid(pubtator_file.name)
+    collection = merge.load_merged(merged_path, pmid, StringTable())
+    index = merge.load_entity_index(merge.get_entity_index_path(merged_path, pmid))
+    document = attach_relations(collection.documents[0], pubtator_file, index)
+    if bioc_path is not None:
+        write_bioc(collection, get_bioc_path(pubtator_file, bioc_path))
+    return [
+        process_document_from_pubtator3_local(
+            local_bioconcepts2pubtator3_path, local_relation2pubtator3_path, document, *writers
+        )
+    ]
+
+
+def export(args):
+    pubtator_path = Path(args.local_dir) / "pubtator"
+    pubtator_path.mkdir(exist_ok=True)
+    # a PMID whose BioREx input is missing is merged again even if its merged document is up to date
+    merge.run(
+        args,
+        export=partial(export_pubtator, pubtator_path),
+        export_path=partial(get_pubtator_path, pubtator_path),
+    )
+
+
+def finish(args):
+    local_path = Path(args.local_dir)
+    merged_path = local_path / "merged"
+    bioc_path = local_path / "pubtator3" if args.write_xml else None
+    if bioc_path is not None:
+        bioc_path.mkdir(exist_ok=True)
+    local_bioconcepts2pubtator3_path = local_path / "bioconcepts2pubtator3"
+    local_bioconcepts2pubtator3_path.mkdir(exist_ok=True)
+    local_relation2pubtator3_path = local_path / "relation2pubtator3"
+    local_relation2pubtator3_path.mkdir(exist_ok=True)
+
+    parquet = args.output_format == "parquet"
+    pubtator_files = list((local_path / "biorex").glob("*.pubtator"))
+    if parquet:
+        pubtator_files = get_pending_dataset_files(pubtator_files, args.dataset_dir)
+    report = run_per_file(
+        finish_file,
+        pubtator_files,
+        args=(merged_path, bioc_path, local_bioconcepts2pubtator3_path, local_relation2pubtator3_path),
+        get_output=None if parquet else lambda path: local_bioconcepts2pubtator3_path / f"{get_pmid(path.name)}.tsv",
+        get_dependencies=lambda path: [merge.get_merged_base(merged_path, get_pmid(path.name)) or path],
+        open_chunk=partial(open_dataset_writers, args.dataset_dir) if parquet else None,
+        max_workers=args.max_workers,
+        error_report=local_path / "finish_errors.tsv",
+        description="finish",
+    )
+    if not parquet:
+        record_outputs(args.ledger, local_bioconcepts2pubtator3_path, local_relation2pubtator3_path, report.results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the post-NER stages without intermediate BioC XML")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    # export takes the merge arguments, with the merged documents only going to the document cache by default
+    export_parser = subparsers.add_parser(
+        "export", parents=[merge.get_parser()], add_help=False, help="merge and write the BioREx input"
+    )
+    export_parser.set_defaults(function=export, output="cache")
+
+    finish_parser = subparsers.add_parser("finish", help="attach the BioREx relations and write the TSVs")
+    finish_parser.add_argument(
+        "--local_dir", help="local directory", default="/data/rgd-knowledge-graph/pubtator3/local/"
+    )
+    finish_parser.add_argument("--max_workers", help="worker processes", type=int, default=get_max_workers())
+    finish_parser.add_argument(
+        "--write_xml", help="also write the BioC XML with relations to pubtator3/ for debugging", action="store_true"
+    )
+    finish_parser.add_argument(
+        "--output_format",
+        help="per-PMID TSV files or a partitioned Parquet dataset",
+        choices=["tsv", "parquet"],
+        default="tsv",
+    )
+    finish_parser.add_argument(
+        "--dataset_dir", help="dataset directory", default="/data/rgd-knowledge-graph/pubtator3/dataset"
+    )
+    finish_parser.add_argument(
+        "--ledger", help="per-PMID stage ledger", default="/data/rgd-knowledge-graph/pubtator3/ledger.sqlite"
+    )
+    finish_parser.set_defaults(function=finish)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import random
+import time
+
+import neo4j
+import numpy as np
+import pandas as pd
+from neo4j.exceptions import DriverError, Neo4jError
+
+
+def unwind_rows(columns: list[str]):
+    # the batch is sent as one list per column and rebuilt into rows on the server, so neither side holds a
+    # dict per row until the statement runs
+    fields = ", ".join(f"`{column}`: $batch['{column}'][i]" for column in columns)
+    return f"UNWIND range(0, size($batch['{columns[0]}']) - 1) AS i\nWITH {{{fields}}} AS row"
+
+
+def iter_columnar_batches(df: pd.DataFrame, columns: list[str], batch_size: int, rows: np.ndarray = None):
+    arrays = [df[column].to_numpy(dtype=object) for column in columns]
+    if rows is not None:
+        arrays = [values[rows] for values in arrays]
+    for start in range(0, len(arrays[0]) if arrays else 0, batch_size):
+        batch = {}
+        for column, values in zip(columns, arrays):
+            values = values[start : start + batch_size]
+            batch[column] = np.where(pd.isna(values), None, values).tolist()
+        yield batch
+
+
+def get_node_buckets(df: pd.DataFrame, type_column: str, id_column: str, buckets: int):
+    keys = (df[type_column].astype(str) + "|" + df[id_column].astype(str)).to_numpy(dtype=object)
+    return (pd.util.hash_array(keys) % np.uint64(buckets)).astype(np.intp)
+
+
+def get_rounds(buckets: int):
+    """Schedule the pairs of an even number of node buckets into rounds in which no bucket occurs twice.
+
+    Returns the round and the slot within it of every bucket pair as two symmetric lookup arrays. Pairs of
+    different buckets are paired round-robin over ``buckets - 1`` rounds, a bucket with itself is in the last round.
+    """
+    rounds = np.zeros((buckets, buckets), dtype=np.intp)
+    slots = np.zeros((buckets, buckets), dtype=np.intp)
+    others = list(range(1, buckets))
+    for round_index in range(buckets - 1):
+        order = [0, *others]
+        for slot in range(buckets // 2):
+            i, j = order[slot], order[buckets - 1 - slot]
+            rounds[i, j] = rounds[j, i] = round_index
+            slots[i, j] = slots[j, i] = slot
+        others = others[-1:] + others[:-1]
+    for i in range(buckets):
+        rounds[i, i] = buckets - 1
+        slots[i, i] = i
+    return rounds, slots
+
+
+async def run_all(coroutines: list, concurrency: int):
+    # like asyncio.gather, but at most concurrency at a time and the others are cancelled when one fails
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    tasks = [asyncio.create_task(run(coroutine)) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def is_retryable(error: Exception):
+    return isinstance(error, (DriverError, Neo4jError)) and error.is_retryable()
+
+
+def get_retry_delay(attempt: int, backoff: float):
+    return backoff * 2**attempt * (1 + random.random())
+
+
+class BatchWriter:
+    """Streams a frame to Neo4j as fixed-size ``UNWIND`` batches, each in its own transaction.
+
+    Up to ``concurrency`` batches are in flight on their own sessions while the next one is prepared, so memory
+    on both sides is bounded by the batch size rather than by the frame. Batches failing with a retryable error,
+    e.g. a deadlock or a lost connection, are retried with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        driver: neo4j.AsyncDriver,
+        database: str = None,
+        batch_size: int = 10000,
+        concurrency: int = 1,
+        retries: int = 5,
+        backoff: float = 1.0,
+        log_interval: float = 30.0,
+    ):
+        self.driver = driver
+        self.database = database
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.log_interval = log_interval
+
+    async def run_batch(self, query: str, batch: dict, size: int):
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.driver.session(database=self.database) as session:
+                    result = await session.run(query, batch=batch)
+                    await result.consume()
+                return size
+            except Exception as e:
+                if attempt == self.retries or not is_retryable(e):
+                    raise
+                delay = get_retry_delay(attempt, self.backoff)
+                logging.warning(f"Retrying batch in {delay:.1f}s after {type(e).__name__}: {e}")
+                await asyncio.sleep(delay)
+
+    async def write(self, query: str, df: pd.DataFrame, columns: list[str] = None, description: str = "rows"):
+        """Run ``query`` for every row of ``df``, which it refers to as ``row`` with the given columns."""
+        columns = list(columns or df.columns)
+        query = f"{unwind_rows(columns)}\n{query}"
+        start = last_log = time.perf_counter()
+        written = 0
+        pending = set()
+        try:
+            for batch in iter_columnar_batches(df, columns, self.batch_size):
+                while len(pending) >= self.concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        written += task.result()
+                pending.add(asyncio.create_task(self.run_batch(query, batch, len(batch[columns[0]]))))
+                if time.perf_counter() - last_log >= self.log_interval:
+                    last_log = time.perf_counter()
+                    logging.info(f"{description}: {written}/{len(df)} written, {written / (last_log - start):.0f}/s")
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    written += task.result()
+        finally:
+            # a failed batch stops the batches still in flight
+            for task in pending:
+                task.cancel()
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        logging.info(f"{description}: wrote {written} in {elapsed:.1f}s, {written / elapsed:.0f}/s")
+        return written
+
+    async def write_rows(self, jobs: list):
+        # (query, df, columns, rows) jobs written one batch after another
+        written = 0
+        for query, df, columns, rows in jobs:
+            query = f"{unwind_rows(columns)}\n{query}"
+            for batch in iter_columnar_batches(df, columns, self.batch_size, rows):
+                written += await self.run_batch(query, batch, len(batch[columns[0]]))
+        return written
+
+    async def write_disjoint(self, jobs: list, start: tuple, end: tuple, description: str = "relationships"):
+        """Write relationship ``jobs`` of (query, df, columns) concurrently without two transactions locking a node.
+
+        ``start`` and ``end`` are the (type, concept ID) columns of the endpoints, which are hashed into twice
+        ``concurrency`` buckets. The relationships of a pair of buckets form one slot of a round in which every
+        bucket occurs once, so the slots of a round touch disjoint nodes and run concurrently, each on its own
+        session one batch at a time; the rounds run one after another.
+        """
+        buckets = 2 * self.concurrency
+        rounds, slots = get_rounds(buckets)
+        schedule = [[[] for _ in range(buckets)] for _ in range(buckets)]
+        for query, df, columns in jobs:
+            start_buckets = get_node_buckets(df, *start, buckets)
+            end_buckets = get_node_buckets(df, *end, buckets)
+            keys = rounds[start_buckets, end_buckets] * buckets + slots[start_buckets, end_buckets]
+            order = np.argsort(keys, kind="stable")
+            bounds = np.flatnonzero(np.diff(keys[order])) + 1
+            for rows in np.split(order, bounds) if len(order) else []:
+                round_index, slot = divmod(int(keys[rows[0]]), buckets)
+                schedule[round_index][slot].append((query, df, columns, rows))
+
+        start_time = time.perf_counter()
+        written = 0
+        total = sum(len(df) for _, df, _ in jobs)
+        for round_index, round_slots in enumerate(schedule):
+            coroutines = [self.write_rows(slot_jobs) for slot_jobs in round_slots if slot_jobs]
+            written += sum(await run_all(coroutines, self.concurrency))
+            rate = written / max(time.perf_counter() - start_time, 1e-9)
+            logging.info(f"{description}: round {round_index + 1}/{buckets}, {written}/{total} written, {rate:.0f}/s")
+        return written
@@ -1,12 +1,12 @@
 import argparse
 import asyncio
 import csv
-import glob
 import gzip
 import itertools
 import json
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
@@ -17,74 +17,166 @@ import pandas as pd
 from tqdm import tqdm
 from tqdm.contrib.concurrent import process_map
 
+from dataset import get_partitions, iter_dataset_batches
+from graph_writer import BatchWriter
+from ledger import Ledger, get_stage
+from pmidset import PMIDSet
+from runner import get_max_workers
+from spill import SpillAggregator
+
+AGG_BIOCONCEPTS_PATH = Path("/data/rgd-knowledge-graph/aggbioconcepts2pubtator3.tsv")
+AGG_RELATION_PATH = Path("/data/rgd-knowledge-graph/aggrelation2pubtator3.tsv")
+
 
 def get_relation_df(file: str):
     df = pd.read_csv(file, sep="\t")
     try:
-        df[["1st Type", "1st Concept ID"]] = df["1st"].str.split("|", n=1, expand=True)
-        df[["2nd Type", "2nd Concept ID"]] = df["2nd"].str.split("|", n=1, expand=True)
+        return split_relation_roles(df)
     except ValueError:
         logging.exception(f"Error parsing {file}")
         return pd.DataFrame()
+
+
+def split_relation_roles(df: pd.DataFrame):
+    df[["1st Type", "1st Concept ID"]] = df["1st"].str.split("|", n=1, expand=True)
+    df[["2nd Type", "2nd Concept ID"]] = df["2nd"].str.split("|", n=1, expand=True)
     df.drop(columns=["1st", "2nd"], inplace=True)
     return df
 
 
-async def run_relation_queries(session: neo4j.AsyncSession, input_dirs: list[str]):
+def get_dataset_source(source: str):
+    # the rows read from the Parquet dataset are tracked by its source partition, the TSV files by their ledger stage
+    return f"dataset/{source}"
+
+
+def get_dataset_sources(input_dataset: str, table: str):
+    if not input_dataset or not Path(input_dataset).exists():
+        return []
+    return sorted({get_dataset_source(source) for source, _ in get_partitions(input_dataset, table)})
+
+
+def spill_dataset(aggregator: SpillAggregator, input_dataset: str, table: str, prepare):
+    # the rows of a PMID can span record batches and part files, but not PMID buckets, so the PMIDs of a
+    # bucket are only committed once all of its rows have been added; rows added again after a crash are
+    # harmless since the aggregation is idempotent
+    if not input_dataset or not Path(input_dataset).exists():
+        return
+    for source, bucket in tqdm(get_partitions(input_dataset, table)):
+        ingested = aggregator.get_pmids(get_dataset_source(source))
+        pmids = []
+        for df in iter_dataset_batches(input_dataset, table, [source], buckets=[bucket]):
+            df = df[~ingested.isin(df["PMID"].to_numpy())]
+            if len(df):
+                pmids.append(df["PMID"].to_numpy())
+                aggregator.add(prepare(df.astype({"PMID": str})), {})
+        if pmids:
+            aggregator.add(pd.DataFrame(), {get_dataset_source(source): np.concatenate(pmids)})
+
+
+def get_pending_files(ledger: Ledger, input_dirs: list[str], aggregator: SpillAggregator):
+    # the PMIDs of every input stage minus the ones already aggregated from it, as (stage, pmid, path); the
+    # directories are written by other processes, so the ones that changed since the last run are listed again
     files = []
     for input_dir in input_dirs:
-        for file in glob.glob(f"{input_dir}/*.tsv"):
-            files.append(file)
+        stage = get_stage(input_dir)
+        ledger.sync_dir(stage, input_dir, ".tsv")
+        pending = ledger.pmids(stage) - aggregator.get_pmids(stage)
+        logging.info(f"{stage}: {len(pending)} PMIDs not ingested yet")
+        if len(pending):
+            files.extend((stage, pmid, path) for pmid, path in ledger.files(stage, pending))
+    return files
+
+
+def get_aggregator(path: Path, keys: list[str], aggregate, memory_budget: int, sources: list[str]):
+    aggregator = SpillAggregator(path.with_suffix(".spill"), keys, aggregate, memory_budget)
+    if aggregator.batch == 0 and path.exists():
+        # an aggregate TSV written before the spill runs existed seeds them, its PMIDs count as ingested from
+        # every source like the file name check that used to skip them
+        logging.info(f"Seeding {aggregator.root} from {path}")
+        for df in pd.read_csv(path, sep="\t", dtype=str, chunksize=10**6):
+            pmids = pd.to_numeric(df["PMID"].dropna().str.split("|").explode().str.strip(), errors="coerce")
+            pmids = PMIDSet(pmids.dropna().to_numpy())
+            aggregator.add(df, {source: pmids for source in sources})
+    return aggregator
+
+
+def spill_files(aggregator: SpillAggregator, files: list[tuple], load, chunk_size: int = 10000):
+    # files are loaded chunk by chunk and spilled as one batch whenever the rows reach the batch size, so
+    # at most one batch and one chunk of rows are held in memory
+    logging.info(f"Processing {len(files)} files")
+    pending = []
+    pending_pmids = {}
+    pending_bytes = 0
+    with ProcessPoolExecutor(get_max_workers()) as executor:
+        for files_batch in tqdm(batch(files, n=chunk_size), total=len(files) // chunk_size + 1):
+            dfs = [df for df in executor.map(load, [path for _, _, path in files_batch], chunksize=100) if len(df)]
+            for stage, pmid, _ in files_batch:
+                pending_pmids.setdefault(stage, []).append(pmid)
+            if dfs:
+                df = pd.concat(dfs)
+                pending.append(df)
+                pending_bytes += df.memory_usage(deep=True).sum()
+            if pending_bytes >= aggregator.batch_bytes:
+                aggregator.add(pd.concat(pending), pending_pmids)
+                pending, pending_pmids, pending_bytes = [], {}, 0
+    if pending or pending_pmids:
+        aggregator.add(pd.concat(pending) if pending else pd.DataFrame(), pending_pmids)
+
+
+def write_aggregates(path: Path, aggregator: SpillAggregator):
+    # the compacted partitions are appended one after another, in key order within each partition
+    tmp_path = path.with_suffix(".tmp")
+    header = True
+    for df in aggregator.compact():
+        df.to_csv(tmp_path, sep="\t", index=False, header=header, mode="w" if header else "a")
+        header = False
+    if header:
+        return
+    os.replace(tmp_path, path)
+
+
+async def run_relation_queries(
+    writer: BatchWriter,
+    input_dirs: list[str],
+    ledger: Ledger,
+    input_dataset: str = None,
+    memory_budget: int = 8 * 2**30,
+):
     # pmids = [int(Path(file).stem) for file in files]
     # pmid_date_lookup = get_pmid_date_lookup(pmids)
 
-    logging.info(f"Processing {len(files)} files")
-    if Path("/data/rgd-knowledge-graph/aggrelation2pubtator3.tsv").exists():
-        df = pd.read_csv("/data/rgd-knowledge-graph/aggrelation2pubtator3.tsv", sep="\t")
-        logging.info(f"Already processed {len(df)} relations")
-        pmids_already_in_df = set(df["PMID"].apply(item_to_list).explode())
-        files = [f for f in files if Path(f).stem not in pmids_already_in_df]
-    else:
-        df = pd.DataFrame()
-    if files:
-        agg_dfs = [df]
-        batch_size = 128000
-        for files_batch in tqdm(batch(files, n=batch_size), total=len(files) // batch_size + 1):
-            dfs = process_map(get_relation_df, files_batch, chunksize=1000, max_workers=24, disable=True)
-            concat_df = pd.concat(dfs)
-            del dfs
-            agg_df = agg_relations(concat_df)
-            agg_dfs.append(agg_df)
-        df = pd.concat(agg_dfs)
-        del agg_dfs
-        df = agg_relations(df)
-        # df["PubDate"] = df["PMID"].map(pmid_date_lookup)
-        # df["PubDate"] = df["PubDate"].fillna(np.nan).replace([np.nan], [None])
-        df.to_csv("/data/rgd-knowledge-graph/aggrelation2pubtator3.tsv", sep="\t", index=False)
-
-    grouped_df = df.groupby(["1st Type", "2nd Type", "Type"])
-    for [node_1st_type, node_2nd_type, relation_type], df_type in tqdm(sorted(grouped_df, key=lambda k: len(k[1]))):
-        logging.info(f"Creating {len(df_type)} {node_1st_type} {relation_type} {node_2nd_type} relations")
-        query = f"""
-            CALL apoc.periodic.iterate(
-                "UNWIND $rows as row RETURN row",
-                "MATCH (a:`{node_1st_type}`:PubTator3 {{ConceptID: row['1st Concept ID']}})
+    aggregator = get_aggregator(
+        AGG_RELATION_PATH,
+        ["1st Type", "1st Concept ID", "2nd Type", "2nd Concept ID", "Type"],
+        agg_relations,
+        memory_budget,
+        [*get_dataset_sources(input_dataset, "relation2pubtator3"), *map(get_stage, input_dirs)],
+    )
+    spill_dataset(aggregator, input_dataset, "relation2pubtator3", split_relation_roles)
+    spill_files(aggregator, get_pending_files(ledger, input_dirs, aggregator), get_relation_df)
+    # df["PubDate"] = df["PMID"].map(pmid_date_lookup)
+    # df["PubDate"] = df["PubDate"].fillna(np.nan).replace([np.nan], [None])
+    write_aggregates(AGG_RELATION_PATH, aggregator)
+
+    for df in aggregator.iter_aggregates():
+        jobs = []
+        grouped_df = df.groupby(["1st Type", "2nd Type", "Type"])
+        for [node_1st_type, node_2nd_type, relation_type], df_type in sorted(grouped_df, key=lambda k: len(k[1])):
+            logging.info(f"Creating {len(df_type)} {node_1st_type} {relation_type} {node_2nd_type} relations")
+            query = f"""
+                MATCH (a:`{node_1st_type}`:PubTator3 {{ConceptID: row['1st Concept ID']}})
                 MATCH (b:`{node_2nd_type}`:PubTator3 {{ConceptID: row['2nd Concept ID']}})
-                MERGE (a)-[r:`{relation_type}_PubTator3` {{PMID: row['PMID']}}]->(b)",
-                {{batchSize: 10000, batchMode: "BATCH", parallel: false, params: {{rows: $rows}}}}
-            )
-        """
-        # query = f"""
-        #     CALL apoc.periodic.iterate(
-        #         "UNWIND $rows as row RETURN row",
-        #         "MATCH (a:`{node_1st_type}`:PubTator3 {{ConceptID: row['1st Concept ID']}})
-        #         MATCH (b:`{node_2nd_type}`:PubTator3 {{ConceptID: row['2nd Concept ID']}})
-        #         MERGE (a)-[r:`{relation_type}_PubTator3` {{PMID: row['PMID']}}]->(b)
-        #         SET r.PubDate = row['PubDate']",
-        #         {{batchSize: 10000, batchMode: "BATCH", parallel: false, params: {{rows: $rows}}}}
-        #     )
-        # """
-        await run_query(session, query, rows=df_type.to_dict("records"))
+                MERGE (a)-[r:`{relation_type}_PubTator3` {{PMID: row['PMID']}}]->(b)
+            """
+            # query = f"""
+            #     MATCH (a:`{node_1st_type}`:PubTator3 {{ConceptID: row['1st Concept ID']}})
+            #     MATCH (b:`{node_2nd_type}`:PubTator3 {{ConceptID: row['2nd Concept ID']}})
+            #     MERGE (a)-[r:`{relation_type}_PubTator3` {{PMID: row['PMID']}}]->(b)
+            #     SET r.PubDate = row['PubDate']
+            # """
+            jobs.append((query, df_type, ["1st Concept ID", "2nd Concept ID", "PMID"]))
+        # all relation types of the partition at once, scheduled so concurrent batches never share a node
+        await writer.write_disjoint(jobs, ("1st Type", "1st Concept ID"), ("2nd Type", "2nd Concept ID"))
 
 def batch(iterable, n=1):
     l = len(iterable)
@@ -114,27 +206,50 @@ def unique_list(xs):
     ))
 
 
+def agg_unique_lists(df: pd.DataFrame, keys: list[str], columns: list[str]):
+    """Group ``df`` by ``keys`` and reduce every column in ``columns`` like ``unique_list``, vectorized.
+
+    The '|'-separated values are exploded into one array of pieces, dictionary-encoded in sorted order and
+    deduplicated as (group, code) pairs, so the joined strings are only built once per group at the end.
+    """
+    grouped = df.groupby(keys, sort=True)
+    group_ids = grouped.ngroup().to_numpy()
+    result = grouped.size().index.to_frame(index=False)
+    for column in columns:
+        values = df[column]
+        mask = values.notna().to_numpy() & (group_ids >= 0)
+        values = values[mask].astype(str).tolist()
+        joined = np.full(len(result), "", dtype=object)
+        if values:
+            # one split of all values at once, the pieces of value i are the next counts[i] pieces
+            pieces = "|".join(values).split("|")
+            if len(pieces) == len(values):
+                counts = 1
+            else:
+                counts = np.fromiter((value.count("|") + 1 for value in values), dtype=np.int64, count=len(values))
+            codes, uniques = pd.factorize(np.array(pieces, dtype=object))
+            # stripping and sorting only the distinct pieces, so code order is string order
+            stripped = [value.strip() for value in uniques]
+            uniques = sorted(set(stripped))
+            ranks = {value: rank for rank, value in enumerate(uniques)}
+            codes = np.array([ranks[value] for value in stripped], dtype=np.int64)[codes]
+            pairs = np.unique(np.repeat(group_ids[mask].astype(np.int64), counts) * len(uniques) + codes)
+            owners, codes = np.divmod(pairs, len(uniques))
+            starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+            ends = np.r_[starts[1:], len(codes)]
+            group_values = [uniques[code] for code in codes.tolist()]
+            for owner, start, end in zip(owners[starts].tolist(), starts.tolist(), ends.tolist()):
+                joined[owner] = "|".join(group_values[start:end])
+        result[column] = joined
+    return result
+
+
 def agg_bioconcepts(df: pd.DataFrame):
-    df = df.groupby(["Concept ID", "Type"]).agg(
-        {
-            "PMID": unique_list,
-            "Mentions": unique_list,
-            "Resource": unique_list,
-        }
-    )
-    df = df.reset_index()
-    return df
+    return agg_unique_lists(df, ["Concept ID", "Type"], ["PMID", "Mentions", "Resource"])
 
 
 def agg_relations(df: pd.DataFrame):
-    df = df.groupby(["1st Type", "1st Concept ID", "2nd Type", "2nd Concept ID", "Type"]).agg(
-        {
-            "PMID": unique_list,
-            # "PubDate": sorted_unique_list,
-        }
-    )
-    df = df.reset_index()
-    return df
+    return agg_unique_lists(df, ["1st Type", "1st Concept ID", "2nd Type", "2nd Concept ID", "Type"], ["PMID"])
 
 def get_pmid_date(pmid: int):
     date = None
@@ -186,7 +301,7 @@ def get_pmid_date_lookup(pmids):
     #         pmid_date_lookup = json.load(f)
     #         pmid_date_lookup = {int(k): v for k, v in pmid_date_lookup.items()}
     #         return pmid_date_lookup
-    pmid_date_lookup = dict(process_map(get_pmid_date, pmids, chunksize=1000, max_workers=24))
+    pmid_date_lookup = dict(process_map(get_pmid_date, pmids, chunksize=1000, max_workers=get_max_workers()))
     with open("/data/rgd-knowledge-graph/pmid_date_lookup.json", "w") as f:
         json.dump(pmid_date_lookup, f)
     return pmid_date_lookup
@@ -201,43 +316,41 @@ def load_bioconcepts_queries_df(file: str):
     return df_file
 
 
-async def run_bioconcepts_queries(session: neo4j.AsyncSession, input_dirs: list[str]):
-    files = []
-    for input_dir in input_dirs:
-        files.extend(glob.glob(f"{input_dir}/*.tsv"))
-
-    if Path("/data/rgd-knowledge-graph/aggbioconcepts2pubtator3.tsv").exists():
-        df = pd.read_csv("/data/rgd-knowledge-graph/aggbioconcepts2pubtator3.tsv", sep="\t")
-        pmids_already_in_df = set(df["PMID"].apply(item_to_list).explode())
-        logging.info(f"Already processed {len(pmids_already_in_df)} PMIDs")
-        files = [f for f in files if Path(f).stem not in pmids_already_in_df]
-    else:
-        df = pd.DataFrame()
-
-    files = sorted(files)
-    logging.info(f"Processing {len(files)} files")
-    if files:
-        for files_batch in tqdm(batch(files, n=1280000), total=len(files) // 1280000 + 1):
-            dfs = process_map(load_bioconcepts_queries_df, files_batch, chunksize=1000, max_workers=24, disable=True)
-            df = pd.concat([df] + dfs)
-            del dfs
-            df = agg_bioconcepts(df)
-            assert df["Mentions"].str.contains("PubTator3").sum() == 0
-            df.to_csv("/data/rgd-knowledge-graph/aggbioconcepts2pubtator3.tsv", sep="\t", index=False)
-
-    for node_type, df_type in tqdm(df.groupby("Type")):
-        logging.info(f"Creating constraint on {node_type} nodes")
-        query = f"CREATE CONSTRAINT IF NOT EXISTS FOR (a:`{node_type}`) REQUIRE a.ConceptID IS UNIQUE"
-        await run_query(session, query)
-        logging.info(f"Creating {len(df_type)} {node_type} nodes")
-        query = f"""
-            CALL apoc.periodic.iterate(
-                "UNWIND $rows as row RETURN row",
-                "MERGE (a:`PubTator3`:`{node_type}` {{ConceptID: row['Concept ID'], Mentions: row['Mentions'], PMID: row['PMID'], Resource: row['Resource']}})",
-                {{batchSize: 10000, batchMode: "BATCH", concurrency: 8, parallel: true, params: {{rows: $rows}}}}
-            )
-        """
-        await run_query(session, query, rows=df_type.to_dict("records"))
+async def run_bioconcepts_queries(
+    session: neo4j.AsyncSession,
+    writer: BatchWriter,
+    input_dirs: list[str],
+    ledger: Ledger,
+    input_dataset: str = None,
+    memory_budget: int = 8 * 2**30,
+):
+    aggregator = get_aggregator(
+        AGG_BIOCONCEPTS_PATH,
+        ["Concept ID", "Type"],
+        agg_bioconcepts,
+        memory_budget,
+        [*get_dataset_sources(input_dataset, "bioconcepts2pubtator3"), *map(get_stage, input_dirs)],
+    )
+    spill_dataset(aggregator, input_dataset, "bioconcepts2pubtator3", lambda df: df[df["Concept ID"] != "-"])
+    spill_files(aggregator, get_pending_files(ledger, input_dirs, aggregator), load_bioconcepts_queries_df)
+    write_aggregates(AGG_BIOCONCEPTS_PATH, aggregator)
+
+    constrained_types = set()
+    for df in aggregator.iter_aggregates():
+        for node_type, df_type in df.groupby("Type"):
+            if node_type not in constrained_types:
+                logging.info(f"Creating constraint on {node_type} nodes")
+                query = f"CREATE CONSTRAINT IF NOT EXISTS FOR (a:`{node_type}`) REQUIRE a.ConceptID IS UNIQUE"
+                await run_query(session, query)
+                constrained_types.add(node_type)
+            logging.info(f"Creating {len(df_type)} {node_type} nodes")
+            query = f"""
+                MERGE (a:`PubTator3`:`{node_type}` {{
+                    ConceptID: row['Concept ID'], Mentions: row['Mentions'], PMID: row['PMID'],
+                    Resource: row['Resource']
+                }})
+            """
+            await writer.write(query, df_type, ["Concept ID", "Mentions", "PMID", "Resource"], f"{node_type} nodes")
 
 
 async def run_query(session: neo4j.AsyncSession, query: str, **kwargs):
@@ -271,6 +384,16 @@ async def main():
             "/data/rgd-knowledge-graph/pubtator3/local/bioconcepts2pubtator3",
         ],
     )
+    parser.add_argument(
+        "--input_dataset", help="partitioned Parquet dataset", default="/data/rgd-knowledge-graph/pubtator3/dataset"
+    )
+    parser.add_argument(
+        "--ledger", help="per-PMID stage ledger", default="/data/rgd-knowledge-graph/pubtator3/ledger.sqlite"
+    )
+    parser.add_argument("--memory_budget", help="memory budget of the aggregation in MiB", type=int, default=8192)
+    parser.add_argument("--batch_size", help="rows per Neo4j write transaction", type=int, default=10000)
+    parser.add_argument("--node_concurrency", help="node write transactions in flight", type=int, default=8)
+    parser.add_argument("--relation_concurrency", help="relationship write transactions in flight", type=int, default=8)
     args = parser.parse_args()
 
     log_format = "%(asctime)s - %(levelname)s - %(message)s"
@@ -287,9 +410,17 @@ async def main():
     async with neo4j.AsyncGraphDatabase.driver(
         uri=args.neo4j_uri, auth=(args.neo4j_user, args.neo4j_password), database=args.neo4j_database
     ) as driver:
+        node_writer = BatchWriter(driver, args.neo4j_database, args.batch_size, args.node_concurrency)
+        relation_writer = BatchWriter(driver, args.neo4j_database, args.batch_size, args.relation_concurrency)
         async with driver.session(database=args.neo4j_database) as session:
-            await run_bioconcepts_queries(session, args.input_bioconcepts_dirs)
-            await run_relation_queries(session, args.input_relation_dirs)
+            with Ledger(args.ledger) as ledger:
+                memory_budget = args.memory_budget * 2**20
+                await run_bioconcepts_queries(
+                    session, node_writer, args.input_bioconcepts_dirs, ledger, args.input_dataset, memory_budget
+                )
+                await run_relation_queries(
+                    relation_writer, args.input_relation_dirs, ledger, args.input_dataset, memory_budget
+                )
 
 
 if __name__ == "__main__":
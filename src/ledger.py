@@ -0,0 +1,207 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+from pmidset import PMID_DTYPE, PMIDSet
+
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stages (
+    stage TEXT NOT NULL,
+    pmid INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    path TEXT,
+    hash TEXT,
+    updated REAL NOT NULL,
+    signature TEXT,
+    PRIMARY KEY (stage, pmid)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS stages_status ON stages (stage, status, pmid);
+CREATE TABLE IF NOT EXISTS directories (
+    stage TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    mtime INTEGER NOT NULL,
+    PRIMARY KEY (stage, directory)
+) WITHOUT ROWID;
+"""
+
+
+def get_stage(directory: Path):
+    # stages are named after their output directory, e.g. "ftp/relation2pubtator3" or "local/gnorm2"
+    directory = Path(directory)
+    return f"{directory.parent.name}/{directory.name}"
+
+
+def content_hash(data: bytes):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def get_pmid(name: str):
+    pmid = name.split(".", 1)[0]
+    return int(pmid) if pmid.isdigit() else None
+
+
+class Ledger:
+    # one row per stage and PMID with its status, output path and content hash, so stages can ask what is
+    # left to do with an indexed query instead of listing their output directories
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # the connection may be handed to a worker thread, e.g. the one processing the API responses, but it is
+        # only ever used by one thread at a time
+        self.conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # ledgers written before the signature column was added get it on first open
+        columns = {column for _, column, *_ in self.conn.execute("PRAGMA table_info(stages)")}
+        if "signature" not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE stages ADD COLUMN signature TEXT")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def record(self, stage: str, records, status: str = DONE):
+        # records are (pmid, path, hash) or (pmid, path, hash, signature), the signature describing the inputs
+        # the output was built from, e.g. their mtimes and sizes, as opposed to the hash of the output itself
+        now = time.time()
+        with self.conn:
+            cursor = self.conn.executemany(
+                "INSERT OR REPLACE INTO stages (stage, pmid, status, path, hash, updated, signature) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        stage,
+                        int(pmid),
+                        status,
+                        str(path) if path is not None else None,
+                        hash,
+                        now,
+                        signature[0] if signature else None,
+                    )
+                    for pmid, path, hash, *signature in records
+                ),
+            )
+        return cursor.rowcount
+
+    def has_stage(self, stage: str):
+        return self.conn.execute("SELECT 1 FROM stages WHERE stage = ? LIMIT 1", (stage,)).fetchone() is not None
+
+    def pmids(self, stage: str, status: str = DONE):
+        cursor = self.conn.execute(
+            "SELECT pmid FROM stages WHERE stage = ? AND status = ? ORDER BY pmid", (stage, status)
+        )
+        return PMIDSet.from_sorted(np.fromiter((pmid for pmid, in cursor), dtype=PMID_DTYPE))
+
+    def paths(self, stage: str, status: str = DONE):
+        cursor = self.conn.execute(
+            "SELECT path FROM stages WHERE stage = ? AND status = ? AND path IS NOT NULL ORDER BY pmid",
+            (stage, status),
+        )
+        return [Path(path) for path, in cursor]
+
+    def files(self, stage: str, pmids=None, status: str = DONE):
+        # (pmid, path) pairs, only of the given PMIDs if any, which are joined through a temporary table
+        query = "SELECT pmid, path FROM stages WHERE stage = ? AND status = ? AND path IS NOT NULL"
+        if pmids is None:
+            return self.conn.execute(f"{query} ORDER BY pmid", (stage, status)).fetchall()
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS selected (pmid INTEGER PRIMARY KEY)")
+            self.conn.execute("DELETE FROM selected")
+            self.conn.executemany("INSERT INTO selected VALUES (?)", ((pmid,) for pmid in PMIDSet(pmids)))
+        return self.conn.execute(
+            f"{query} AND pmid IN (SELECT pmid FROM selected) ORDER BY pmid", (stage, status)
+        ).fetchall()
+
+    def hashes(self, stage: str, status: str = DONE):
+        return dict(self.conn.execute("SELECT pmid, hash FROM stages WHERE stage = ? AND status = ?", (stage, status)))
+
+    def signatures(self, stage: str, status: str = DONE):
+        return dict(
+            self.conn.execute(
+                "SELECT pmid, signature FROM stages WHERE stage = ? AND status = ? AND signature IS NOT NULL",
+                (stage, status),
+            )
+        )
+
+    def pending(self, stage: str, pmids):
+        return PMIDSet(pmids) - self.pmids(stage)
+
+    def forget(self, stage: str, pmids):
+        paths = []
+        pmids = [(stage, pmid) for pmid in PMIDSet(pmids)]
+        with self.conn:
+            for params in pmids:
+                row = self.conn.execute("SELECT path FROM stages WHERE stage = ? AND pmid = ?", params).fetchone()
+                if row is not None and row[0] is not None:
+                    paths.append(Path(row[0]))
+            self.conn.executemany("DELETE FROM stages WHERE stage = ? AND pmid = ?", pmids)
+        return paths
+
+    def adopt_dir(self, stage: str, directory: Path, suffix: str | tuple):
+        # a stage the ledger has never seen is imported from its directory once, after that it is
+        # only updated by the stage itself
+        if not self.has_stage(stage):
+            self.sync_dir(stage, directory, suffix)
+
+    def sync_dir(self, stage: str, directory: Path, suffix: str | tuple, recursive: bool = False):
+        # for directories written by external tools; adding or removing a file bumps the directory
+        # mtime, so only directories that changed since the last sync are listed again
+        directory = Path(directory)
+        if not directory.exists():
+            return 0
+        synced = dict(self.conn.execute("SELECT directory, mtime FROM directories WHERE stage = ?", (stage,)))
+        children = defaultdict(list)
+        for path in synced:
+            children[str(Path(path).parent)].append(path)
+        changed = 0
+        pending = [str(directory)]
+        while pending:
+            path = pending.pop()
+            mtime = os.stat(path).st_mtime_ns
+            if synced.get(path) == mtime:
+                if recursive:
+                    pending.extend(children[path])
+                continue
+            files = {}
+            for entry in os.scandir(path):
+                if recursive and entry.is_dir():
+                    pending.append(entry.path)
+                elif entry.name.endswith(suffix) and (pmid := get_pmid(entry.name)) is not None:
+                    files[pmid] = entry.path
+            changed += self.replace_dir(stage, path, files, mtime)
+        if changed:
+            logging.info(f"Synced {changed} changed {stage} entries from {directory}")
+        return changed
+
+    def replace_dir(self, stage: str, directory: str, files: dict, mtime: int):
+        known = {
+            pmid: path
+            for pmid, path in self.conn.execute(
+                "SELECT pmid, path FROM stages WHERE stage = ? AND path > ? AND path < ?",
+                (stage, f"{directory}/", f"{directory}0"),
+            )
+            if os.path.dirname(path) == directory
+        }
+        removed = [(stage, pmid) for pmid, path in known.items() if files.get(pmid) != path]
+        added = [(pmid, path, None) for pmid, path in files.items() if known.get(pmid) != path]
+        with self.conn:
+            self.conn.executemany("DELETE FROM stages WHERE stage = ? AND pmid = ?", removed)
+            self.conn.execute("INSERT OR REPLACE INTO directories VALUES (?, ?, ?)", (stage, directory, mtime))
+        self.record(stage, added)
+        return len(removed) + len(added)
@@ -1,168 +1,415 @@
-import glob
+import argparse
+import io
+import json
 import logging
+import os
+import time
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from itertools import islice
 from pathlib import Path
+from typing import Callable, NamedTuple
 
-from bioc import biocxml
-
-from xml.etree import ElementTree as ET
+import numpy as np
 from tqdm import tqdm
-from itertools import chain
-from collections import defaultdict
 
-def main():
-    local_path = Path("/data/rgd-knowledge-graph/pubtator3/local/")
+import biocio
+import document_cache
+from annotation_store import MISSING, AnnotationArray, StringTable, as_annotation_array, get_string_table
+from ledger import Ledger, get_stage
+from runner import get_max_workers
+
+# output directory under local/ and file suffix of each tool, AIONER first since its documents are the merge base
+TOOLS = {
+    "aioner": ".bioc",
+    "gnorm2": ".bioc",
+    "nlmchem": ".bioc",
+    "taggerone-cellline": ".bioc",
+    "taggerone-disease": ".bioc",
+    "tmvar3": ".bioc.BioC.XML",
+}
+
+
+class AlignmentRule(NamedTuple):
+    tool: str
+    type: str
+    predicate: Callable
+    identifier_infon: str
+
+
+def is_gnorm2_gene(annotations: AnnotationArray):
+    return annotations.has("NCBI Gene")
+
+
+def is_gnorm2_species(annotations: AnnotationArray):
+    return annotations.has("NCBI Taxonomy")
+
+
+def is_nlmchem_chemical(annotations: AnnotationArray):
+    return (
+        annotations.equals("type", "Chemical")
+        & annotations.has("identifier")
+        & ~annotations.equals("identifier", "-")
+    )
+
+
+def is_taggerone_cellline(annotations: AnnotationArray):
+    return annotations.equals("type", "CellLine") & annotations.has("identifier")
+
+
+def is_taggerone_disease(annotations: AnnotationArray):
+    return annotations.equals("type", "Disease") & annotations.has("identifier")
+
+
+def is_tmvar3_variant(annotations: AnnotationArray):
+    return annotations.matching("type", lambda type: type is not None and "Mutation" in type) & annotations.has(
+        "Identifier"
+    )
+
+
+# an AIONER annotation of `type` takes the `identifier_infon` of the tool annotation with the same
+# offset and length that satisfies `predicate`, a mask over the tool's annotation columns
+ALIGNMENT_RULES = [
+    AlignmentRule("gnorm2", "Gene", is_gnorm2_gene, "NCBI Gene"),
+    AlignmentRule("gnorm2", "Species", is_gnorm2_species, "NCBI Taxonomy"),
+    AlignmentRule("nlmchem", "Chemical", is_nlmchem_chemical, "identifier"),
+    AlignmentRule("taggerone-cellline", "CellLine", is_taggerone_cellline, "identifier"),
+    AlignmentRule("taggerone-disease", "Disease", is_taggerone_disease, "identifier"),
+    AlignmentRule("tmvar3", "Variant", is_tmvar3_variant, "Identifier"),
+]
+
+
+def join_annotations(aioner: AnnotationArray, targets: np.ndarray, tool: AnnotationArray, rule: AlignmentRule):
+    candidates = np.flatnonzero(rule.predicate(tool) & (tool.records["offset"] != MISSING))
+    if not len(candidates) or not len(targets):
+        return
+    # candidates sorted by span and position, so the candidates of a span are a contiguous ascending run
+    spans = tool.spans()[candidates]
+    order = np.lexsort((candidates, spans))
+    spans, candidates = spans[order], candidates[order]
+    target_spans = aioner.spans()[targets]
+    starts = np.searchsorted(spans, target_spans, "left").tolist()
+    ends = np.searchsorted(spans, target_spans, "right").tolist()
+    candidates = candidates.tolist()
+    # like the pointer scans this replaces, a tool annotation can only match after the previous match
+    matched_targets = []
+    matched = []
+    last_matched = 0
+    for target, start, end in zip(targets.tolist(), starts, ends):
+        i = bisect_left(candidates, last_matched, start, end)
+        if i < end:
+            matched_targets.append(target)
+            matched.append(candidates[i])
+            last_matched = candidates[i] + 1
+    if matched:
+        aioner.set_identifiers(matched_targets, tool.values(rule.identifier_infon)[matched], rule.tool)
+
+
+def align_passage(aioner: AnnotationArray, tools: dict, rules: list = ALIGNMENT_RULES):
+    for rule in rules:
+        if rule.tool in tools:
+            join_annotations(aioner, np.flatnonzero(aioner.equals("type", rule.type)), tools[rule.tool], rule)
+
+
+def merge_collections(collections: dict, rules: list = ALIGNMENT_RULES, strings: StringTable = None):
+    tools = list(collections)[1:]
+    for documents in zip(*(collection.documents for collection in collections.values())):
+        for passages in zip(*(document.passages for document in documents)):
+            strings = strings if strings is not None else get_string_table(passages)
+            annotations = [as_annotation_array(passage, strings) for passage in passages]
+            align_passage(annotations[0], dict(zip(tools, annotations[1:])), rules)
+    return collections["aioner"]
+
+
+def get_input_signature(local_path: Path, pmid: int):
+    # the mtime and size of every tool output, None for an output that is missing
+    signature = {}
+    for tool, suffix in TOOLS.items():
+        try:
+            stat = os.stat(local_path / tool / f"{pmid}{suffix}")
+        except FileNotFoundError:
+            signature[tool] = None
+            continue
+        signature[tool] = [stat.st_mtime_ns, stat.st_size]
+    return signature
+
+
+def get_changed_tools(signature: dict, previous_signature: str = None):
+    if previous_signature is None:
+        return list(TOOLS)
+    previous_signature = json.loads(previous_signature)
+    return [tool for tool in TOOLS if signature[tool] is None or signature[tool] != previous_signature.get(tool)]
+
+
+def clear_identifiers(collection, types: set, strings: StringTable):
+    for document in collection.documents:
+        for passage in document.passages:
+            annotations = as_annotation_array(passage, strings)
+            annotations.clear_identifiers(annotations.matching("type", types.__contains__))
+
+
+def read_tool_outputs(
+    executor: ThreadPoolExecutor,
+    local_path: Path,
+    merged_path: Path,
+    pmid: int,
+    previous_signature: str = None,
+    partial: bool = False,
+    output: str = "xml",
+    exported: bool = True,
+):
+    signature = get_input_signature(local_path, pmid)
+    missing = [tool for tool, tool_signature in signature.items() if tool_signature is None]
+    if missing:
+        # removed since the ledger was synced, the PMID is left unmerged and looked at again on the next run
+        logging.warning(f"Skipping {pmid} with missing {', '.join(missing)} output")
+        return signature, {}
+    tools = get_changed_tools(signature, previous_signature)
+    if not tools and (not exported or not has_merged(merged_path, pmid, output)):
+        # unchanged inputs, but the merged document or its export was removed or is wanted in another format
+        tools = list(TOOLS)
+    merged_base = get_merged_base(merged_path, pmid)
+    paths = {}
+    if tools and partial and "aioner" not in tools and merged_base is not None:
+        # only the changed tools are aligned again, onto the previously merged document
+        paths["aioner"] = merged_base
+        tools = [tool for tool in tools if tool != "aioner"]
+    else:
+        tools = list(TOOLS) if tools else []
+    for tool in tools:
+        paths.setdefault(tool, local_path / tool / f"{pmid}{TOOLS[tool]}")
+    return signature, {tool: (path, executor.submit(path.read_bytes)) for tool, path in paths.items()}
+
+
+def get_merged_paths(merged_path: Path, pmid: int):
+    return merged_path / f"{pmid}.bioc", merged_path / f"{pmid}.pickle"
+
+
+def has_merged(merged_path: Path, pmid: int, output: str = "xml"):
+    # the merged document in every format of ``output`` and its entity index
+    xml_path, cache_path = get_merged_paths(merged_path, pmid)
+    paths = {"xml": [xml_path], "cache": [cache_path], "both": [xml_path, cache_path]}[output]
+    return all(path.exists() for path in [*paths, get_entity_index_path(merged_path, pmid)])
+
+
+def get_merged_base(merged_path: Path, pmid: int):
+    for path in get_merged_paths(merged_path, pmid)[::-1]:
+        if path.exists():
+            return path
+    return None
+
+
+def parse_tool_output(path: Path, data: bytes, strings: StringTable):
+    if path.suffix == ".pickle":
+        return document_cache.loads(data, strings)
+    return biocio.load(io.BytesIO(data), strings=strings)
+
+
+def load_merged(merged_path: Path, pmid: int, strings: StringTable = None):
+    path = get_merged_base(merged_path, pmid)
+    if path is None:
+        raise FileNotFoundError(f"No merged document for {pmid} in {merged_path}")
+    return parse_tool_output(path, path.read_bytes(), strings if strings is not None else StringTable())
+
+
+def get_entity_index_path(merged_path: Path, pmid: int):
+    return merged_path / f"{pmid}.entities.tsv"
+
+
+def build_entity_index(collection):
+    # identifier -> "type|identifier" of every concept, the BioREx relations refer to concepts by identifier
+    index = {}
+    for document in collection.documents:
+        strings = get_string_table(document.passages)
+        for passage in document.passages:
+            annotations = as_annotation_array(passage, strings)
+            types = strings.decode(annotations.values("type")).tolist()
+            identifiers = strings.decode(annotations.values("identifier")).tolist()
+            for type, identifier in zip(types, identifiers):
+                if type and identifier and identifier != "-":
+                    index[identifier] = f"{type}|{identifier}"
+    return index
+
+
+def write_entity_index(index: dict, path: Path):
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "w") as f:
+        for identifier, concept_id in index.items():
+            f.write(f"{identifier}\t{concept_id}\n")
+    os.replace(tmp_path, path)
+
+
+def load_entity_index(path: Path):
+    try:
+        with open(path) as f:
+            return dict(line.rstrip("\n").split("\t", 1) for line in f)
+    except FileNotFoundError:
+        return None
+
+
+def write_merged(collection, merged_path: Path, pmid: int, output: str = "xml"):
+    # the format that is not written is removed, so a stale copy is never picked up as the merged document
+    xml_path, cache_path = get_merged_paths(merged_path, pmid)
+    write_entity_index(build_entity_index(collection), get_entity_index_path(merged_path, pmid))
+    if output in ("cache", "both"):
+        document_cache.dump(collection, cache_path)
+    else:
+        cache_path.unlink(missing_ok=True)
+    if output in ("xml", "both"):
+        tmp_path = xml_path.with_suffix(".bioc.tmp")
+        with open(tmp_path, "w") as f:
+            biocio.dump(collection, f)
+        os.replace(tmp_path, xml_path)
+    else:
+        xml_path.unlink(missing_ok=True)
+    return xml_path if output == "xml" else cache_path
+
+
+def merge_batch(
+    pmids: list,
+    local_path: Path,
+    merged_path: Path,
+    signatures: dict = None,
+    partial: bool = False,
+    prefetch: int = 2,
+    output: str = "xml",
+    export: Callable = None,
+    export_path: Callable = None,
+):
+    """Merge the tool outputs of a batch of PMIDs and write the merged documents as ``output``.
+
+    ``export(pmid, collection)``, if given, is called with every merged document while it is still in memory.
+    ``export_path(pmid)``, if given, is the file ``export`` writes, a PMID whose export is missing is merged again.
+    """
+    # the inputs of the next PMIDs are read by threads while the current PMID is parsed and aligned
+    parse_times = dict.fromkeys(TOOLS, 0.0)
+    records = []
+    signatures = signatures or {}
+    pmids = iter(pmids)
+    # the annotations of the batch are parsed into columns sharing one string table
+    strings = StringTable()
+
+    def prefetch_next(n: int):
+        for pmid in islice(pmids, n):
+            prefetched.append(
+                (
+                    pmid,
+                    *read_tool_outputs(
+                        executor,
+                        local_path,
+                        merged_path,
+                        pmid,
+                        signatures.get(pmid),
+                        partial,
+                        output,
+                        export_path is None or export_path(pmid).exists(),
+                    ),
+                )
+            )
+
+    with ThreadPoolExecutor(len(TOOLS) * prefetch) as executor:
+        prefetched = deque()
+        prefetch_next(prefetch)
+        while prefetched:
+            pmid, signature, futures = prefetched.popleft()
+            prefetch_next(1)
+            if not futures:
+                continue
+            collections = {}
+            for tool, (path, future) in futures.items():
+                data = future.result()
+                start = time.perf_counter()
+                collections[tool] = parse_tool_output(path, data, strings)
+                parse_times[tool] += time.perf_counter() - start
+            rules = [rule for rule in ALIGNMENT_RULES if rule.tool in collections]
+            if len(rules) < len(ALIGNMENT_RULES):
+                clear_identifiers(collections["aioner"], {rule.type for rule in rules}, strings)
+            merged = merge_collections(collections, rules, strings)
+            merged_output = write_merged(merged, merged_path, pmid, output)
+            if export is not None:
+                export(pmid, merged)
+            records.append((pmid, merged_output, None, json.dumps(signature)))
+    return records, parse_times
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Merge the NER tool outputs into the AIONER documents")
+    parser.add_argument("--local_dir", help="local directory", default="/data/rgd-knowledge-graph/pubtator3/local/")
+    parser.add_argument("--max_workers", help="worker processes", type=int, default=get_max_workers())
+    parser.add_argument("--batch_size", help="PMIDs per worker task", type=int, default=256)
+    parser.add_argument(
+        "--partial",
+        help="re-align only the tools whose outputs changed onto the existing merged documents",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--output",
+        help="merged documents as BioC XML, as the binary document cache, or both",
+        choices=["xml", "cache", "both"],
+        default="xml",
+    )
+    parser.add_argument(
+        "--ledger", help="per-PMID stage ledger", default="/data/rgd-knowledge-graph/pubtator3/ledger.sqlite"
+    )
+    return parser
+
+
+def run(args, export: Callable = None, export_path: Callable = None):
+    local_path = Path(args.local_dir)
     merged_path = local_path / "merged"
     merged_path.mkdir(exist_ok=True)
 
-    aioner = local_path / "aioner"
-    aioner_paths = list(aioner.glob("*.bioc"))
-    aioner_pmids = set([path.stem for path in aioner_paths])
-    print(f"Found {len(aioner_pmids)} aioner pmids")
-
-    gnorm2_path = local_path / "gnorm2"
-    gnorm2_paths = list(gnorm2_path.glob("*.bioc"))
-    gnorm2_pmids = set([path.stem for path in gnorm2_paths])
-    print(f"Found {len(gnorm2_pmids)} gnorm2 pmids")
-
-    nlmchem_path = local_path / "nlmchem"
-    nlmchem_paths = list(nlmchem_path.glob("*.bioc"))
-    nlmchem_pmids = set([path.stem for path in nlmchem_paths])
-    print(f"Found {len(nlmchem_pmids)} nlmchem pmids")
-
-    taggerone_cellline_path = local_path / "taggerone-cellline"
-    taggerone_cellline_paths = list(taggerone_cellline_path.glob("*.bioc"))
-    taggerone_cellline_pmids = set([path.stem for path in taggerone_cellline_paths])
-    print(f"Found {len(taggerone_cellline_pmids)} taggerone cellline pmids")
-
-    taggerone_disease_path = local_path / "taggerone-disease"
-    taggerone_disease_paths = list(taggerone_disease_path.glob("*.bioc"))
-    taggerone_disease_pmids = set([path.stem for path in taggerone_disease_paths])
-    print(f"Found {len(taggerone_disease_pmids)} taggerone disease pmids")
-
-    tmvar3_path = local_path / "tmvar3"
-    tmvar3_paths = list(tmvar3_path.rglob("*.bioc.BioC.XML"))
-    tmvar3_pmids = set([path.name.split(".")[0] for path in tmvar3_paths])
-    print(f"Found {len(tmvar3_pmids)} tmvar3 pmids")
-
-    pmids = gnorm2_pmids & nlmchem_pmids & taggerone_cellline_pmids & taggerone_disease_pmids & tmvar3_pmids
+    ledger = Ledger(args.ledger)
+
+    pmids = None
+    for tool, suffix in TOOLS.items():
+        tool_path = local_path / tool
+        ledger.sync_dir(get_stage(tool_path), tool_path, suffix, recursive=tool == "tmvar3")
+        tool_pmids = ledger.pmids(get_stage(tool_path))
+        print(f"Found {len(tool_pmids)} {tool} pmids")
+        pmids = tool_pmids if pmids is None else pmids & tool_pmids
     print(f"Found {len(pmids)} common pmids")
 
-    pmids = sorted(list(pmids))
-
-    for pmid in tqdm(pmids):
-        aioner_bioc = aioner / f"{pmid}.bioc"
-        gnorm2_bioc = gnorm2_path / f"{pmid}.bioc"
-        nlmchem_bioc = nlmchem_path / f"{pmid}.bioc"
-        taggerone_cellline_bioc = taggerone_cellline_path / f"{pmid}.bioc"
-        taggerone_disease_bioc = taggerone_disease_path / f"{pmid}.bioc"
-        tmvar3_bioc = tmvar3_path / f"{pmid}.bioc.BioC.XML"
-        merged_bioc = merged_path / f"{pmid}.bioc"
-        with open(aioner_bioc, "r") as f:
-            aioner_collection = biocxml.load(f)
-        with open(gnorm2_bioc, "r") as f:
-            gnorm2_collection = biocxml.load(f)
-        with open(nlmchem_bioc, "r") as f:
-            nlmchem_collection = biocxml.load(f)
-        with open(taggerone_cellline_bioc, "r") as f:
-            taggerone_cellline_collection = biocxml.load(f)
-        with open(taggerone_disease_bioc, "r") as f:
-            taggerone_disease_collection = biocxml.load(f)
-        with open(tmvar3_bioc, "r") as f:
-            tmvar3_collection = biocxml.load(f)
-        for aioner_document, gnorm2_document, nlmchem_document, taggerone_cellline_document, taggerone_disease_document, tmvar3_document in zip(
-            aioner_collection.documents,
-            gnorm2_collection.documents,
-            nlmchem_collection.documents,
-            taggerone_cellline_collection.documents,
-            taggerone_disease_collection.documents,
-            tmvar3_collection.documents,
-        ):
-            for aioner_passage, gnorm2_passage, nlmchem_passage, taggerone_cellline_passage, taggerone_disease_passage, tmvar3_passage in zip(
-                aioner_document.passages,
-                gnorm2_document.passages,
-                nlmchem_document.passages,
-                taggerone_cellline_document.passages,
-                taggerone_disease_document.passages,
-                tmvar3_document.passages,
-            ):
-                annotations_grouped_by_type = defaultdict(list)
-                for annotation in aioner_passage.annotations:
-                    annotations_grouped_by_type[annotation.infons.get("type")].append(annotation)
-
-                gnorm2_gene_annotations_queue = list(gnorm2_passage.annotations)
-                pointer_last_matched = 0
-                for aioner_annotation in annotations_grouped_by_type["Gene"]:
-                    pointer_scanning = pointer_last_matched
-                    while pointer_scanning < len(gnorm2_gene_annotations_queue):
-                        gnorm2_annotation = gnorm2_gene_annotations_queue[pointer_scanning]
-                        if gnorm2_annotation.locations[0].offset == aioner_annotation.locations[0].offset and gnorm2_annotation.locations[0].length == aioner_annotation.locations[0].length and "NCBI Gene" in gnorm2_annotation.infons:
-                            aioner_annotation.infons["identifier"] = gnorm2_annotation.infons["NCBI Gene"]
-                            pointer_last_matched = pointer_scanning + 1
-                            break
-                        pointer_scanning += 1
-
-                gnorm2_species_annotations_queue = list(gnorm2_passage.annotations)
-                pointer_last_matched = 0
-                for aioner_annotation in annotations_grouped_by_type["Species"]:
-                    pointer_scanning = pointer_last_matched
-                    while pointer_scanning < len(gnorm2_species_annotations_queue):
-                        gnorm2_annotation = gnorm2_species_annotations_queue[pointer_scanning]
-                        if gnorm2_annotation.locations[0].offset == aioner_annotation.locations[0].offset and gnorm2_annotation.locations[0].length == aioner_annotation.locations[0].length and "NCBI Taxonomy" in gnorm2_annotation.infons:
-                            aioner_annotation.infons["identifier"] = gnorm2_annotation.infons["NCBI Taxonomy"]
-                            pointer_last_matched = pointer_scanning + 1
-                            break
-                        pointer_scanning += 1
-
-                chemical_annotations_queue = list(nlmchem_passage.annotations)
-                pointer_last_matched = 0
-                for aioner_annotation in annotations_grouped_by_type["Chemical"]:
-                    pointer_scanning = pointer_last_matched
-                    while pointer_scanning < len(chemical_annotations_queue):
-                        chemical_annotation = chemical_annotations_queue[pointer_scanning]
-                        if chemical_annotation.locations[0].offset == aioner_annotation.locations[0].offset and chemical_annotation.locations[0].length == aioner_annotation.locations[0].length and chemical_annotation.infons.get("type") == "Chemical" and "identifier" in chemical_annotation.infons and chemical_annotation.infons["identifier"] != "-":
-                            aioner_annotation.infons["identifier"] = chemical_annotation.infons["identifier"]
-                            pointer_last_matched = pointer_scanning + 1
-                            break
-                        pointer_scanning += 1
-
-                taggerone_cellline_annotations_queue = list(taggerone_cellline_passage.annotations)
-                pointer_last_matched = 0
-                for aioner_annotation in annotations_grouped_by_type["CellLine"]:
-                    pointer_scanning = pointer_last_matched
-                    while pointer_scanning < len(taggerone_cellline_annotations_queue):
-                        taggerone_cellline_annotation = taggerone_cellline_annotations_queue[pointer_scanning]
-                        if taggerone_cellline_annotation.locations[0].offset == aioner_annotation.locations[0].offset and taggerone_cellline_annotation.locations[0].length == aioner_annotation.locations[0].length and taggerone_cellline_annotation.infons.get("type") == "CellLine" and "identifier" in taggerone_cellline_annotation.infons:
-                            aioner_annotation.infons["identifier"] = taggerone_cellline_annotation.infons["identifier"]
-                            pointer_last_matched = pointer_scanning + 1
-                            break
-                        pointer_scanning += 1
-
-                taggerone_disease_annotations_queue = list(taggerone_disease_passage.annotations)
-                pointer_last_matched = 0
-                for aioner_annotation in annotations_grouped_by_type["Disease"]:
-                    pointer_scanning = pointer_last_matched
-                    while pointer_scanning < len(taggerone_disease_annotations_queue):
-                        taggerone_disease_annotation = taggerone_disease_annotations_queue[pointer_scanning]
-                        if taggerone_disease_annotation.locations[0].offset == aioner_annotation.locations[0].offset and taggerone_disease_annotation.locations[0].length == aioner_annotation.locations[0].length and taggerone_disease_annotation.infons.get("type") == "Disease" and "identifier" in taggerone_disease_annotation.infons:
-                            aioner_annotation.infons["identifier"] = taggerone_disease_annotation.infons["identifier"]
-                            pointer_last_matched = pointer_scanning + 1
-                            break
-                        pointer_scanning += 1
-
-                tmvar3_annotations_queue = list(tmvar3_passage.annotations)
-                pointer_last_matched = 0
-                for aioner_annotation in annotations_grouped_by_type["Variant"]:
-                    pointer_scanning = pointer_last_matched
-                    while pointer_scanning < len(tmvar3_annotations_queue):
-                        tmvar3_annotation = tmvar3_annotations_queue[pointer_scanning]
-                        if tmvar3_annotation.locations[0].offset == aioner_annotation.locations[0].offset and tmvar3_annotation.locations[0].length == aioner_annotation.locations[0].length and "Mutation" in tmvar3_annotation.infons.get("type", "") and "Identifier" in tmvar3_annotation.infons:
-                            aioner_annotation.infons["identifier"] = tmvar3_annotation.infons["Identifier"]
-                            pointer_last_matched = pointer_scanning + 1
-                            break
-                        pointer_scanning += 1
-
-        with open(merged_bioc, "w") as f:
-            biocxml.dump(aioner_collection, f)
+    # the ledger keeps the mtimes and sizes of the inputs each merged document was built from
+    signatures = ledger.signatures(get_stage(merged_path))
+    pmids = list(pmids)
+    parse_times = dict.fromkeys(TOOLS, 0.0)
+    merged = 0
+    with ProcessPoolExecutor(args.max_workers) as executor, tqdm(total=len(pmids)) as progress:
+        futures = {}
+        for i in range(0, len(pmids), args.batch_size):
+            batch = pmids[i : i + args.batch_size]
+            batch_signatures = {pmid: signatures[pmid] for pmid in batch if pmid in signatures}
+            future = executor.submit(
+                merge_batch,
+                batch,
+                local_path,
+                merged_path,
+                batch_signatures,
+                args.partial,
+                output=args.output,
+                export=export,
+                export_path=export_path,
+            )
+            futures[future] = len(batch)
+        for future in as_completed(futures):
+            records, batch_parse_times = future.result()
+            ledger.record(get_stage(merged_path), records)
+            for tool, parse_time in batch_parse_times.items():
+                parse_times[tool] += parse_time
+            merged += len(records)
+            progress.update(futures[future])
+    ledger.close()
+
+    print(f"Merged {merged} pmids, {len(pmids) - merged} were up to date")
+
+    for tool, parse_time in parse_times.items():
+        print(f"Parsed {tool} in {parse_time:.1f}s ({parse_time / max(len(pmids), 1) * 1000:.2f} ms per pmid)")
+
+
+def main():
+    run(get_parser().parse_args())
 
 
 if __name__ == "__main__":
@@ -1,64 +1,207 @@
 import argparse
+import asyncio
+import fcntl
 import gzip
 import logging
+import mmap
+import os
 import shutil
+from collections import Counter
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 
-import bioc
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-import requests
-from bioc import BioCCollection, biocxml
 from bioconverters import pmcxml2bioc, pubmedxml2bioc
 from matplotlib_venn import venn3
+from pandas.api.types import union_categoricals
 from tqdm import tqdm
-from tqdm.contrib.concurrent import process_map
+from tqdm.contrib.concurrent import process_map, thread_map
+
+import biocio
+from annotation_store import StringTable, as_annotation_array, get_string_table
+from api_cache import ResponseCache
+from dataset import DatasetWriter, read_dataset_pmids
+from emitter import emit_document
+from ledger import Ledger, content_hash, get_stage
+from pmid_index import build_pmid_index, load_pmid_index, split_pmid_aligned
+from pmidset import PMIDSet, as_pmid_set, load_dump_pmids
+from pubtator3_api import PUBTATOR3_API_PARAMS, PUBTATOR3_API_URL, fetch_pubtator3_api
+from runner import get_max_workers, run_per_file
+
+BIOCONCEPTS2PUBTATOR3_HEADER = b"PMID\tType\tConcept ID\tMentions\tResource\n"
+RELATION2PUBTATOR3_HEADER = b"PMID\tType\t1st\t2nd\n"
+TSV_HEADERS = {
+    "bioconcepts2pubtator3": BIOCONCEPTS2PUBTATOR3_HEADER,
+    "relation2pubtator3": RELATION2PUBTATOR3_HEADER,
+}
+FICLONE = 0x40049409
+# HTML entities in PubMed XML that are undefined in XML
+ENTITY_REPLACEMENTS = {"&plusmn;": "±"}
+
+
+class EntityFixupReader:
+    # replaces HTML entities that are undefined in XML while the parser streams the file
+    def __init__(self, f, replacements: dict = None):
+        self.f = f
+        self.replacements = replacements if replacements is not None else ENTITY_REPLACEMENTS
+        self.max_length = max(map(len, self.replacements))
+        self.pending = ""
+
+    def read(self, size: int = -1):
+        while True:
+            chunk = self.f.read(size)
+            data = self.pending + chunk
+            self.pending = ""
+            if not chunk or size is None or size < 0:
+                return self.fixup(data)
+            # hold back a trailing "&..." that may be the start of an entity split across reads
+            cut = data.rfind("&", max(0, len(data) - self.max_length + 1))
+            if cut != -1:
+                self.pending = data[cut:]
+                data = data[:cut]
+            if data:
+                return self.fixup(data)
+
+    def fixup(self, data: str):
+        for entity, replacement in self.replacements.items():
+            data = data.replace(entity, replacement)
+        return data
+
+
+def convert_abstracts(manifest_path: Path, output_dir: Path, quarantine_path: Path, max_workers: int = os.cpu_count()):
+    logging.info(f"Converting abstracts listed in {manifest_path} to BIOC format in {output_dir}")
+    quarantined = load_quarantine(quarantine_path)
+    manifest = [(pmid, path) for pmid, path in load_manifest(manifest_path) if not is_quarantined(quarantined, path)]
+    output_dir.mkdir(exist_ok=True)
 
+    failures = process_map(
+        convert_abstract_single,
+        [pmid for pmid, _ in manifest],
+        [path for _, path in manifest],
+        [output_dir] * len(manifest),
+        chunksize=64,
+        max_workers=max_workers,
+    )
+    add_to_quarantine(quarantine_path, [failure for failure in failures if failure])
 
-def convert_abstracts(input_dir: Path, output_dir: Path):
-    logging.info(f"Converting abstracts from {input_dir} to BIOC format in {output_dir}")
-    pmc_xmls = list(input_dir.glob("*.xml"))
-    output_dir.mkdir(exist_ok=True)
 
-    for pmc_xml in tqdm(pmc_xmls):
-        path_bioc = output_dir / pmc_xml.with_suffix(".bioc").name
-        if path_bioc.exists():
-            continue
-        source = str(pmc_xml)
-        import io
-        with open(source) as f:
-            text = f.read()
-            text = text.replace("&plusmn;", "±")
-            string_io = io.StringIO(text)
-            documents = list(pubmedxml2bioc(string_io))
+def convert_abstract_single(pmid: int, pubmed_xml: Path, output_dir: Path):
+    path_bioc = output_dir / f"{pmid}.bioc"
+    if path_bioc.exists():
+        return None
+    try:
+        with open_xml(pubmed_xml) as f:
+            documents = list(pubmedxml2bioc(EntityFixupReader(f)))
         if not documents:
-            logging.warning(f"Could not convert {pmc_xml}")
+            raise ValueError("no PubmedArticle found")
         for document in documents:
             for passage in document.passages:
                 passage.infons["type"] = passage.infons["section"]
-        collection = BioCCollection.of_documents(*documents)
-
-        with open(str(path_bioc), "w") as fp:
-            biocxml.dump(collection, fp)
+        collection = biocio.BioCCollection.of_documents(*documents)
+
+        tmp_path = path_bioc.with_suffix(".bioc.tmp")
+        with open(str(tmp_path), "w") as fp:
+            biocio.dump(collection, fp)
+        tmp_path.rename(path_bioc)
+    except Exception as e:
+        return str(pubmed_xml), f"{type(e).__name__}: {e}"
+
+
+def open_xml(path: Path):
+    # PubMed and PMC sources are read in place, gzipped or not
+    if Path(path).suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def load_manifest(manifest_path: Path):
+    if not manifest_path.exists():
+        return []
+    with open(manifest_path) as f:
+        return [(int(pmid), Path(path)) for pmid, path in (line.rstrip("\n").split("\t", 1) for line in f)]
+
+
+def write_manifest(manifest_path: Path, manifest: list):
+    tmp_path = manifest_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        for pmid, path in manifest:
+            f.write(f"{pmid}\t{path}\n")
+    os.replace(tmp_path, manifest_path)
+
+
+def load_quarantine(quarantine_path: Path):
+    # the mtime in ns of every quarantined source when it failed, the last entry of a source wins
+    if not quarantine_path.exists():
+        return {}
+    quarantined = {}
+    with open(quarantine_path) as f:
+        for line in f:
+            path, mtime, _ = (line.rstrip("\n").split("\t", 2) + ["", ""])[:3]
+            # entries without an mtime are retried once
+            quarantined[path] = int(mtime) if mtime.isdigit() else -1
+    return quarantined
+
+
+def is_quarantined(quarantined: dict, path: Path, mtime_ns: int = None):
+    # a source is retried once it was modified after it failed, e.g. replaced by a fixed file
+    if str(path) not in quarantined:
+        return False
+    if mtime_ns is None:
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return True
+    return mtime_ns <= quarantined[str(path)]
 
 
-def convert_pmc_xml(input_dir: Path, output_dir: Path):
+def add_to_quarantine(quarantine_path: Path, failures: list):
+    if not failures:
+        return
+    logging.warning(f"Quarantined {len(failures)} files that could not be converted, see {quarantine_path}")
+    with open(quarantine_path, "a") as f:
+        for path, error in failures:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = 0
+            error = " ".join(error.split())
+            f.write(f"{path}\t{mtime}\t{error}\n")
+
+
+def convert_pmc_xml(input_dir: Path, output_dir: Path, quarantine_path: Path, max_workers: int = os.cpu_count()):
     logging.info(f"Converting PMC XMLs from {input_dir} to BIOC XMLs in {output_dir}")
-    pmc_xmls = list(input_dir.glob("*.xml"))
     output_dir.mkdir(exist_ok=True)
+    quarantined = load_quarantine(quarantine_path)
+    pmc_xmls = [
+        Path(entry.path)
+        for entry in os.scandir(input_dir)
+        if not entry.name.startswith(".") and not is_quarantined(quarantined, entry.path)
+    ]
+    report = run_per_file(
+        convert_pmc_xml_single,
+        pmc_xmls,
+        args=(output_dir,),
+        get_output=partial(get_pmc_bioc_path, output_dir=output_dir),
+        max_workers=max_workers,
+        description="convert_pmc_xml",
+    )
+    add_to_quarantine(quarantine_path, report.failures)
 
-    process_map(convert_pmc_xml_single, pmc_xmls, [output_dir] * len(pmc_xmls), chunksize=1, max_workers=24)
+
+def get_pmc_bioc_path(pmc_xml: Path, output_dir: Path):
+    return output_dir / f"{pmc_xml.name.split('.', 1)[0]}.bioc"
 
 
 def convert_pmc_xml_single(pmc_xml: Path, output_dir: Path):
-    path_bioc = output_dir / pmc_xml.with_suffix(".bioc").name
-    pmid = pmc_xml.stem
-    # if path_bioc.exists():
-    #     return
-    documents = list(pmcxml2bioc(str(pmc_xml)))
+    pmid = pmc_xml.name.split(".", 1)[0]
+    path_bioc = get_pmc_bioc_path(pmc_xml, output_dir)
+    with open_xml(pmc_xml) as f:
+        documents = list(pmcxml2bioc(f))
     if not documents:
-        raise Exception(f"Could not convert {pmc_xml}")
+        raise ValueError("no article found")
     for document in documents:
         document.id = pmid
         document.encoding = "utf-8"
@@ -66,38 +209,56 @@ def convert_pmc_xml_single(pmc_xml: Path, output_dir: Path):
         for passage in document.passages:
             passage.infons["type"] = passage.infons["section"]
 
-    collection = BioCCollection.of_documents(*documents)
-    with open(str(path_bioc), "w") as fp:
-        biocxml.dump(collection, fp)
+    collection = biocio.BioCCollection.of_documents(*documents)
+    tmp_path = path_bioc.with_suffix(".bioc.tmp")
+    with open(str(tmp_path), "w") as fp:
+        biocio.dump(collection, fp)
+    tmp_path.rename(path_bioc)
+    return path_bioc
 
 
 def get_rgd_df_pmids(rgd_csv: str):
     logging.info(f"Getting PMIDs from {rgd_csv}")
     rgd_df = pd.read_csv(rgd_csv, usecols=["PMID", "article_path"], dtype={"PMID": int, "article_path": str})
-    return rgd_df, set(rgd_df["PMID"])
+    return rgd_df, PMIDSet(rgd_df["PMID"])
 
 
-def get_relation2pubtator3_df_pmids(relation2pubtator3_csv: str):
+def get_relation2pubtator3_df_pmids(relation2pubtator3_csv: str, rgd_pmids: PMIDSet, chunksize: int = 10**6):
     logging.info(f"Getting relations and PMIDs from {relation2pubtator3_csv}")
-    relation2pubtator3_df = pd.read_csv(
-        relation2pubtator3_csv, sep="\t", header=None, names=["PMID", "Type", "1st", "2nd"], dtype={"PMID": int}
-    )
-    relation2pubtator3_pmids = set(relation2pubtator3_df["PMID"])
+    dfs = []
+    pmids = []
+    with pd.read_csv(
+        relation2pubtator3_csv,
+        sep="\t",
+        header=None,
+        names=["PMID", "Type", "1st", "2nd"],
+        dtype={"PMID": "uint32", "Type": "category"},
+        chunksize=chunksize,
+    ) as reader:
+        for chunk in tqdm(reader):
+            pmids.append(chunk["PMID"].unique())
+            # the kept rows are made categorical before the next chunk is read, so the concept strings of all
+            # chunks are never held as objects at once
+            chunk = chunk[rgd_pmids.isin(chunk["PMID"])]
+            dfs.append(chunk.astype({"1st": "category", "2nd": "category"}))
+    relation2pubtator3_df = concat_categorical_chunks(dfs, ["Type", "1st", "2nd"])
+    relation2pubtator3_pmids = PMIDSet(np.concatenate(pmids))
+    logging.info(f"Kept {len(relation2pubtator3_df)} relations of RGD PMIDs from {relation2pubtator3_csv}")
     return relation2pubtator3_df, relation2pubtator3_pmids
 
 
-def get_bioconcepts2pubtator3_pmids(bioconcepts2pubtator3_csv: str):
+def concat_categorical_chunks(dfs: list, columns: list):
+    # pd.concat falls back to object columns when the categories of the chunks differ, so the categorical
+    # columns are joined with the union of their categories instead
+    df = pd.concat([chunk.drop(columns=columns) for chunk in dfs], ignore_index=True)
+    for column in columns:
+        df[column] = union_categoricals([chunk[column] for chunk in dfs])
+    return df[dfs[0].columns]
+
+
+def get_bioconcepts2pubtator3_pmids(bioconcepts2pubtator3_csv: str, max_workers: int = os.cpu_count()):
     logging.info(f"Getting PMIDs from {bioconcepts2pubtator3_csv}")
-    # pmids = set()
-    # with open(bioconcepts2pubtator3_csv) as f, tqdm(total=None) as pbar:
-    #     for line in f:
-    #         pmid = int(line.split("\t")[0])
-    #         pmids.add(pmid)
-    #         inc = len(pmids) - pbar.n
-    #         pbar.update(inc)
-    pmids = {38060310}
-    pmids = range(1, max(pmids) + 1)
-    return pmids
+    return load_dump_pmids(bioconcepts2pubtator3_csv, max_workers)
 
 
 def main():
@@ -110,7 +271,31 @@ def main():
         "--bioconcepts2pubtator3_csv", help="bioconcepts2pubtator3 csv", default="/data/PubTator3/bioconcepts2pubtator3"
     )
     parser.add_argument("--in_dir_pubmed_abstract", help="input directory", default="/data/Archive/pubmed/Archive")
-    parser.add_argument("--out_dir", help="output directory", default="/data/rd-knowledge-graph/pubtator3")
+    parser.add_argument("--out_dir", help="output directory", default="/data/rgd-knowledge-graph/pubtator3")
+    parser.add_argument("--max_workers", help="worker processes", type=int, default=get_max_workers())
+    parser.add_argument("--build_index", help="(re)build the PMID byte-offset indexes", action="store_true")
+    parser.add_argument(
+        "--output_format",
+        help="per-PMID TSV files or a partitioned Parquet dataset",
+        choices=["tsv", "parquet"],
+        default="tsv",
+    )
+    parser.add_argument(
+        "--dataset_dir", help="dataset directory", default="/data/rgd-knowledge-graph/pubtator3/dataset"
+    )
+    parser.add_argument(
+        "--ledger", help="per-PMID stage ledger", default="/data/rgd-knowledge-graph/pubtator3/ledger.sqlite"
+    )
+    parser.add_argument("--api_concurrency", help="concurrent PubTator3 API requests", type=int, default=4)
+    parser.add_argument("--api_rate", help="PubTator3 API requests per second", type=float, default=3)
+    parser.add_argument("--api_cache_max_gb", help="size bound of the PubTator3 API cache", type=float, default=100)
+    parser.add_argument(
+        "--from-cache",
+        "--from_cache",
+        dest="from_cache",
+        help="re-derive the PubTator3 API outputs from the response cache without fetching",
+        action="store_true",
+    )
     args = parser.parse_args()
 
     in_dir_pubmed_abstract = Path(args.in_dir_pubmed_abstract)
@@ -138,8 +323,6 @@ def main():
     out_dir_local_raw.mkdir(parents=True, exist_ok=True)
     out_dir_local_raw_articles = out_dir_local_raw / "articles"
     out_dir_local_raw_articles.mkdir(parents=True, exist_ok=True)
-    out_dir_local_raw_abstracts = out_dir_local_raw / "abstracts"
-    out_dir_local_raw_abstracts.mkdir(parents=True, exist_ok=True)
     out_dir_local_bioc = out_dir_local / "bioc"
     out_dir_local_bioc.mkdir(parents=True, exist_ok=True)
     api_path = out_dir / "api"
@@ -148,137 +331,326 @@ def main():
     api_bioconcepts2pubtator3_path.mkdir(exist_ok=True)
     api_relation2pubtator3_path = api_path / "relation2pubtator3"
     api_relation2pubtator3_path.mkdir(exist_ok=True)
+    dataset_dir = Path(args.dataset_dir) if args.output_format == "parquet" else None
+    ledger = Ledger(args.ledger)
+    api_cache = ResponseCache(
+        api_path / "cache",
+        {"url": PUBTATOR3_API_URL, **PUBTATOR3_API_PARAMS},
+        max_bytes=int(args.api_cache_max_gb * 1e9),
+    )
 
     rgd_df, rgd_pmids = get_rgd_df_pmids(args.rgd_csv)
     logging.info(f"Length of rgd_df: {len(rgd_df)}")
     logging.info(f"rgd_pmid len: {len(rgd_pmids)}")
-    logging.info(f"rgd_pmid max: {max(rgd_pmids)}")
-    relation2pubtator3_df, relation2pubtator3_pmids = get_relation2pubtator3_df_pmids(args.relation2pubtator3_csv)
-    bioconcepts2pubtator3_pmids = get_bioconcepts2pubtator3_pmids(args.bioconcepts2pubtator3_csv)
-    print(f"bioconcepts2pubtator3_pmids max {max(bioconcepts2pubtator3_pmids)}")
+    logging.info(f"rgd_pmid max: {rgd_pmids.max()}")
+    if args.build_index:
+        build_pmid_index(args.relation2pubtator3_csv, args.max_workers)
+        build_pmid_index(args.bioconcepts2pubtator3_csv, args.max_workers)
+    relation2pubtator3_index = load_pmid_index(args.relation2pubtator3_csv)
+    if relation2pubtator3_index is None:
+        relation2pubtator3_df, relation2pubtator3_pmids = get_relation2pubtator3_df_pmids(
+            args.relation2pubtator3_csv, rgd_pmids
+        )
+    else:
+        relation2pubtator3_df = None
+        relation2pubtator3_pmids = PMIDSet.from_sorted(relation2pubtator3_index.pmids())
+    bioconcepts2pubtator3_pmids = get_bioconcepts2pubtator3_pmids(args.bioconcepts2pubtator3_csv, args.max_workers)
+    logging.info(f"bioconcepts2pubtator3_pmids max: {bioconcepts2pubtator3_pmids.max()}")
     # plot_venn_diagram(out_dir, rgd_pmids, relation2pubtator3_pmids, bioconcepts2pubtator3_pmids)
 
     relevant_pmids = relation2pubtator3_pmids & rgd_pmids
 
-    extract_relations(out_dir_ftp_relation2pubtator3, relation2pubtator3_df, relevant_pmids)
-    total = len([pmid for pmid in relevant_pmids if pmid in bioconcepts2pubtator3_pmids])
-    extract_bioconcepts(args.bioconcepts2pubtator3_csv, out_dir_ftp_bioconcepts2pubtator3, relevant_pmids, total)
-    relevant_in_ftp  = {pmid for pmid in rgd_pmids if pmid in bioconcepts2pubtator3_pmids}
+    extract_relations(
+        out_dir_ftp_relation2pubtator3,
+        relation2pubtator3_df,
+        relevant_pmids,
+        ledger,
+        args.relation2pubtator3_csv,
+        args.max_workers,
+        dataset_dir,
+    )
+    del relation2pubtator3_df
+    extract_bioconcepts(
+        args.bioconcepts2pubtator3_csv,
+        out_dir_ftp_bioconcepts2pubtator3,
+        relevant_pmids,
+        ledger,
+        args.max_workers,
+        dataset_dir,
+    )
+    relevant_in_ftp = rgd_pmids & bioconcepts2pubtator3_pmids
     logging.info(f"Relevant PMIDs in FTP: {len(relevant_in_ftp)}")
-    relevant_but_not_in_ftp = {pmid for pmid in rgd_pmids if pmid not in bioconcepts2pubtator3_pmids}
+    relevant_but_not_in_ftp = rgd_pmids - bioconcepts2pubtator3_pmids
     pubtator3_api_pmids = pull_from_pubtator3_api_batched(
-        relevant_but_not_in_ftp, api_bioconcepts2pubtator3_path, api_relation2pubtator3_path
+        relevant_but_not_in_ftp,
+        api_bioconcepts2pubtator3_path,
+        api_relation2pubtator3_path,
+        ledger,
+        dataset_dir,
+        args.api_concurrency,
+        args.api_rate,
+        api_cache,
+        args.from_cache,
     )
     relevant_but_not_in_pubtator3 = relevant_but_not_in_ftp - pubtator3_api_pmids
 
-    articles_pmids = copy_raw_articles(out_dir_local_raw_articles, rgd_df, relevant_but_not_in_pubtator3)
+    articles_pmids = stage_raw_articles(out_dir_local_raw_articles, rgd_df, relevant_but_not_in_pubtator3, ledger)
     remaining_pmids = relevant_but_not_in_pubtator3 - articles_pmids
-    abstract_pmids = copy_raw_dir(in_dir_pubmed_abstract, out_dir_local_raw_abstracts, remaining_pmids)
-    logging.info(f"Max Abstract PMID: {max(abstract_pmids)}")
+    abstracts_manifest_path = out_dir_local_raw / "abstracts.tsv"
+    abstract_pmids = stage_raw_abstracts(in_dir_pubmed_abstract, abstracts_manifest_path, remaining_pmids)
+    logging.info(f"Max Abstract PMID: {abstract_pmids.max()}")
 
-    convert_pmc_xml(out_dir_local_raw_articles, out_dir_local_bioc)
-    convert_abstracts(out_dir_local_raw_abstracts, out_dir_local_bioc)
+    quarantine_path = out_dir_local / "quarantine.tsv"
+    convert_pmc_xml(out_dir_local_raw_articles, out_dir_local_bioc, quarantine_path, args.max_workers)
+    convert_abstracts(abstracts_manifest_path, out_dir_local_bioc, quarantine_path, args.max_workers)
+    ledger.close()
 
 
-def copy_raw_articles(out_dir_local_raw_articles, rgd_df, pmids: set):
-    df = rgd_df[rgd_df["PMID"].isin(pmids)]
+def stage_raw_articles(out_dir_local_raw_articles, rgd_df, pmids: PMIDSet, ledger: Ledger, io_workers: int = 32):
+    stage = get_stage(out_dir_local_raw_articles)
+    ledger.adopt_dir(stage, out_dir_local_raw_articles, (".xml", ".xml.gz"))
+    clean_stage(ledger, stage, pmids)
+    df = rgd_df[ledger.pending(stage, pmids).isin(rgd_df["PMID"])]
     df = df[df["article_path"].notnull()]
 
-    logging.info(f"Cleaning {out_dir_local_raw_articles}")
-    cleaned = 0
-    for path in out_dir_local_raw_articles.glob("*.xml"):
-        pmid = int(path.stem)
-        if pmid not in pmids:
-            path.unlink()
-            cleaned += 1
-    logging.info(f"Cleaned {cleaned} irrelevant PMID articles from {out_dir_local_raw_articles}")
-
-    logging.info(f"Copying {len(df)} articles to {out_dir_local_raw_articles}")
-    copied_pmids = set()
-    for pmid, article_path in tqdm(zip(df["PMID"], df["article_path"]), total=len(df)):
-        copied_pmid = copy_raw(Path(article_path), out_dir_local_raw_articles, pmid)
-        if copied_pmid:
-            copied_pmids.add(pmid)
-    return copied_pmids
-
-
-def copy_raw_dir(in_dir_pubmed_article: Path, out_dir_local: Path, pmids: set):
-    logging.info(
-        f"Cleaning {out_dir_local}"
+    logging.info(f"Linking {len(df)} articles into {out_dir_local_raw_articles}")
+    staged_paths = thread_map(
+        stage_raw,
+        [Path(article_path) for article_path in df["article_path"]],
+        [out_dir_local_raw_articles] * len(df),
+        df["PMID"].tolist(),
+        chunksize=64,
+        max_workers=io_workers,
     )
-    cleaned = 0
-    for path in out_dir_local.glob("*.xml"):
-        pmid = int(path.stem)
-        if pmid not in pmids:
-            path.unlink()
-            cleaned += 1
-    logging.info(f"Cleaned {cleaned} irrelevant PMID articles from {out_dir_local}")
-
-    logging.info(
-        f"Copying {len(pmids)} from {in_dir_pubmed_article} to {out_dir_local}"
+    ledger.record(
+        stage, [(pmid, path, None) for pmid, path in zip(df["PMID"].tolist(), staged_paths) if path is not None]
     )
-    out_dir_local.mkdir(exist_ok=True)
-    articles_pmids = set()
-    for pmid in tqdm(pmids):
-        padded_pmid = f"{pmid:08d}"
-        in_pubmed_path = (
-            in_dir_pubmed_article / padded_pmid[0:2] / padded_pmid[2:4] / padded_pmid[4:6] / f"{pmid}.xml.gz"
-        )
-        pmid_copied = copy_raw(in_pubmed_path, out_dir_local, pmid)
-        if pmid_copied:
-            articles_pmids.add(pmid_copied)
-    logging.info(f"Copied {len(articles_pmids)} to {out_dir_local}")
-    return articles_pmids
+    return ledger.pmids(stage) & pmids
+
 
+def stage_raw_abstracts(in_dir_pubmed_abstract: Path, manifest_path: Path, pmids: PMIDSet, io_workers: int = 32):
+    # the converters read the archive in place, so staging only records which sources exist
+    logging.info(f"Staging {len(pmids)} abstracts from {in_dir_pubmed_abstract} into {manifest_path}")
+    paths = [get_pubmed_abstract_path(in_dir_pubmed_abstract, pmid) for pmid in pmids]
+    exists = thread_map(os.path.exists, paths, chunksize=1024, max_workers=io_workers)
+    manifest = [(pmid, path) for pmid, path, found in zip(pmids, paths, exists) if found]
+    for pmid, path, found in zip(pmids, paths, exists):
+        if not found:
+            logging.warning(f"Could not find {path}")
+    write_manifest(manifest_path, manifest)
+    logging.info(f"Staged {len(manifest)} abstracts in {manifest_path}")
+    return PMIDSet([pmid for pmid, _ in manifest])
 
-def copy_raw(in_pubmed_path: Path, out_dir_local: Path, pmid: int):
+
+def get_pubmed_abstract_path(in_dir_pubmed_abstract: Path, pmid: int):
+    padded_pmid = f"{pmid:08d}"
+    return in_dir_pubmed_abstract / padded_pmid[0:2] / padded_pmid[2:4] / padded_pmid[4:6] / f"{pmid}.xml.gz"
+
+
+def stage_raw(in_path: Path, out_dir_local: Path, pmid: int):
+    # the source keeps its compression, the converters decompress while parsing
+    out_path = out_dir_local / (f"{pmid}.xml.gz" if in_path.suffix == ".gz" else f"{pmid}.xml")
     try:
-        out_pubmed_path = out_dir_local / f"{pmid}.xml"
-        if out_pubmed_path.stat().st_size == 0:
-            out_pubmed_path.unlink()
-        if not out_pubmed_path.exists():
-            if in_pubmed_path.suffix == ".gz":
-                with gzip.open(in_pubmed_path, "rb") as f_in:
-                    with open(out_pubmed_path, "wb") as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-            else:
-                with open(in_pubmed_path, "rb") as f_in:
-                    with open(out_pubmed_path, "wb") as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-        return pmid
+        if out_path.exists() and out_path.stat().st_size == 0:
+            out_path.unlink()
+        if not out_path.exists():
+            link_or_copy(in_path, out_path)
+        return out_path
     except FileNotFoundError:
-        logging.warning(f"Could not find {in_pubmed_path}")
+        logging.warning(f"Could not find {in_path}")
+
+
+def link_or_copy(src: Path, dst: Path):
+    tmp_path = dst.with_name(f".{dst.name}.tmp")
+    try:
+        os.link(src, tmp_path)
+    except OSError as e:
+        if isinstance(e, FileNotFoundError):
+            raise
+        # hardlinks cannot cross filesystems, fall back to a reflink where the filesystem supports it
+        with open(src, "rb") as f_in, open(tmp_path, "wb") as f_out:
+            try:
+                fcntl.ioctl(f_out.fileno(), FICLONE, f_in.fileno())
+            except OSError:
+                shutil.copyfileobj(f_in, f_out)
+    os.replace(tmp_path, dst)
 
 
 def extract_bioconcepts(
-    bioconcepts2pubtator3_csv: Path, out_dir_ftp_bioconcepts2pubtator3: Path, relevant_pmids: set, total: int
+    bioconcepts2pubtator3_csv: Path,
+    out_dir_ftp_bioconcepts2pubtator3: Path,
+    relevant_pmids: set,
+    ledger: Ledger,
+    max_workers: int = os.cpu_count(),
+    dataset_dir: Path = None,
 ):
-    logging.info(f"Cleaning {out_dir_ftp_bioconcepts2pubtator3}")
-    cleaned = 0
-    for path in tqdm(out_dir_ftp_bioconcepts2pubtator3.glob("*.tsv")):
-        if int(path.stem) not in relevant_pmids:
-            path.unlink()
-            cleaned += 1
-    logging.info(f"Cleaned {cleaned} irrelevant PMID bioconcepts from {out_dir_ftp_bioconcepts2pubtator3}")
+    stage = get_stage(out_dir_ftp_bioconcepts2pubtator3)
+    ledger.adopt_dir(stage, out_dir_ftp_bioconcepts2pubtator3, ".tsv")
+    clean_stage(ledger, stage, relevant_pmids)
+    if dataset_dir is not None:
+        relevant_pmids = as_pmid_set(relevant_pmids) - read_dataset_pmids(
+            dataset_dir, "bioconcepts2pubtator3", ["ftp"]
+        )
+    else:
+        relevant_pmids = ledger.pending(stage, relevant_pmids)
     logging.info(f"Extracting {len(relevant_pmids)} relevant PMID bioconcepts to {out_dir_ftp_bioconcepts2pubtator3}")
-    with tqdm(total=total) as pbar, pd.read_csv(
-        bioconcepts2pubtator3_csv,
-        sep="\t",
-        header=None,
-        names=["PMID", "Type", "Concept ID", "Mentions", "Resource"],
-        dtype={"PMID": int},
-        chunksize=1e6,
-    ) as reader:
-        buffer_df = pd.DataFrame()
-        for chunk in reader:
-            chunk_pmids = set(chunk["PMID"])
-            buffer_df = pd.concat([buffer_df, chunk[chunk["PMID"].isin(relevant_pmids)]])
-            to_export = buffer_df[~buffer_df["PMID"].isin(chunk_pmids)]
-            buffer_df = buffer_df[buffer_df["PMID"].isin(chunk_pmids)]
-            group_by_pmid_to_tsv(out_dir_ftp_bioconcepts2pubtator3, to_export, False)
-            pbar.update(len(to_export["PMID"].unique()))
-        group_by_pmid_to_tsv(out_dir_ftp_bioconcepts2pubtator3, buffer_df, progress_bar=False)
-        pbar.update(len(buffer_df["PMID"].unique()))
+    if load_pmid_index(bioconcepts2pubtator3_csv) is not None:
+        records = extract_pmids_indexed(
+            bioconcepts2pubtator3_csv,
+            out_dir_ftp_bioconcepts2pubtator3,
+            relevant_pmids,
+            "bioconcepts2pubtator3",
+            max_workers,
+            dataset_dir,
+        )
+        if dataset_dir is None:
+            ledger.record(stage, records)
+        return
+    ranges = split_pmid_aligned(bioconcepts2pubtator3_csv, max_workers * 4)
+    relevant_pmids = frozenset(relevant_pmids)
+    records = process_map(
+        extract_bioconcepts_range,
+        [bioconcepts2pubtator3_csv] * len(ranges),
+        [start for start, _ in ranges],
+        [end for _, end in ranges],
+        [out_dir_ftp_bioconcepts2pubtator3] * len(ranges),
+        [relevant_pmids] * len(ranges),
+        [dataset_dir] * len(ranges),
+        chunksize=1,
+        max_workers=max_workers,
+    )
+    if dataset_dir is None:
+        records = gather_split_pmids(bioconcepts2pubtator3_csv, out_dir_ftp_bioconcepts2pubtator3, records)
+    records = [record for range_records in records for record in range_records]
+    if dataset_dir is None:
+        ledger.record(stage, records)
+    logging.info(f"Extracted {len(records)} PMID bioconcepts to {out_dir_ftp_bioconcepts2pubtator3}")
+
+
+def gather_split_pmids(bioconcepts2pubtator3_csv: Path, out_dir: Path, records: list):
+    # the ranges assume the rows of a PMID are contiguous in the dump; a PMID found by more than one range
+    # only has the rows of the first range in its file, so its rows are gathered again in one pass
+    range_counts = Counter(pmid for range_records in records for pmid in {record[0] for record in range_records})
+    split_pmids = frozenset(pmid for pmid, count in range_counts.items() if count > 1)
+    if not split_pmids:
+        return records
+    logging.warning(f"Found {len(split_pmids)} PMIDs with non-contiguous rows in {bioconcepts2pubtator3_csv}")
+    for pmid in split_pmids:
+        (out_dir / f"{pmid}.tsv").unlink(missing_ok=True)
+    records = [[record for record in range_records if record[0] not in split_pmids] for range_records in records]
+    size = os.path.getsize(bioconcepts2pubtator3_csv)
+    return records + [extract_bioconcepts_range(bioconcepts2pubtator3_csv, 0, size, out_dir, split_pmids)]
+
+
+def extract_bioconcepts_range(
+    bioconcepts2pubtator3_csv: Path,
+    start: int,
+    end: int,
+    out_dir: Path,
+    relevant_pmids: frozenset,
+    dataset_dir: Path = None,
+):
+    # by PMID, rows of a PMID found again later in the range are appended to the file written before
+    records = {}
+    pmid = None
+    current_pmid = None
+    rows = []
+    writer = DatasetWriter(dataset_dir, "bioconcepts2pubtator3", "ftp") if dataset_dir is not None else None
+
+    def flush():
+        data = b"".join(rows)
+        records[pmid] = write_pmid_rows(out_dir, pmid, data, BIOCONCEPTS2PUBTATOR3_HEADER, writer, pmid in records)
+
+    with open(bioconcepts2pubtator3_csv, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        mm.seek(start)
+        while mm.tell() < end:
+            offset = mm.tell()
+            line = mm.readline()
+            if not line.strip():
+                continue
+            if not line.endswith(b"\n"):
+                line += b"\n"
+            tab = line.find(b"\t")
+            pmid_bytes = line[:tab]
+            if tab == -1 or not pmid_bytes.isdigit():
+                logging.warning(f"Skipping malformed line at byte {offset} of {bioconcepts2pubtator3_csv}: {line!r}")
+                continue
+            if pmid_bytes != current_pmid:
+                if rows:
+                    flush()
+                current_pmid = pmid_bytes
+                pmid = int(pmid_bytes)
+                rows = [] if pmid in relevant_pmids else None
+            if rows is not None:
+                rows.append(line)
+        if rows:
+            flush()
+    if writer is not None:
+        writer.close()
+    return list(records.values())
+
+
+def extract_pmids_indexed(
+    dump_path: Path, out_dir: Path, relevant_pmids: set, table: str, max_workers: int, dataset_dir: Path = None
+):
+    index = load_pmid_index(dump_path)
+    pmids = index.pmids()
+    pmids = pmids[as_pmid_set(relevant_pmids).isin(pmids)]
+    logging.info(f"Seeking to {len(pmids)} indexed PMIDs in {dump_path}")
+    pmid_batches = [pmid_batch.tolist() for pmid_batch in np.array_split(pmids, max_workers * 4) if len(pmid_batch)]
+    records = process_map(
+        extract_pmids_indexed_batch,
+        [dump_path] * len(pmid_batches),
+        pmid_batches,
+        [out_dir] * len(pmid_batches),
+        [table] * len(pmid_batches),
+        [dataset_dir] * len(pmid_batches),
+        chunksize=1,
+        max_workers=max_workers,
+    )
+    records = [record for batch_records in records for record in batch_records]
+    logging.info(f"Extracted {len(records)} PMIDs from {dump_path} to {out_dir}")
+    return records
+
+
+def extract_pmids_indexed_batch(dump_path: Path, pmids: list, out_dir: Path, table: str, dataset_dir: Path = None):
+    index = load_pmid_index(dump_path)
+    records = []
+    writer = DatasetWriter(dataset_dir, table, "ftp") if dataset_dir is not None else None
+    with open(dump_path, "rb") as f:
+        for pmid in pmids:
+            if writer is None and (path := out_dir / f"{pmid}.tsv").exists():
+                records.append((pmid, path, None))
+                continue
+            data = index.read(pmid, f)
+            if not data.endswith(b"\n"):
+                data += b"\n"
+            records.append(write_pmid_rows(out_dir, pmid, data, TSV_HEADERS[table], writer))
+    if writer is not None:
+        writer.close()
+    return records
+
+
+def write_pmid_rows(
+    out_dir: Path, pmid: int, data: bytes, header: bytes, writer: DatasetWriter = None, append: bool = False
+):
+    if writer is not None:
+        writer.write_lines(data)
+        return pmid, None, None
+    path = out_dir / f"{pmid}.tsv"
+    if append:
+        # more rows of a PMID whose file was written earlier in the same scan
+        with open(path, "ab") as f:
+            f.write(data)
+        return pmid, path, content_hash(path.read_bytes())
+    if path.exists():
+        return pmid, path, None
+    tmp_path = path.with_suffix(".tsv.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(data)
+    tmp_path.rename(path)
+    return pmid, path, content_hash(header + data)
 
 
 def batch(iterable, n=1):
@@ -287,132 +659,273 @@ def batch(iterable, n=1):
         yield iterable[ndx : min(ndx + n, l)]
 
 
-def pull_from_pubtator3_api_batched(pmids: set, api_bioconcepts2pubtator3_path, api_relation2pubtator3_path):
+def pull_from_pubtator3_api_batched(
+    pmids: PMIDSet,
+    api_bioconcepts2pubtator3_path,
+    api_relation2pubtator3_path,
+    ledger: Ledger,
+    dataset_dir: Path = None,
+    concurrency: int = 4,
+    rate: float = 3,
+    cache: ResponseCache = None,
+    from_cache: bool = False,
+):
     PUBTATOR3_PMID_CUTOFF = 38506922
-    fetchable_pmids = {pmid for pmid in pmids if pmid <= PUBTATOR3_PMID_CUTOFF}
+    pmids = as_pmid_set(pmids)
+    fetchable_pmids = PMIDSet.from_sorted(pmids.pmids[pmids.pmids <= PUBTATOR3_PMID_CUTOFF])
     logging.info(f"{len(fetchable_pmids)} PMIDs fetchable from PubTator3 API")
-    fetched_paths = set(api_bioconcepts2pubtator3_path.glob("*.tsv"))
-    fetched_pmids = set(map(lambda x: int(x.stem), fetched_paths))
-    logging.info(f"Cleaning {api_bioconcepts2pubtator3_path}")
-    cleaned = 0
-    for pmid in fetched_pmids - fetchable_pmids:
-        path = api_bioconcepts2pubtator3_path / f"{pmid}.tsv"
-        path.unlink()
-        cleaned += 1
-    logging.info(f"Cleaned {cleaned} irrelevant PMID bioconcepts from {api_bioconcepts2pubtator3_path}")
+    stages = (get_stage(api_bioconcepts2pubtator3_path), get_stage(api_relation2pubtator3_path))
+    ledger.adopt_dir(stages[0], api_bioconcepts2pubtator3_path, ".tsv")
+    ledger.adopt_dir(stages[1], api_relation2pubtator3_path, ".tsv")
+    clean_stage(ledger, stages[0], fetchable_pmids)
+    fetched_pmids = ledger.pmids(stages[0])
+    if dataset_dir is not None:
+        fetched_pmids |= read_dataset_pmids(dataset_dir, "bioconcepts2pubtator3", ["api"])
     logging.info(f"Aleady fetched {len(fetched_pmids)} PMIDs from PubTator3 API")
-    not_fetched_pmids = fetchable_pmids - fetched_pmids
-    not_fetched_pmids = list(map(str, not_fetched_pmids))
-    logging.info(f"Fetching {len(not_fetched_pmids)} PMIDs from PubTator3 API")
-    for pmid_batch in tqdm(batch(not_fetched_pmids, 100), total=len(not_fetched_pmids) // 100):
-        pull_from_pubtator3_api(pmid_batch, api_bioconcepts2pubtator3_path, api_relation2pubtator3_path)
+    writers = ()
+    if dataset_dir is not None:
+        writers = (
+            DatasetWriter(dataset_dir, "bioconcepts2pubtator3", "api"),
+            DatasetWriter(dataset_dir, "relation2pubtator3", "api"),
+        )
+
+    def record(records: list):
+        if dataset_dir is None:
+            for stage, stage_records in zip(stages, zip(*records)):
+                ledger.record(stage, [record for record in stage_records if record[1] is not None])
+
+    if from_cache:
+        try:
+            record(
+                rederive_from_pubtator3_api_cache(
+                    fetchable_pmids, cache, api_bioconcepts2pubtator3_path, api_relation2pubtator3_path, writers
+                )
+            )
+        finally:
+            for writer in writers:
+                writer.close()
+        return fetchable_pmids
+
+    # batches are cut from all fetchable PMIDs before the fetched ones are dropped, so a batch that was cached but
+    # not processed before an interruption has the same PMIDs when resuming and is found in the cache
+    not_fetched = ~fetched_pmids.isin(fetchable_pmids.pmids)
+    pmid_batches = [
+        pmid_batch[batch_not_fetched].tolist()
+        for pmid_batch, batch_not_fetched in zip(batch(fetchable_pmids.pmids, 100), batch(not_fetched, 100))
+        if batch_not_fetched.any()
+    ]
+    logging.info(f"Fetching {int(not_fetched.sum())} PMIDs from PubTator3 API")
+
+    def process_response(pmids: list, text: str):
+        # the raw response is cached as fetched, so it can be derived again without depending on a re-serialization
+        if cache is not None and pmids not in cache:
+            cache.put(pmids, text)
+        records = process_pubtator3_api_response(
+            text, api_bioconcepts2pubtator3_path, api_relation2pubtator3_path, writers
+        )
+        record(
+            records
+            + process_pubtator3_api_missing(
+                pmids, records, api_bioconcepts2pubtator3_path, api_relation2pubtator3_path, writers
+            )
+        )
+
+    try:
+        asyncio.run(
+            fetch_pubtator3_api(
+                pmid_batches,
+                process_response,
+                api_bioconcepts2pubtator3_path.parent / "checkpoint.txt",
+                concurrency=concurrency,
+                rate=rate,
+                relevant_pmids=fetchable_pmids,
+                cache=cache,
+            )
+        )
+    finally:
+        for writer in writers:
+            writer.close()
     return fetchable_pmids
 
 
-def pull_from_pubtator3_api(pmids: set, api_bioconcepts2pubtator3_path, api_relation2pubtator3_path):
-    url = f"https://www.ncbi.nlm.nih.gov/research/pubtator3-api/publications/export/biocxml?pmids={','.join(pmids)}&full=true"
-    logging.info(url)
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception(f"Failed to pull {pmids} from PubTator3 API")
-    collection = bioc.loads(response.text)
-    for document in collection.documents:
-        process_document_from_pubtator3_api(api_bioconcepts2pubtator3_path, api_relation2pubtator3_path, document)
+def rederive_from_pubtator3_api_cache(
+    pmids: PMIDSet, cache: ResponseCache, api_bioconcepts2pubtator3_path, api_relation2pubtator3_path, writers=()
+):
+    # the cache holds whole responses, so every one is read and only the documents of pending PMIDs are derived,
+    # each once even if it was fetched again in a later request
+    logging.info(f"Re-deriving {len(pmids)} PMIDs from PubTator3 API cache {cache.cache_dir}")
+    pending = set(as_pmid_set(pmids))
+    records = []
+    for text in tqdm(cache.iter_responses()):
+        documents = []
+        for document in biocio.loads(text, strings=StringTable()).documents:
+            pmid = str(get_document_pmid(document))
+            if pmid.isdigit() and int(pmid) in pending:
+                pending.discard(int(pmid))
+                documents.append(document)
+        records += process_pubtator3_api_documents(
+            documents, api_bioconcepts2pubtator3_path, api_relation2pubtator3_path, writers
+        )
+    logging.info(f"{len(pending)} PMIDs were not in the PubTator3 API cache")
+    return records
+
+
+def process_pubtator3_api_response(text: str, api_bioconcepts2pubtator3_path, api_relation2pubtator3_path, writers=()):
+    collection = biocio.loads(text, strings=StringTable())
+    return process_pubtator3_api_documents(
+        collection.documents, api_bioconcepts2pubtator3_path, api_relation2pubtator3_path, writers
+    )
+
 
+def process_pubtator3_api_missing(
+    pmids: list, records: list, api_bioconcepts2pubtator3_path, api_relation2pubtator3_path, writers=()
+):
+    # requested PMIDs without a document in the response are written like documents without annotations, so the
+    # ledger or dataset agrees with the checkpoint that they were fetched
+    returned = {str(bioconcepts_record[0]) for bioconcepts_record, _ in records}
+    return [
+        emit_document(
+            api_bioconcepts2pubtator3_path / f"{pmid}.tsv",
+            api_relation2pubtator3_path / f"{pmid}.tsv",
+            pmid,
+            [],
+            [],
+            *writers,
+        )
+        for pmid in pmids
+        if str(pmid) not in returned
+    ]
+
+
+def process_pubtator3_api_documents(
+    documents, api_bioconcepts2pubtator3_path, api_relation2pubtator3_path, writers=()
+):
+    return [
+        process_document_from_pubtator3_api(
+            api_bioconcepts2pubtator3_path, api_relation2pubtator3_path, document, *writers
+        )
+        for document in documents
+    ]
 
-def process_document_from_pubtator3_api(api_bioconcepts2pubtator3_path, api_relation2pubtator3_path, document):
+
+def get_document_pmid(document):
     pmid = document.id
-    annotations = []
     for passage in document.passages:
         if article_id_pmid := passage.infons.get("article-id_pmid"):
             pmid = article_id_pmid
-        for annotation in passage.annotations:
-            annotations.append(
-                {
-                    "PMID": pmid,
-                    "Type": annotation.infons["type"],
-                    "Concept ID": annotation.infons.get("identifier"),
-                    "Mentions": annotation.text,
-                    "Resource": "PubTator3",
-                }
-            )
-    if not annotations:
-        (api_bioconcepts2pubtator3_path / f"{pmid}.tsv").touch()
-        return
-    annotation_df = pd.DataFrame(annotations)
-    annotation_df = (
-        annotation_df.groupby(["PMID", "Type", "Concept ID", "Resource"])["Mentions"]
-        .apply(lambda x: "|".join(set(x)))
-        .reset_index()
+    return pmid
+
+
+def process_document_from_pubtator3_api(
+    api_bioconcepts2pubtator3_path,
+    api_relation2pubtator3_path,
+    document,
+    bioconcepts_writer: DatasetWriter = None,
+    relation_writer: DatasetWriter = None,
+):
+    # an article-id_pmid infon overrides the document id from its passage on, like in get_document_pmid
+    pmid = document.id
+    strings = get_string_table(document.passages)
+    segments = []
+    for passage in document.passages:
+        if article_id_pmid := passage.infons.get("article-id_pmid"):
+            pmid = article_id_pmid
+        segments.append((pmid, as_annotation_array(passage, strings)))
+    return emit_document(
+        api_bioconcepts2pubtator3_path / f"{pmid}.tsv",
+        api_relation2pubtator3_path / f"{pmid}.tsv",
+        pmid,
+        segments,
+        document.relations,
+        bioconcepts_writer,
+        relation_writer,
     )
-    annotation_df.to_csv(api_bioconcepts2pubtator3_path / f"{pmid}.tsv", sep="\t", index=False)
-    relations = []
-    relation_type_map = {
-        "Association": "associate",
-        "Bind": "interact",
-        "Cause": "cause",
-        "Comparison": "compare",
-        "Cotreatment": "cotreat",
-        "Drug_Interaction": "drug_interact",
-        "Inhibit": "inhibit",
-        "Interact": "interact",
-        "Negative_Correlation": "negative_correlate",
-        "Positive_Correlation": "positive_correlate",
-        "Prevent": "prevent",
-        "Stimulate": "stimulate",
-        "Treatment": "treat",
-    }
-    for relation in document.relations:
-        try:
-            relations.append(
-                {
-                    "PMID": pmid,
-                    "Type": relation_type_map[relation.infons["type"]],
-                    "1st": relation.infons["role1"],
-                    "2nd": relation.infons["role2"],
-                }
-            )
-        except KeyError as e:
-            logging.error(pmid)
-            raise e
-    if not relations:
-        return
-    df = pd.DataFrame(relations)
-    df.to_csv(api_relation2pubtator3_path / f"{pmid}.tsv", sep="\t", index=False)
 
 
 def group_by_pmid_to_tsv(out_dir: Path, df, progress_bar=True):
     iter = df.groupby("PMID")
     if progress_bar:
         iter = tqdm(iter)
+    records = []
     for pmid, group in iter:
         path = out_dir / f"{pmid}.tsv"
+        records.append((pmid, path, None))
         if path.exists():
             continue
         group.to_csv(path, sep="\t", index=False)
+    return records
 
 
-def extract_relations(out_dir_ftp_relation2pubtator3: Path, relation2pubtator3_df: pd.DataFrame, relevant_pmids: set):
-    logging.info(f"Cleaning {out_dir_ftp_relation2pubtator3}")
-    cleaned = 0
-    for path in tqdm(out_dir_ftp_relation2pubtator3.glob("*.tsv")):
-        if int(path.stem) not in relevant_pmids:
-            path.unlink()
-            cleaned += 1
-    logging.info(f"Cleaned {cleaned} irrelevant PMID relations from {out_dir_ftp_relation2pubtator3}")
+def extract_relations(
+    out_dir_ftp_relation2pubtator3: Path,
+    relation2pubtator3_df: pd.DataFrame,
+    relevant_pmids: set,
+    ledger: Ledger,
+    relation2pubtator3_csv: Path = None,
+    max_workers: int = os.cpu_count(),
+    dataset_dir: Path = None,
+):
+    stage = get_stage(out_dir_ftp_relation2pubtator3)
+    ledger.adopt_dir(stage, out_dir_ftp_relation2pubtator3, ".tsv")
+    clean_stage(ledger, stage, relevant_pmids)
+    if dataset_dir is not None:
+        relevant_pmids = as_pmid_set(relevant_pmids) - read_dataset_pmids(dataset_dir, "relation2pubtator3", ["ftp"])
+    else:
+        relevant_pmids = ledger.pending(stage, relevant_pmids)
     logging.info(f"Extracting {len(relevant_pmids)} relevant PMID relations to {out_dir_ftp_relation2pubtator3}")
-    rgd_relation2pubtator3_df = relation2pubtator3_df[relation2pubtator3_df["PMID"].isin(relevant_pmids)]
-    group_by_pmid_to_tsv(out_dir_ftp_relation2pubtator3, rgd_relation2pubtator3_df)
+    if relation2pubtator3_df is None:
+        records = extract_pmids_indexed(
+            relation2pubtator3_csv,
+            out_dir_ftp_relation2pubtator3,
+            relevant_pmids,
+            "relation2pubtator3",
+            max_workers,
+            dataset_dir,
+        )
+        if dataset_dir is None:
+            ledger.record(stage, records)
+        return
+    rgd_relation2pubtator3_df = relation2pubtator3_df[as_pmid_set(relevant_pmids).isin(relation2pubtator3_df["PMID"])]
+    if dataset_dir is not None:
+        with DatasetWriter(dataset_dir, "relation2pubtator3", "ftp") as writer:
+            writer.write_df(rgd_relation2pubtator3_df)
+        return
+    ledger.record(stage, group_by_pmid_to_tsv(out_dir_ftp_relation2pubtator3, rgd_relation2pubtator3_df))
+
 
+def clean_stage(ledger: Ledger, stage: str, relevant_pmids: PMIDSet):
+    stale_pmids = ledger.pmids(stage) - relevant_pmids
+    for path in ledger.forget(stage, stale_pmids):
+        path.unlink(missing_ok=True)
+    logging.info(f"Cleaned {len(stale_pmids)} irrelevant PMIDs from {stage}")
 
-def plot_venn_diagram(out_dir: Path, rgd_pmids: set, relation2pubtator3_pmids: set, bioconcepts2pubtator3_pmids: set):
+
+def plot_venn_diagram(
+    out_dir: Path, rgd_pmids: PMIDSet, relation2pubtator3_pmids: PMIDSet, bioconcepts2pubtator3_pmids: PMIDSet
+):
     venn_diagram_path = out_dir / "venn.png"
     logging.info(f"Plotted venn diagram of PMIDs to {venn_diagram_path}")
     labels = ("bioconcepts2pubtator3", "rgd", "relation2pubtator3")
     plt.figure(figsize=(10, 10))
-    venn3([bioconcepts2pubtator3_pmids, rgd_pmids, relation2pubtator3_pmids], labels)
+    venn3(get_venn3_subsets(bioconcepts2pubtator3_pmids, rgd_pmids, relation2pubtator3_pmids), labels)
     plt.savefig(venn_diagram_path)
 
 
+def get_venn3_subsets(a: PMIDSet, b: PMIDSet, c: PMIDSet):
+    ab = a & b
+    ac = a & c
+    bc = b & c
+    abc = ab & c
+    return (
+        len(a) - len(ab) - len(ac) + len(abc),
+        len(b) - len(ab) - len(bc) + len(abc),
+        len(ab) - len(abc),
+        len(c) - len(ac) - len(bc) + len(abc),
+        len(ac) - len(abc),
+        len(bc) - len(abc),
+        len(abc),
+    )
+
+
 if __name__ == "__main__":
     main()
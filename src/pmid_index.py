@@ -0,0 +1,205 @@
+import argparse
+import logging
+import mmap
+import os
+import sys
+from array import array
+from pathlib import Path
+
+import numpy as np
+from tqdm.contrib.concurrent import process_map
+
+INDEX_DTYPE = np.dtype([("pmid", "<u4"), ("start", "<u8"), ("end", "<u8")])
+
+
+def get_index_path(dump_path: Path):
+    return Path(f"{dump_path}.pmidx.npy")
+
+
+def split_pmid_aligned(path: Path, n_splits: int):
+    # rows of a PMID are contiguous in the FTP dumps, so each range can be scanned independently
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    offsets = [0]
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for i in range(1, n_splits):
+            offset = next_pmid_boundary(mm, max(size * i // n_splits, offsets[-1]))
+            if offset >= size:
+                break
+            if offset > offsets[-1]:
+                offsets.append(offset)
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def next_pmid_boundary(mm: mmap.mmap, offset: int):
+    if offset == 0:
+        return 0
+    newline = mm.find(b"\n", offset - 1)
+    if newline == -1:
+        return len(mm)
+    offset = newline + 1
+    pmid = get_previous_pmid(mm, newline)
+    # blank lines stay with the rows before them, so a PMID is never split at one
+    while offset < len(mm):
+        newline = mm.find(b"\n", offset)
+        if newline == -1:
+            return len(mm)
+        tab = mm.find(b"\t", offset, newline)
+        if tab != -1 and mm[offset:tab] != pmid:
+            break
+        offset = newline + 1
+    return offset
+
+
+def get_previous_pmid(mm: mmap.mmap, newline: int):
+    # the PMID of the last row ending at or before ``newline``, skipping blank lines
+    while newline >= 0:
+        line_start = mm.rfind(b"\n", 0, newline) + 1
+        tab = mm.find(b"\t", line_start, newline)
+        if tab != -1:
+            return mm[line_start:tab]
+        newline = line_start - 1
+    return None
+
+
+def parse_pmid(field: bytes):
+    try:
+        pmid = int(field)
+    except ValueError:
+        return None
+    return pmid if 0 <= pmid < 2**32 else None
+
+
+def index_range(dump_path: Path, start: int, end: int):
+    pmids = array("I")
+    starts = array("Q")
+    ends = array("Q")
+    current_pmid = None
+    with open(dump_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        mm.seek(start)
+        offset = start
+        while offset < end:
+            line = mm.readline()
+            tab = line.find(b"\t")
+            pmid = parse_pmid(line[:tab]) if tab != -1 else None
+            if tab == -1 and not line.strip():
+                # a blank line ends the run, a PMID continued after it gets another run
+                if current_pmid is not None:
+                    ends.append(offset)
+                current_pmid = None
+            elif pmid is None:
+                # e.g. a truncated line or a header, it ends the run before it and is left out of every run
+                logging.warning(f"Skipping malformed line at byte {offset} of {dump_path}: {line!r}")
+                if current_pmid is not None:
+                    ends.append(offset)
+                current_pmid = None
+            elif line[:tab] != current_pmid:
+                if current_pmid is not None:
+                    ends.append(offset)
+                current_pmid = line[:tab]
+                pmids.append(pmid)
+                starts.append(offset)
+            offset += len(line)
+        if current_pmid is not None:
+            ends.append(offset)
+    index = np.empty(len(pmids), dtype=INDEX_DTYPE)
+    index["pmid"] = pmids
+    index["start"] = starts
+    index["end"] = ends
+    return index
+
+
+def build_pmid_index(dump_path: Path, max_workers: int = os.cpu_count()):
+    index_path = get_index_path(dump_path)
+    logging.info(f"Building PMID index of {dump_path} to {index_path}")
+    ranges = split_pmid_aligned(dump_path, max_workers * 4)
+    indexes = process_map(
+        index_range,
+        [dump_path] * len(ranges),
+        [start for start, _ in ranges],
+        [end for _, end in ranges],
+        chunksize=1,
+        max_workers=max_workers,
+    )
+    index = np.concatenate(indexes) if indexes else np.empty(0, dtype=INDEX_DTYPE)
+    # a PMID split over several runs keeps one entry per run, ordered by offset
+    index = index[np.argsort(index["pmid"], kind="stable")]
+    tmp_path = index_path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, index)
+    os.replace(tmp_path, index_path)
+    logging.info(f"Indexed {len(index)} PMID runs in {dump_path}")
+    return PMIDIndex(dump_path, index)
+
+
+def load_pmid_index(dump_path: Path):
+    index_path = get_index_path(dump_path)
+    if not index_path.exists():
+        return None
+    if index_path.stat().st_mtime < os.path.getmtime(dump_path):
+        logging.warning(f"Ignoring stale PMID index {index_path}")
+        return None
+    return PMIDIndex(dump_path, np.load(index_path, mmap_mode="r"))
+
+
+class PMIDIndex:
+    def __init__(self, dump_path: Path, index: np.ndarray):
+        self.dump_path = dump_path
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, pmid: int):
+        i = np.searchsorted(self.index["pmid"], pmid)
+        return i < len(self.index) and self.index["pmid"][i] == pmid
+
+    def pmids(self):
+        pmids = np.asarray(self.index["pmid"])
+        if len(pmids) == 0:
+            return pmids
+        return pmids[np.concatenate(([True], pmids[1:] != pmids[:-1]))]
+
+    def lookup(self, pmids):
+        pmids = np.unique(np.fromiter(pmids, dtype=INDEX_DTYPE["pmid"]))
+        entries = self.index[np.isin(self.index["pmid"], pmids)]
+        return entries[np.argsort(entries["start"], kind="stable")]
+
+    def ranges(self, pmid: int):
+        lo, hi = np.searchsorted(self.index["pmid"], [pmid, pmid + 1])
+        return [(int(entry["start"]), int(entry["end"])) for entry in self.index[lo:hi]]
+
+    def read(self, pmid: int, f=None):
+        if f is None:
+            with open(self.dump_path, "rb") as f:
+                return self.read(pmid, f)
+        data = []
+        for start, end in self.ranges(pmid):
+            f.seek(start)
+            data.append(f.read(end - start))
+        return b"".join(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query a byte-offset PMID index of a PubTator3 FTP dump")
+    parser.add_argument("dump", help="relation2pubtator3 or bioconcepts2pubtator3 dump")
+    parser.add_argument("pmids", nargs="*", type=int, help="PMIDs to print the rows of")
+    parser.add_argument("--build", action="store_true", help="(re)build the index")
+    parser.add_argument("--max_workers", help="worker processes", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    dump_path = Path(args.dump)
+    index = load_pmid_index(dump_path)
+    if args.build or index is None:
+        index = build_pmid_index(dump_path, args.max_workers)
+    with open(dump_path, "rb") as f:
+        for pmid in args.pmids:
+            sys.stdout.buffer.write(index.read(pmid, f))
+
+
+if __name__ == "__main__":
+    main()
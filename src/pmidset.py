@@ -0,0 +1,117 @@
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+from tqdm.contrib.concurrent import process_map
+
+from pmid_index import index_range, load_pmid_index, split_pmid_aligned
+
+PMID_DTYPE = np.dtype("<u4")
+
+
+class PMIDSet:
+    def __init__(self, pmids=()):
+        if isinstance(pmids, PMIDSet):
+            self.pmids = pmids.pmids
+        elif isinstance(pmids, (set, frozenset, range, list, tuple)) or not hasattr(pmids, "__array__"):
+            self.pmids = np.unique(np.fromiter(pmids, dtype=PMID_DTYPE))
+        else:
+            self.pmids = np.unique(np.asarray(pmids).astype(PMID_DTYPE, copy=False))
+
+    @classmethod
+    def from_sorted(cls, pmids: np.ndarray):
+        pmid_set = cls.__new__(cls)
+        pmid_set.pmids = np.asarray(pmids).astype(PMID_DTYPE, copy=False)
+        return pmid_set
+
+    @classmethod
+    def load(cls, path: Path):
+        return cls.from_sorted(np.load(path, mmap_mode="r"))
+
+    def save(self, path: Path):
+        tmp_path = Path(f"{path}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.asarray(self.pmids))
+        os.replace(tmp_path, path)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.pmids, dtype=dtype)
+
+    def __len__(self):
+        return len(self.pmids)
+
+    def __iter__(self):
+        return iter(self.pmids.tolist())
+
+    def __contains__(self, pmid):
+        i = np.searchsorted(self.pmids, pmid)
+        return bool(i < len(self.pmids) and self.pmids[i] == pmid)
+
+    def __eq__(self, other):
+        other = as_pmid_set(other)
+        return np.array_equal(self.pmids, other.pmids)
+
+    def __and__(self, other):
+        return PMIDSet.from_sorted(np.intersect1d(self.pmids, as_pmid_set(other).pmids, assume_unique=True))
+
+    def __or__(self, other):
+        return PMIDSet.from_sorted(np.union1d(self.pmids, as_pmid_set(other).pmids))
+
+    def __sub__(self, other):
+        return PMIDSet.from_sorted(np.setdiff1d(self.pmids, as_pmid_set(other).pmids, assume_unique=True))
+
+    def __rand__(self, other):
+        return as_pmid_set(other) & self
+
+    def __ror__(self, other):
+        return as_pmid_set(other) | self
+
+    def __rsub__(self, other):
+        return as_pmid_set(other) - self
+
+    def __repr__(self):
+        return f"PMIDSet(len={len(self)})"
+
+    def isin(self, pmids):
+        return np.isin(np.asarray(pmids), self.pmids)
+
+    def max(self):
+        return int(self.pmids[-1]) if len(self.pmids) else None
+
+
+def as_pmid_set(pmids):
+    return pmids if isinstance(pmids, PMIDSet) else PMIDSet(pmids)
+
+
+def get_pmidset_path(dump_path: Path):
+    return Path(f"{dump_path}.pmids.npy")
+
+
+def scan_pmids_range(dump_path: Path, start: int, end: int):
+    # malformed lines, e.g. a header or a truncated row, are logged and skipped by index_range
+    return np.unique(index_range(dump_path, start, end)["pmid"])
+
+
+def load_dump_pmids(dump_path: Path, max_workers: int = os.cpu_count()):
+    pmidset_path = get_pmidset_path(dump_path)
+    if pmidset_path.exists() and pmidset_path.stat().st_mtime >= os.path.getmtime(dump_path):
+        return PMIDSet.load(pmidset_path)
+    index = load_pmid_index(dump_path)
+    if index is not None:
+        pmids = PMIDSet.from_sorted(index.pmids())
+    else:
+        logging.info(f"Scanning PMIDs of {dump_path}")
+        ranges = split_pmid_aligned(dump_path, max_workers * 4)
+        range_pmids = process_map(
+            scan_pmids_range,
+            [dump_path] * len(ranges),
+            [start for start, _ in ranges],
+            [end for _, end in ranges],
+            chunksize=1,
+            max_workers=max_workers,
+        )
+        pmids = PMIDSet(np.concatenate(range_pmids) if range_pmids else ())
+    pmids.save(pmidset_path)
+    logging.info(f"Saved {len(pmids)} PMIDs of {dump_path} to {pmidset_path}")
+    return pmids
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+import aiohttp
+from tqdm import tqdm
+
+from pmidset import PMIDSet
+
+PUBTATOR3_API_URL = "https://www.ncbi.nlm.nih.gov/research/pubtator3-api/publications/export/biocxml"
+PUBTATOR3_API_PARAMS = {"full": "true"}
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Checkpoint:
+    # one fetched PMID per line, appended as soon as its batch has been processed
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.pmids = set()
+        if self.path.exists():
+            with open(self.path) as f:
+                self.pmids = {int(line) for line in f if line.strip()}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.f = open(self.path, "a")
+
+    def __contains__(self, pmid: int):
+        return int(pmid) in self.pmids
+
+    def add(self, pmids):
+        for pmid in pmids:
+            self.f.write(f"{pmid}\n")
+            self.pmids.add(int(pmid))
+        self.f.flush()
+
+    def retain(self, pmids):
+        # PMIDs that are no longer relevant had their outputs cleaned, so they are dropped to be fetched again
+        # once they are relevant again
+        kept = PMIDSet(self.pmids) & pmids
+        if len(kept) == len(self.pmids):
+            return 0
+        removed = len(self.pmids) - len(kept)
+        self.f.close()
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            f.writelines(f"{pmid}\n" for pmid in kept)
+        os.replace(tmp_path, self.path)
+        self.pmids = set(kept)
+        self.f = open(self.path, "a")
+        logging.info(f"Dropped {removed} PMIDs that are no longer relevant from {self.path}")
+        return removed
+
+    def close(self):
+        self.f.close()
+
+
+def get_retry_delay(attempt: int, backoff: float, response: aiohttp.ClientResponse = None):
+    if response is not None and (retry_after := response.headers.get("Retry-After", "")).isdigit():
+        return float(retry_after)
+    return backoff * 2**attempt * (1 + random.random())
+
+
+async def fetch_batch(
+    session: aiohttp.ClientSession,
+    url: str,
+    pmids: list,
+    bucket: TokenBucket,
+    retries: int,
+    backoff: float,
+):
+    params = {"pmids": ",".join(map(str, pmids)), **PUBTATOR3_API_PARAMS}
+    for attempt in range(retries + 1):
+        await bucket.acquire()
+        try:
+            async with session.get(url, params=params) as response:
+                if response.status == 200:
+                    return await response.text()
+                if response.status not in RETRYABLE_STATUSES:
+                    logging.error(f"Failed to pull {len(pmids)} PMIDs from PubTator3 API: HTTP {response.status}")
+                    return None
+                delay = get_retry_delay(attempt, backoff, response)
+                logging.warning(f"HTTP {response.status} from PubTator3 API, retrying in {delay:.1f}s")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            delay = get_retry_delay(attempt, backoff)
+            logging.warning(f"{e!r} from PubTator3 API, retrying in {delay:.1f}s")
+        if attempt < retries:
+            await asyncio.sleep(delay)
+    logging.error(f"Giving up on {len(pmids)} PMIDs after {retries + 1} attempts: {pmids[0]}..{pmids[-1]}")
+    return None
+
+
+async def fetch_pubtator3_api(
+    pmid_batches: list,
+    process_response,
+    checkpoint_path: Path,
+    url: str = PUBTATOR3_API_URL,
+    concurrency: int = 4,
+    rate: float = 3,
+    retries: int = 5,
+    backoff: float = 1,
+    timeout: float = 300,
+    relevant_pmids: PMIDSet = None,
+    cache=None,
+):
+    """Fetch ``pmid_batches`` concurrently and call ``process_response(pmids, text)`` for every fetched batch.
+
+    Batches whose PMIDs are all in the checkpoint are skipped, after dropping the checkpointed PMIDs outside
+    ``relevant_pmids`` if given. At most ``concurrency`` batches are in flight at a time. A batch whose response
+    ``cache.get(pmids)`` returns, e.g. from a ResponseCache, is read and processed without requesting it.
+    ``process_response`` runs on a single worker thread, so parsing and writing a response neither stalls the
+    requests in flight nor has to be thread-safe.
+    """
+    checkpoint = Checkpoint(checkpoint_path)
+    if relevant_pmids is not None:
+        checkpoint.retain(relevant_pmids)
+    pmid_batches = [pmids for pmids in pmid_batches if not all(pmid in checkpoint for pmid in pmids)]
+    logging.info(f"Fetching {len(pmid_batches)} batches from PubTator3 API")
+    bucket = TokenBucket(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(1)
+    failed = 0
+    cached = 0
+
+    def process_cached(pmids):
+        # a cached response is read and processed as one unit, so it is never held in memory waiting its turn
+        text = cache.get(pmids)
+        if text is None:
+            return False
+        process_response(pmids, text)
+        return True
+
+    async def fetch(pmids):
+        # cache hits hold a slot like requests, so at most ``concurrency`` responses are in memory at a time
+        async with semaphore:
+            if cache is not None and await loop.run_in_executor(executor, process_cached, pmids):
+                return pmids, None, True
+            return pmids, await fetch_batch(session, url, pmids, bucket, retries, backoff), False
+
+    tasks = set()
+    batches = iter(pmid_batches)
+    try:
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=timeout), raise_for_status=False
+        ) as session:
+            with tqdm(total=len(pmid_batches)) as progress:
+                while True:
+                    # only a window of batches is scheduled, the next ones once earlier ones are done
+                    for pmids in islice(batches, concurrency - len(tasks)):
+                        tasks.add(asyncio.ensure_future(fetch(pmids)))
+                    if not tasks:
+                        break
+                    done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        pmids, text, from_cache = task.result()
+                        progress.update()
+                        if from_cache:
+                            cached += 1
+                        elif text is None:
+                            failed += 1
+                            continue
+                        else:
+                            await loop.run_in_executor(executor, process_response, pmids, text)
+                        checkpoint.add(pmids)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        executor.shutdown()
+        checkpoint.close()
+    if cached:
+        logging.info(f"Processed {cached} batches from the PubTator3 API cache without fetching them")
+    if failed:
+        logging.error(f"Failed to fetch {failed} batches from PubTator3 API, rerun to retry them")
+    return failed
@@ -0,0 +1,154 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from functools import partial
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+import numpy as np
+from tqdm import tqdm
+
+
+class RunReport(NamedTuple):
+    results: list
+    failures: list
+    skipped: int
+    elapsed: float
+
+
+def get_max_workers(max_workers: int = None):
+    # the CPUs this process may run on, which can be fewer than os.cpu_count() under taskset or a container quota
+    available = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    return max(1, min(max_workers, available) if max_workers else available)
+
+
+def get_pool_shape(sizes: np.ndarray, max_workers: int, chunk_bytes: int = 64 * 2**20):
+    # a chunk holds about chunk_bytes of typical files, but every worker still gets several chunks
+    max_workers = max(1, min(max_workers, len(sizes)))
+    typical_size = max(1, int(np.median(sizes)))
+    chunksize = min(max(1, chunk_bytes // typical_size), max(1, len(sizes) // (max_workers * 4)))
+    return max_workers, chunksize
+
+
+def is_up_to_date(path: Path, source_mtime: float):
+    try:
+        return path.stat().st_mtime >= source_mtime
+    except FileNotFoundError:
+        return False
+
+
+def get_mtime(path: Path):
+    # a missing dependency never counts as up to date, the stage reports it as a failure instead
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return float("inf")
+
+
+def write_error_report(report_path: Path, failures: list):
+    if not failures:
+        return
+    logging.warning(f"{len(failures)} files failed, see {report_path}")
+    with open(report_path, "a") as f:
+        for path, error in failures:
+            error = " ".join(error.split())
+            f.write(f"{path}\t{error}\n")
+
+
+def run_chunk(function: Callable, args: tuple, open_chunk: Callable, paths: list):
+    # one failing file is reported instead of taking the rest of its chunk down with it
+    results = []
+    failures = []
+    with open_chunk() if open_chunk is not None else nullcontext() as resource:
+        chunk_args = args if open_chunk is None else (*args, resource)
+        for path in paths:
+            try:
+                results.append(function(path, *chunk_args))
+            except Exception as e:
+                logging.debug(f"Failed to process {path}", exc_info=True)
+                failures.append((str(path), f"{type(e).__name__}: {e}"))
+    return results, failures
+
+
+def run_per_file(
+    function: Callable,
+    paths: list,
+    args: tuple = (),
+    get_output: Callable = None,
+    get_dependencies: Callable = None,
+    open_chunk: Callable = None,
+    max_workers: int = None,
+    error_report: Path = None,
+    description: str = None,
+):
+    """Call ``function(path, *args)`` for every path in a process pool and collect the results.
+
+    A path is skipped when ``get_output(path)`` is newer than it and than any of ``get_dependencies(path)``.
+    ``open_chunk``, if given, is called in the worker for every chunk of paths and the value of the context
+    manager it returns is passed to ``function`` as its last argument, e.g. a writer shared by the chunk.
+    Exceptions are caught per file, including inputs that can no longer be read when the paths are scheduled,
+    and appended to ``error_report`` as path and error.
+    """
+    description = description or function.__name__
+    start = time.perf_counter()
+    pending = []
+    sizes = []
+    skipped = 0
+    # like a failing file in run_chunk, an input that disappeared since it was listed is only reported
+    unavailable = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            if get_output is not None:
+                dependencies = get_dependencies(path) if get_dependencies is not None else ()
+                mtime = max([stat.st_mtime, *map(get_mtime, dependencies)])
+                if is_up_to_date(Path(get_output(path)), mtime):
+                    skipped += 1
+                    continue
+        except OSError as e:
+            logging.debug(f"Failed to schedule {path}", exc_info=True)
+            unavailable.append((str(path), f"{type(e).__name__}: {e}"))
+            continue
+        pending.append(path)
+        sizes.append(stat.st_size)
+    logging.info(
+        f"{description}: skipped {skipped} up to date files, processing {len(pending)}, "
+        f"{len(unavailable)} unavailable"
+    )
+
+    results = []
+    failures = []
+    if pending:
+        # largest files first so they do not end up as stragglers at the end of the pool
+        order = np.argsort(sizes, kind="stable")[::-1]
+        pending = [pending[i] for i in order]
+        max_workers, chunksize = get_pool_shape(np.asarray(sizes), get_max_workers(max_workers))
+        chunks = [pending[i : i + chunksize] for i in range(0, len(pending), chunksize)]
+        work = partial(run_chunk, function, args, open_chunk)
+        with tqdm(total=len(pending), desc=description, unit="file") as progress:
+            if max_workers == 1:
+                for chunk in chunks:
+                    chunk_results, chunk_failures = work(chunk)
+                    results += chunk_results
+                    failures += chunk_failures
+                    progress.update(len(chunk))
+            else:
+                with ProcessPoolExecutor(max_workers) as executor:
+                    futures = {executor.submit(work, chunk): len(chunk) for chunk in chunks}
+                    for future in as_completed(futures):
+                        chunk_results, chunk_failures = future.result()
+                        results += chunk_results
+                        failures += chunk_failures
+                        progress.update(futures[future])
+
+    elapsed = time.perf_counter() - start
+    logging.info(
+        f"{description}: processed {len(pending) - len(failures)} files in {elapsed:.1f}s "
+        f"({len(pending) / max(elapsed, 1e-9):.1f} files/s), {len(failures)} failed"
+    )
+    failures = unavailable + failures
+    if error_report is not None:
+        write_error_report(error_report, failures)
+    return RunReport(results, failures, skipped, elapsed)
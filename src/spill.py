@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from pmidset import PMIDSet
+
+# a partition is aggregated in memory when its runs, times this factor for the exploded pieces and the result,
+# fit the memory budget, otherwise it is split into SPLIT_FANOUT sub-partitions by more bits of the key hash
+AGGREGATE_OVERHEAD = 4
+SPLIT_FANOUT = 16
+MAX_SPLIT_LEVEL = 4
+
+
+class SpillAggregator:
+    """Out-of-core aggregation of a table by its key columns, checkpointed after every batch.
+
+    Every batch is pre-aggregated with ``aggregate`` and hash-partitioned by ``keys`` into Parquet runs under
+    ``root``. A batch is committed by atomically replacing ``checkpoint.json``, which lists the live runs and, per
+    source, a sorted PMID array sidecar of the PMIDs they cover, so the runs of a batch that did not commit are
+    removed on the next start. ``aggregate`` must be idempotent, e.g. a unique-list reduction, since partitions
+    are aggregated again from their runs.
+    """
+
+    def __init__(self, root: Path, keys: list[str], aggregate: Callable, memory_budget: int, partitions: int = 64):
+        self.root = Path(root)
+        self.keys = keys
+        self.aggregate = aggregate
+        self.memory_budget = memory_budget
+        self.runs_path = self.root / "runs"
+        self.runs_path.mkdir(parents=True, exist_ok=True)
+        self.checkpoint_path = self.root / "checkpoint.json"
+        if self.checkpoint_path.exists():
+            checkpoint = json.loads(self.checkpoint_path.read_text())
+        else:
+            checkpoint = {"partitions": partitions, "batch": 0, "pmids": {}, "runs": []}
+        # the partition count is fixed by the existing runs
+        self.partitions = checkpoint["partitions"]
+        self.batch = checkpoint["batch"]
+        self.runs = checkpoint["runs"]
+        self.pmids_names = checkpoint["pmids"]
+        self.pmids = {source: PMIDSet.load(self.root / name) for source, name in self.pmids_names.items()}
+        self.remove_uncommitted()
+
+    @property
+    def batch_bytes(self):
+        # the in-memory size of the rows to collect before a batch is aggregated and spilled
+        return max(1, self.memory_budget // AGGREGATE_OVERHEAD)
+
+    def remove_uncommitted(self):
+        live = {run["name"] for run in self.runs}
+        for path in self.runs_path.iterdir():
+            if path.name not in live:
+                path.unlink()
+        for path in self.root.glob("pmids-*.npy*"):
+            if path.name not in self.pmids_names.values():
+                path.unlink()
+        shutil.rmtree(self.root / "split", ignore_errors=True)
+
+    def get_pmids(self, source: str):
+        return self.pmids.get(source, PMIDSet())
+
+    def commit(self, runs: list, pmids: dict = None):
+        # only the sidecars of the sources in pmids are rewritten
+        self.batch += 1
+        pmids = pmids or {}
+        pmids_names = dict(self.pmids_names)
+        for source, source_pmids in pmids.items():
+            pmids_names[source] = f"pmids-{source.replace('/', '-')}-{self.batch:06d}.npy"
+            source_pmids.save(self.root / pmids_names[source])
+        checkpoint = {"partitions": self.partitions, "batch": self.batch, "pmids": pmids_names, "runs": runs}
+        tmp_path = self.checkpoint_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        previous_names = set(self.pmids_names.values()) - set(pmids_names.values())
+        self.runs, self.pmids, self.pmids_names = runs, {**self.pmids, **pmids}, pmids_names
+        for name in previous_names:
+            (self.root / name).unlink(missing_ok=True)
+
+    def get_hashes(self, df: pd.DataFrame):
+        return pd.util.hash_pandas_object(df[self.keys], index=False).to_numpy()
+
+    def normalize(self, df: pd.DataFrame):
+        # keys are compared as strings, a Concept ID read as an integer from one file and as a string from
+        # another is the same concept
+        df = df.dropna(subset=self.keys)
+        return df.astype({key: str for key in self.keys})
+
+    def write_run(self, df: pd.DataFrame, partition: int, compacted: bool, directory: Path = None):
+        name = f"{partition:04d}-{self.batch + 1:06d}-{uuid.uuid4().hex[:8]}.parquet"
+        path = (directory or self.runs_path) / name
+        tmp_path = path.with_name(f".{name}")
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path)
+        os.replace(tmp_path, path)
+        size = int(df.memory_usage(deep=True).sum())
+        return {"name": name, "partition": partition, "bytes": size, "compacted": compacted}
+
+    def read_run(self, run: dict, directory: Path = None):
+        return pq.read_table((directory or self.runs_path) / run["name"]).to_pandas()
+
+    def add(self, df: pd.DataFrame, pmids: dict):
+        """Aggregate a batch, spill it as one run per partition and commit it together with its PMIDs by source."""
+        runs = list(self.runs)
+        if len(df):
+            df = self.normalize(df)
+        if len(df):
+            df = self.aggregate(df)
+            partitions = self.get_hashes(df) % np.uint64(self.partitions)
+            order = np.argsort(partitions, kind="stable")
+            partitions = partitions[order]
+            bounds = np.flatnonzero(np.diff(partitions)) + 1
+            for rows in np.split(order, bounds):
+                runs.append(self.write_run(df.iloc[rows], int(partitions[rows[0]]), False))
+        self.commit(runs, {source: self.get_pmids(source) | PMIDSet(added) for source, added in pmids.items()})
+
+    def get_partition_runs(self):
+        partitions = {}
+        for run in self.runs:
+            partitions.setdefault(run["partition"], []).append(run)
+        return sorted(partitions.items())
+
+    def aggregate_runs(self, runs: list, directory: Path = None, level: int = 0):
+        # yields frames whose keys are disjoint, splitting runs that would not fit the memory budget
+        if sum(run["bytes"] for run in runs) * AGGREGATE_OVERHEAD <= self.memory_budget or level >= MAX_SPLIT_LEVEL:
+            yield self.aggregate(pd.concat([self.read_run(run, directory) for run in runs], ignore_index=True))
+            return
+        logging.info(f"Splitting {len(runs)} runs of {sum(run['bytes'] for run in runs) / 2**20:.0f} MiB")
+        split_path = self.root / "split" / uuid.uuid4().hex
+        split_path.mkdir(parents=True)
+        sub_runs = {}
+        divisor = self.partitions * SPLIT_FANOUT**level
+        for run in runs:
+            df = self.read_run(run, directory)
+            sub_partitions = self.get_hashes(df) // np.uint64(divisor) % np.uint64(SPLIT_FANOUT)
+            for sub_partition in np.unique(sub_partitions).tolist():
+                sub_df = df[sub_partitions == sub_partition]
+                sub_runs.setdefault(sub_partition, []).append(self.write_run(sub_df, sub_partition, False, split_path))
+        for sub_partition_runs in sub_runs.values():
+            yield from self.aggregate_runs(sub_partition_runs, split_path, level + 1)
+        shutil.rmtree(split_path)
+
+    def compact(self):
+        """Aggregate every partition that has uncompacted runs and commit the result, yielding all aggregates."""
+        for partition, runs in self.get_partition_runs():
+            if all(run["compacted"] for run in runs):
+                for run in runs:
+                    yield self.read_run(run)
+                continue
+            compacted = []
+            for df in self.aggregate_runs(runs):
+                compacted.append(self.write_run(df, partition, True))
+                yield df
+            self.commit([run for run in self.runs if run["partition"] != partition] + compacted)
+            for run in runs:
+                (self.runs_path / run["name"]).unlink()
+
+    def iter_aggregates(self):
+        """Yield the aggregated table as frames with disjoint keys, each bounded by the memory budget."""
+        for partition, runs in self.get_partition_runs():
+            if all(run["compacted"] for run in runs):
+                for run in runs:
+                    yield self.read_run(run)
+            else:
+                yield from self.aggregate_runs(runs)
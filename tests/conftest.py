@@ -0,0 +1,35 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# the tests import the modules by their bare names, as the modules import each other
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+BIOCONCEPTS2PUBTATOR3_ROWS = [
+    (1, "Gene", "1017", "CDK2", "GNorm2"),
+    (1, "Species", "9606", "human", "GNorm2"),
+    (2, "Disease", "MESH:D003920", "diabetes", "TaggerOne"),
+    (3, "Chemical", "MESH:D008687", "metformin", "NLMChem"),
+    (3, "Chemical", "MESH:D005947", "glucose", "NLMChem"),
+    (3, "Gene", "3630", "insulin", "GNorm2"),
+    (10, "Disease", "MESH:D009369", "cancer", "TaggerOne"),
+]
+
+
+@pytest.fixture
+def bioconcepts_rows():
+    return BIOCONCEPTS2PUBTATOR3_ROWS
+
+
+@pytest.fixture
+def bioconcepts_dump(tmp_path):
+    # blank lines between and within the rows of a PMID and at the end, which the readers skip
+    path = tmp_path / "bioconcepts2pubtator3"
+    with open(path, "w") as f:
+        for i, row in enumerate(BIOCONCEPTS2PUBTATOR3_ROWS):
+            if i in (2, 4):
+                f.write("\n")
+            f.write("\t".join(map(str, row)) + "\n")
+        f.write("\n")
+    return path
@@ -0,0 +1,74 @@
+import numpy as np
+from bioc import BioCAnnotation, BioCCollection, BioCDocument, BioCLocation, BioCPassage, biocxml
+
+import biocio
+from annotation_store import MISSING, AnnotationArray, StringTable
+
+
+def make_annotation(id: str, text: str, locations: list, **infons):
+    annotation = BioCAnnotation()
+    annotation.id = id
+    annotation.text = text
+    annotation.infons.update(infons)
+    for offset, length in locations:
+        annotation.add_location(BioCLocation(offset, length))
+    return annotation
+
+
+def make_collection():
+    passage = BioCPassage()
+    passage.offset = 0
+    passage.text = "CDK2 and cyclin E in human cells"
+    passage.add_annotation(make_annotation("0", "CDK2", [(0, 4)], type="Gene", **{"NCBI Gene": "1017"}))
+    passage.add_annotation(make_annotation("1", "cyclin E", [(9, 6), (16, 1)], identifier="898", type="Gene"))
+    passage.add_annotation(make_annotation("2", "human", [(21, 5)], type="Species", identifier=None))
+    passage.add_annotation(make_annotation("3", "", []))
+    document = BioCDocument()
+    document.id = "1"
+    document.add_passage(passage)
+    return BioCCollection.of_documents(document)
+
+
+def test_round_trip_is_lossless():
+    expected = biocxml.dumps(make_collection())
+    strings = StringTable()
+    collection = biocio.loads(expected, strings=strings)
+    annotations = collection.documents[0].passages[0].annotations
+    assert isinstance(annotations, biocio.annotation_store.AnnotationArray) and len(annotations) == 4
+    assert biocio.dumps(collection) == expected
+
+    originals = make_collection().documents[0].passages[0].annotations
+    converted = AnnotationArray.from_annotations(originals, strings)
+    assert [annotation.infons for annotation in converted] == [annotation.infons for annotation in originals]
+    assert converted[-1].text == "" and converted[-1].locations == []
+
+
+def test_columns():
+    collection = biocio.loads(biocxml.dumps(make_collection()), strings=StringTable())
+    annotations = collection.documents[0].passages[0].annotations
+    strings = annotations.strings
+    assert strings.decode(annotations.values("type")).tolist() == ["Gene", "Gene", "Species", None]
+    assert annotations.has("identifier").tolist() == [False, True, True, False]
+    assert annotations.equals("type", "Gene").tolist() == [True, True, False, False]
+    assert not annotations.equals("type", "Chemical").any()
+    assert annotations.values("NCBI Gene").tolist() == [strings.lookup("1017"), MISSING, MISSING, MISSING]
+    assert annotations.spans().tolist()[:2] == [4, 9 << 32 | 6]
+
+
+def test_set_and_clear_identifiers():
+    strings = StringTable()
+    annotations = AnnotationArray.from_annotations(make_collection().documents[0].passages[0].annotations, strings)
+    annotations.set_identifiers([0, 1], np.array([strings.intern("1017"), strings.intern("899")]), "gnorm2")
+    assert [list(annotation.infons.items()) for annotation in annotations][:2] == [
+        [("type", "Gene"), ("NCBI Gene", "1017"), ("identifier", "1017")],
+        [("identifier", "899"), ("type", "Gene")],
+    ]
+    assert strings.decode(annotations.records["tool"]).tolist() == ["gnorm2", "gnorm2", None, None]
+
+    annotations.clear_identifiers(annotations.equals("type", "Gene"))
+    assert [annotation.infons.get("identifier", "absent") for annotation in annotations] == [
+        "absent",
+        "absent",
+        None,
+        "absent",
+    ]
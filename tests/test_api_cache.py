@@ -0,0 +1,36 @@
+import os
+
+from api_cache import ResponseCache
+
+
+def test_response_cache(tmp_path):
+    cache = ResponseCache(tmp_path, {"full": "true"})
+    assert cache.get([1, 2]) is None
+    cache.put([2, 1], "<collection/>")
+    assert [1, 2] in cache and [1] not in cache
+    assert cache.get([1, 2]) == "<collection/>"
+    assert list(cache.iter_responses()) == ["<collection/>"]
+    assert ResponseCache(tmp_path, {"full": "false"}).get([1, 2]) is None
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(tmp_path, {}, max_bytes=None)
+    for pmid in range(4):
+        cache.put([pmid], str(pmid) * 1000)
+        os.utime(cache.path([pmid]), (pmid, pmid))
+    size = cache.path([0]).stat().st_size
+    cache.max_bytes = int(2.5 * size)
+    assert cache.evict() == 2
+    assert [[pmid] in cache for pmid in range(4)] == [False, False, True, True]
+
+
+def test_response_cache_evicts_on_put(tmp_path):
+    cache = ResponseCache(tmp_path, {}, max_bytes=None)
+    cache.put([0], "0" * 1000)
+    cache.max_bytes = int(3.5 * cache.path([0]).stat().st_size)
+    for pmid in range(1, 10):
+        os.utime(cache.path([pmid - 1]), (pmid, pmid))
+        cache.put([pmid], str(pmid) * 1000)
+        # the bound holds during a long fetch, not only once it is done
+        assert sum(size for _, size, _ in cache.scan()) <= cache.max_bytes
+    assert [9] in cache and [0] not in cache
@@ -0,0 +1,78 @@
+import io
+
+import pytest
+from bioc import BioCAnnotation, BioCCollection, BioCDocument, BioCLocation, BioCNode, BioCPassage, BioCRelation
+from bioc import biocxml
+
+import biocio
+
+
+def make_collection():
+    document = BioCDocument()
+    document.id = "12345"
+    document.infons["note"] = 'a "quoted" & <escaped> value'
+    for offset, text in [(0, "CDK2 binds\r\ncyclin E."), (24, "")]:
+        passage = BioCPassage()
+        passage.offset = offset
+        passage.text = text
+        passage.infons["type"] = "abstract"
+        document.add_passage(passage)
+    annotation = BioCAnnotation()
+    annotation.id = "0"
+    annotation.text = "CDK2"
+    annotation.infons.update({"type": "Gene", "identifier": "1017"})
+    annotation.add_location(BioCLocation(0, 4))
+    document.passages[0].add_annotation(annotation)
+    relation = BioCRelation()
+    relation.id = "R0"
+    relation.infons["type"] = "Bind"
+    relation.add_node(BioCNode("0", "Gene\t1"))
+    document.add_relation(relation)
+    empty_relation = BioCRelation()
+    empty_relation.id = "R1"
+    document.add_relation(empty_relation)
+    collection = BioCCollection.of_documents(document)
+    collection.source = "PubTator3"
+    collection.infons["version"] = "1"
+    return collection
+
+
+def test_dumps_matches_bioc():
+    collection = make_collection()
+    assert biocio.dumps(collection) == biocxml.dumps(collection)
+
+
+def test_round_trip_matches_bioc():
+    expected = biocxml.dumps(make_collection())
+    assert biocio.dumps(biocio.loads(expected)) == expected
+    assert biocio.dumps(biocio.load(io.BytesIO(expected.encode()))) == expected
+
+
+def test_iterparse_writer_matches_dump():
+    expected = biocxml.dumps(make_collection())
+    collection = biocio.BioCCollection()
+    out = io.StringIO()
+    documents = biocio.iterparse(io.BytesIO(expected.encode()), collection=collection)
+    document = next(documents)
+    with biocio.BioCXMLWriter(out, collection) as writer:
+        writer.write_document(document)
+        for document in documents:
+            writer.write_document(document)
+    assert out.getvalue() == expected
+
+
+def test_annotations_only():
+    data = biocxml.dumps(make_collection()).encode()
+    document = biocio.load(io.BytesIO(data), annotations_only=True).documents[0]
+    assert [passage.text for passage in document.passages] == [None, None]
+    annotation = document.passages[0].annotations[0]
+    assert (annotation.text, annotation.infons["identifier"]) == ("CDK2", "1017")
+    assert (annotation.locations[0].offset, annotation.locations[0].length) == (0, 4)
+    assert [relation.id for relation in document.relations] == ["R0", "R1"]
+
+
+def test_dumps_rejects_invalid_characters():
+    collection = make_collection()
+    collection.documents[0].passages[0].text = "bad\x01text"
+    with pytest.raises(ValueError):
+        biocio.dumps(collection)
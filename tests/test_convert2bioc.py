@@ -0,0 +1,52 @@
+from bioc import BioCAnnotation, BioCCollection, BioCDocument, BioCLocation, BioCPassage, biocxml
+
+from convert2bioc import convert_file
+from merge import write_merged
+
+BIOREX_PUBTATOR = (
+    "1|t|Gene\n"
+    "1|a|\n"
+    "1\t0\t4\tGene\tGene\t1017\n"
+    "1\tAssociation\t1017\t1017\n"
+    "1\tAssociation\t1017\tunknown\n"
+    "\n"
+)
+
+
+def make_collection():
+    annotation = BioCAnnotation()
+    annotation.id = "0"
+    annotation.text = "Gene"
+    annotation.infons.update(type="Gene", identifier="1017")
+    annotation.add_location(BioCLocation(0, 4))
+    passage = BioCPassage()
+    passage.offset = 0
+    passage.text = "Gene"
+    passage.add_annotation(annotation)
+    document = BioCDocument()
+    document.id = "1"
+    document.add_passage(passage)
+    return BioCCollection.of_documents(document)
+
+
+def test_convert_file(tmp_path):
+    merged_path = tmp_path / "merged"
+    merged_path.mkdir()
+    pubtator_file = tmp_path / "1.pubtator"
+    pubtator_file.write_text(BIOREX_PUBTATOR)
+    bioc_path = tmp_path / "pubtator3"
+    bioc_path.mkdir()
+
+    # the merged document is read from whichever format merge wrote
+    outputs = []
+    for output in ["xml", "cache"]:
+        write_merged(make_collection(), merged_path, 1, output)
+        outputs.append(convert_file(pubtator_file, merged_path, bioc_path).read_text())
+    assert outputs[0] == outputs[1]
+
+    with open(bioc_path / "1.bioc") as f:
+        document = biocxml.load(f).documents[0]
+    assert document.passages[0].annotations[0].infons["identifier"] == "1017"
+    assert [(relation.infons["role1"], relation.infons["role2"]) for relation in document.relations] == [
+        ("Gene|1017", "Gene|1017")
+    ]
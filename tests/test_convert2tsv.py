@@ -0,0 +1,14 @@
+from convert2tsv import get_pending_dataset_files
+from dataset import DatasetWriter
+
+
+def test_get_pending_dataset_files(tmp_path):
+    dataset = tmp_path / "dataset"
+    with DatasetWriter(dataset, "bioconcepts2pubtator3", "local") as writer:
+        writer.write_lines(b"1\tGene\t1017\tCDK2\tPubTator3\n")
+        writer.write_empty(2)
+    with DatasetWriter(dataset, "bioconcepts2pubtator3", "api") as writer:
+        writer.write_lines(b"3\tGene\t1017\tCDK2\tPubTator3\n")
+    paths = [tmp_path / name for name in ["1.bioc", "2.bioc", "3.bioc", "notes.bioc"]]
+    # documents without annotations are in the dataset too, the other sources are not looked at
+    assert get_pending_dataset_files(paths, dataset) == [tmp_path / "3.bioc", tmp_path / "notes.bioc"]
@@ -0,0 +1,30 @@
+import pandas as pd
+
+from dataset import DatasetWriter, read_dataset, read_dataset_pmids
+
+
+def test_dataset_roundtrip(tmp_path):
+    with DatasetWriter(tmp_path, "bioconcepts2pubtator3", "ftp", row_group_size=2) as writer:
+        writer.write_lines(b"1\tGene\t1017\tCDK2\tGNorm2\n1500000\tSpecies\t9606\thuman\tGNorm2\n")
+    with DatasetWriter(tmp_path, "bioconcepts2pubtator3", "api") as writer:
+        writer.write_df(
+            pd.DataFrame(
+                [{"PMID": "7", "Type": "Gene", "Concept ID": None, "Mentions": "INS", "Resource": "PubTator3"}]
+            )
+        )
+        writer.write_empty(8)
+    assert not list(tmp_path.rglob(".part-*"))
+    assert sorted(path.parent.name for path in tmp_path.rglob("*.parquet")) == [
+        "pmid_bucket=0",
+        "pmid_bucket=0",
+        "pmid_bucket=1",
+    ]
+
+    df = read_dataset(tmp_path, "bioconcepts2pubtator3")
+    assert sorted(df["PMID"].tolist()) == [1, 7, 1500000]
+    assert list(read_dataset_pmids(tmp_path, "bioconcepts2pubtator3", ["api"])) == [7, 8]
+
+    df = read_dataset(tmp_path, "bioconcepts2pubtator3", sources=["ftp"], pmids=[1500000, 7])
+    assert df.to_dict("records") == [
+        {"PMID": 1500000, "Type": "Species", "Concept ID": "9606", "Mentions": "human", "Resource": "GNorm2"}
+    ]
@@ -0,0 +1,46 @@
+from bioc import BioCAnnotation, BioCCollection, BioCDocument, BioCLocation, BioCPassage, biocxml
+
+import biocio
+import document_cache
+from annotation_store import StringTable
+
+
+def make_xml():
+    passage = BioCPassage()
+    passage.offset = 0
+    passage.text = "CDK2 in human cells"
+    for i, (offset, length, infons) in enumerate(
+        [(0, 4, {"type": "Gene", "identifier": "1017"}), (8, 5, {"type": "Species", "NCBI Taxonomy": "9606"})]
+    ):
+        annotation = BioCAnnotation()
+        annotation.id = str(i)
+        annotation.text = passage.text[offset : offset + length]
+        annotation.infons.update(infons)
+        annotation.add_location(BioCLocation(offset, length))
+        passage.add_annotation(annotation)
+    document = BioCDocument()
+    document.id = "1"
+    document.add_passage(passage)
+    return biocxml.dumps(BioCCollection.of_documents(document))
+
+
+def test_round_trip(tmp_path):
+    expected = make_xml()
+    batch_strings = StringTable()
+    for value in ["unrelated"] * 3 + [str(i) for i in range(100)]:
+        batch_strings.intern(value)
+    collection = biocio.loads(expected, strings=batch_strings)
+    document_cache.dump(collection, tmp_path / "1.pickle")
+    # the in-memory collection keeps its table, the cache only the strings it uses
+    assert collection.documents[0].passages[0].annotations.strings is batch_strings
+    cached = document_cache.load(tmp_path / "1.pickle")
+    assert len(cached.documents[0].passages[0].annotations.strings) < 20
+    assert biocio.dumps(cached) == expected
+
+    strings = StringTable()
+    strings.intern("shifted")
+    loaded = document_cache.load(tmp_path / "1.pickle", strings)
+    annotations = loaded.documents[0].passages[0].annotations
+    assert annotations.strings is strings
+    assert strings.decode(annotations.values("identifier")).tolist() == ["1017", None]
+    assert biocio.dumps(loaded) == expected
@@ -0,0 +1,102 @@
+import random
+
+import pandas as pd
+from bioc import BioCAnnotation, BioCRelation
+
+from annotation_store import AnnotationArray, StringTable
+from emitter import RELATION_TYPE_MAP, emit_document
+
+
+def pandas_bioconcepts(rows: list):
+    # the per-document pandas aggregation the emitter replaces
+    df = pd.DataFrame(rows, columns=["PMID", "Type", "Concept ID", "Mentions", "Resource"])
+    return (
+        df.groupby(["PMID", "Type", "Concept ID", "Resource"])["Mentions"]
+        .apply(lambda x: "|".join(set(x)))
+        .reset_index()
+    )
+
+
+def make_annotation(text: str, infons: dict):
+    annotation = BioCAnnotation()
+    annotation.text = text
+    annotation.infons.update(infons)
+    return annotation
+
+
+def split_mentions(text: str):
+    # the mentions are a set in the pandas output, so their order is not comparable
+    lines = text.splitlines()
+    return lines[0], sorted((*line.split("\t")[:-1], frozenset(line.split("\t")[-1].split("|"))) for line in lines[1:])
+
+
+def test_matches_pandas(tmp_path):
+    rng = random.Random(0)
+    for i in range(50):
+        pmid = str(1000 + i)
+        segments = []
+        rows = []
+        strings = StringTable()
+        for passage_pmid in [pmid, pmid, str(2000 + i)][: rng.randint(1, 3)]:
+            annotations = []
+            for _ in range(rng.randint(0, 20)):
+                infons = {"type": rng.choice(["Gene", "Disease", "Chemical", None])}
+                if rng.random() < 0.8:
+                    infons["identifier"] = rng.choice(["1017", "D003920", "-", 'a "quoted"\tvalue', None])
+                text = rng.choice(["CDK2", "diabetes", "glucose", "a|b", ""])
+                annotations.append(make_annotation(text, infons))
+                rows.append((passage_pmid, infons["type"], infons.get("identifier"), text, "PubTator3"))
+            segments.append((passage_pmid, AnnotationArray.from_annotations(annotations, strings)))
+        relations = []
+        for _ in range(rng.randint(0, 3)):
+            relation = BioCRelation()
+            relation.infons.update({"type": rng.choice(list(RELATION_TYPE_MAP)), "role1": "Gene|1017", "role2": ""})
+            relations.append(relation)
+
+        records = emit_document(tmp_path / f"{pmid}.tsv", tmp_path / f"{pmid}.rel.tsv", pmid, segments, relations)
+        if not rows:
+            assert (tmp_path / f"{pmid}.tsv").read_text() == ""
+            assert records[1][1] is None
+            continue
+        expected = pandas_bioconcepts(rows).to_csv(sep="\t", index=False)
+        assert split_mentions((tmp_path / f"{pmid}.tsv").read_text()) == split_mentions(expected)
+        if relations:
+            expected = pd.DataFrame(
+                [
+                    {"PMID": pmid, "Type": RELATION_TYPE_MAP[r.infons["type"]], "1st": "Gene|1017", "2nd": ""}
+                    for r in relations
+                ]
+            ).to_csv(sep="\t", index=False)
+            assert (tmp_path / f"{pmid}.rel.tsv").read_text() == expected
+            assert records[1] == (pmid, tmp_path / f"{pmid}.rel.tsv", None)
+        else:
+            assert records[1] == (pmid, None, None)
+
+
+class RowWriter:
+    def __init__(self):
+        self.rows = []
+
+    def write_rows(self, rows):
+        self.rows += rows
+
+    def write_empty(self, pmid):
+        self.rows.append((pmid,))
+
+
+def test_rows_go_to_writers(tmp_path):
+    strings = StringTable()
+    annotations = AnnotationArray.from_annotations(
+        [
+            make_annotation("CDK2", {"type": "Gene", "identifier": "1017"}),
+            make_annotation("Cdk2", {"type": "Gene", "identifier": "1017"}),
+            make_annotation("CDK2", {"type": "Gene", "identifier": "1017"}),
+        ],
+        strings,
+    )
+    bioconcepts_writer = RowWriter()
+    emit_document(tmp_path / "1.tsv", tmp_path / "2.tsv", "1", [("1", annotations)], [], bioconcepts_writer)
+    assert bioconcepts_writer.rows == [("1", "Gene", "1017", "CDK2|Cdk2", "PubTator3")]
+    emit_document(tmp_path / "1.tsv", tmp_path / "2.tsv", "2", [], [], bioconcepts_writer)
+    assert bioconcepts_writer.rows[-1] == ("2",)
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,51 @@
+from argparse import Namespace
+
+from bioc import BioCAnnotation, BioCCollection, BioCDocument, BioCLocation, BioCPassage, biocxml
+
+from fused import export
+from merge import TOOLS
+
+
+def write_tool_output(local_path, tool, pmid):
+    annotation = BioCAnnotation()
+    annotation.id = "0"
+    annotation.text = "CDK2"
+    annotation.infons.update({"type": "Gene", "NCBI Gene": "1017"})
+    annotation.add_location(BioCLocation(0, 4))
+    passage = BioCPassage()
+    passage.offset = 0
+    passage.text = "CDK2 in humans"
+    passage.infons["type"] = "title"
+    passage.add_annotation(annotation)
+    document = BioCDocument()
+    document.id = str(pmid)
+    document.add_passage(passage)
+    with open(local_path / tool / f"{pmid}{TOOLS[tool]}", "w") as f:
+        biocxml.dump(BioCCollection.of_documents(document), f)
+
+
+def test_export_regenerates_missing_pubtator(tmp_path):
+    local_path = tmp_path / "local"
+    for tool in TOOLS:
+        (local_path / tool).mkdir(parents=True)
+        for pmid in [1, 2]:
+            write_tool_output(local_path, tool, pmid)
+    args = Namespace(
+        local_dir=str(local_path),
+        max_workers=1,
+        batch_size=256,
+        partial=False,
+        output="cache",
+        ledger=tmp_path / "ledger.sqlite",
+    )
+    export(args)
+    pubtator_path = local_path / "pubtator"
+    assert sorted(path.name for path in pubtator_path.iterdir()) == ["1.pubtator", "2.pubtator"]
+    text = (pubtator_path / "1.pubtator").read_text()
+
+    # an up to date merged document is merged again when its BioREx input is missing
+    (pubtator_path / "1.pubtator").unlink()
+    mtime = (pubtator_path / "2.pubtator").stat().st_mtime_ns
+    export(args)
+    assert (pubtator_path / "1.pubtator").read_text() == text
+    assert (pubtator_path / "2.pubtator").stat().st_mtime_ns == mtime
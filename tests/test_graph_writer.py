@@ -0,0 +1,126 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+import pytest
+from neo4j.exceptions import ClientError, ServiceUnavailable
+
+from graph_writer import BatchWriter, get_rounds, iter_columnar_batches, unwind_rows
+
+
+class FakeResult:
+    async def consume(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def run(self, query, batch):
+        driver = self.driver
+        driver.in_flight += 1
+        driver.max_in_flight = max(driver.max_in_flight, driver.in_flight)
+        await asyncio.sleep(0.001)
+        driver.in_flight -= 1
+        if driver.errors:
+            raise driver.errors.pop(0)
+        driver.batches.append(batch)
+        return FakeResult()
+
+
+class FakeDriver:
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.batches = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def session(self, database=None):
+        return FakeSession(self)
+
+
+def test_columnar_batches():
+    df = pd.DataFrame({"Concept ID": ["1017", "898", None], "PMID": ["1|2", np.nan, "3"], "Other": 1})
+    assert list(iter_columnar_batches(df, ["Concept ID", "PMID"], 2)) == [
+        {"Concept ID": ["1017", "898"], "PMID": ["1|2", None]},
+        {"Concept ID": [None], "PMID": ["3"]},
+    ]
+    assert unwind_rows(["Concept ID", "PMID"]) == (
+        "UNWIND range(0, size($batch['Concept ID']) - 1) AS i\n"
+        "WITH {`Concept ID`: $batch['Concept ID'][i], `PMID`: $batch['PMID'][i]} AS row"
+    )
+
+
+def test_batch_writer():
+    df = pd.DataFrame({"Concept ID": [str(i) for i in range(25)]})
+    driver = FakeDriver(errors=[ServiceUnavailable("connection lost")])
+    writer = BatchWriter(driver, batch_size=10, concurrency=2, backoff=0)
+    assert asyncio.run(writer.write("MERGE (a:Gene {ConceptID: row['Concept ID']})", df)) == 25
+    # the batch that lost its connection was sent again
+    assert sorted(len(batch["Concept ID"]) for batch in driver.batches) == [5, 10, 10]
+    assert sorted(sum((batch["Concept ID"] for batch in driver.batches), [])) == sorted(df["Concept ID"])
+    assert driver.max_in_flight == 2
+
+    driver = FakeDriver(errors=[ClientError("syntax error")])
+    with pytest.raises(ClientError):
+        asyncio.run(BatchWriter(driver, batch_size=10, backoff=0).write("MERGE", df))
+
+
+def test_rounds_touch_disjoint_buckets():
+    for buckets in [2, 4, 16]:
+        rounds, slots = get_rounds(buckets)
+        assert (rounds == rounds.T).all() and (slots == slots.T).all()
+        for round_index in range(buckets):
+            pairs = {(i, j) for i in range(buckets) for j in range(i, buckets) if rounds[i, j] == round_index}
+            touched = [bucket for pair in pairs for bucket in set(pair)]
+            assert len(touched) == len(set(touched))
+            # every slot of a round holds one pair
+            assert len({slots[i, j] for i, j in pairs}) == len(pairs)
+
+
+def test_write_disjoint():
+    class LockingSession(FakeSession):
+        async def run(self, query, batch):
+            nodes = set(batch["1st Concept ID"]) | set(batch["2nd Concept ID"])
+            assert not nodes & self.driver.locked, "concurrent batches share a node"
+            self.driver.locked |= nodes
+            try:
+                return await super().run(query, batch)
+            finally:
+                self.driver.locked -= nodes
+
+    driver = FakeDriver()
+    driver.locked = set()
+    driver.session = lambda database=None: LockingSession(driver)
+    rng = np.random.default_rng(0)
+    jobs = []
+    for relation_type in ["associate", "treat"]:
+        df = pd.DataFrame(
+            {
+                "1st Type": "Gene",
+                "1st Concept ID": rng.integers(0, 30, 200).astype(str),
+                "2nd Type": "Gene",
+                "2nd Concept ID": rng.integers(0, 30, 200).astype(str),
+                "PMID": relation_type,
+            }
+        )
+        jobs.append(("MERGE", df, ["1st Concept ID", "2nd Concept ID", "PMID"]))
+
+    writer = BatchWriter(driver, batch_size=7, concurrency=4)
+    start, end = ("1st Type", "1st Concept ID"), ("2nd Type", "2nd Concept ID")
+    assert asyncio.run(writer.write_disjoint(jobs, start, end)) == 400
+    assert driver.max_in_flight > 1
+    written = {
+        (a, b, pmid)
+        for batch in driver.batches
+        for a, b, pmid in zip(batch["1st Concept ID"], batch["2nd Concept ID"], batch["PMID"])
+    }
+    expected = {tuple(row) for _, df, columns in jobs for row in df[columns].itertuples(index=False)}
+    assert written == expected
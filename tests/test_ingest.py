@@ -0,0 +1,92 @@
+import os
+import random
+
+import numpy as np
+import pandas as pd
+
+from dataset import DatasetWriter
+from ingest import agg_bioconcepts, agg_relations, get_pending_files, spill_dataset, unique_list
+from ledger import Ledger
+from spill import SpillAggregator
+
+
+def reference_agg(df: pd.DataFrame, keys: list[str], columns: list[str]):
+    return df.groupby(keys).agg({column: unique_list for column in columns}).reset_index()
+
+
+def make_bioconcepts(rng: random.Random, n: int):
+    return pd.DataFrame(
+        {
+            "PMID": [rng.choice(["9", "10", "11|9", " 12 ", None]) for _ in range(n)],
+            "Type": [rng.choice(["Gene", "Disease", None]) for _ in range(n)],
+            "Concept ID": [rng.choice(["1017", "D003920", "-", None]) for _ in range(n)],
+            "Mentions": [rng.choice(["CDK2", "Cdk2|CDK2", "a||b", "x ", np.nan, 7, 1.5]) for _ in range(n)],
+            "Resource": [rng.choice(["PubTator3", None]) for _ in range(n)],
+        }
+    )
+
+
+def test_agg_bioconcepts_matches_unique_list():
+    rng = random.Random(0)
+    for n in [1, 5, 50, 500]:
+        df = make_bioconcepts(rng, n)
+        expected = reference_agg(df, ["Concept ID", "Type"], ["PMID", "Mentions", "Resource"])
+        pd.testing.assert_frame_equal(agg_bioconcepts(df), expected)
+
+
+def test_agg_relations_matches_unique_list():
+    rng = random.Random(1)
+    df = pd.DataFrame(
+        {
+            "PMID": [rng.choice([9, 10, 123]) for _ in range(200)],
+            "Type": [rng.choice(["associate", "treat"]) for _ in range(200)],
+            "1st Type": "Gene",
+            "1st Concept ID": [rng.choice(["1017", "898"]) for _ in range(200)],
+            "2nd Type": [rng.choice(["Disease", "Chemical"]) for _ in range(200)],
+            "2nd Concept ID": [rng.choice(["D003920", None]) for _ in range(200)],
+        }
+    )
+    keys = ["1st Type", "1st Concept ID", "2nd Type", "2nd Concept ID", "Type"]
+    expected = reference_agg(df, keys, ["PMID"])
+    actual = agg_relations(df)
+    pd.testing.assert_frame_equal(actual, expected)
+    # aggregating the aggregated frame again is a no-op, as when batches are folded into the running total
+    pd.testing.assert_frame_equal(agg_relations(pd.concat([actual, actual])), expected)
+
+
+def test_get_pending_files_sees_new_files(tmp_path):
+    input_dir = tmp_path / "api" / "bioconcepts2pubtator3"
+    input_dir.mkdir(parents=True)
+    (input_dir / "1.tsv").touch()
+    aggregator = SpillAggregator(tmp_path / "spill", ["Concept ID", "Type"], agg_bioconcepts, memory_budget=2**30)
+    with Ledger(tmp_path / "ledger.sqlite") as ledger:
+        assert get_pending_files(ledger, [input_dir], aggregator) == [
+            ("api/bioconcepts2pubtator3", 1, str(input_dir / "1.tsv"))
+        ]
+        aggregator.add(pd.DataFrame(), {"api/bioconcepts2pubtator3": [1]})
+
+        # a file added by another process after the first run is picked up on the next one
+        (input_dir / "2.tsv").touch()
+        os.utime(input_dir, ns=(0, os.stat(input_dir).st_mtime_ns + 1))
+        assert get_pending_files(ledger, [input_dir], aggregator) == [
+            ("api/bioconcepts2pubtator3", 2, str(input_dir / "2.tsv"))
+        ]
+
+
+def test_spill_dataset_tracks_sources(tmp_path):
+    dataset = tmp_path / "dataset"
+    # the rows of PMID 1 span two part files
+    for mention in ["CDK2", "Cdk2"]:
+        with DatasetWriter(dataset, "bioconcepts2pubtator3", "ftp") as writer:
+            writer.write_lines(f"1\tGene\t1017\t{mention}\tGNorm2\n".encode())
+    aggregator = SpillAggregator(tmp_path / "spill", ["Concept ID", "Type"], agg_bioconcepts, memory_budget=2**30)
+    spill_dataset(aggregator, dataset, "bioconcepts2pubtator3", lambda df: df)
+    assert list(aggregator.get_pmids("dataset/ftp")) == [1]
+
+    # a PMID ingested from ftp does not hide its rows added later under api
+    with DatasetWriter(dataset, "bioconcepts2pubtator3", "api") as writer:
+        writer.write_lines(b"1\tGene\t1017\tcyclin\tPubTator3\n")
+    spill_dataset(aggregator, dataset, "bioconcepts2pubtator3", lambda df: df)
+    assert list(aggregator.get_pmids("dataset/api")) == [1]
+    df = pd.concat(aggregator.iter_aggregates())
+    assert df[["Mentions", "Resource"]].values.tolist() == [["CDK2|Cdk2|cyclin", "GNorm2|PubTator3"]]
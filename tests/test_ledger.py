@@ -0,0 +1,80 @@
+import os
+import sqlite3
+
+from ledger import FAILED, Ledger, get_stage
+
+
+def test_ledger(tmp_path):
+    with Ledger(tmp_path / "ledger.sqlite") as ledger:
+        assert not ledger.has_stage("ftp/relation2pubtator3")
+        ledger.record("ftp/relation2pubtator3", [(3, tmp_path / "3.tsv", "abc"), (1, tmp_path / "1.tsv", None)])
+        ledger.record("ftp/relation2pubtator3", [(2, None, None)], status=FAILED)
+        assert list(ledger.pmids("ftp/relation2pubtator3")) == [1, 3]
+        assert list(ledger.pmids("ftp/relation2pubtator3", FAILED)) == [2]
+        assert ledger.paths("ftp/relation2pubtator3") == [tmp_path / "1.tsv", tmp_path / "3.tsv"]
+        assert ledger.files("ftp/relation2pubtator3") == [(1, str(tmp_path / "1.tsv")), (3, str(tmp_path / "3.tsv"))]
+        assert ledger.files("ftp/relation2pubtator3", [2, 3, 4]) == [(3, str(tmp_path / "3.tsv"))]
+        assert ledger.files("ftp/relation2pubtator3", []) == []
+        assert list(ledger.pending("ftp/relation2pubtator3", [1, 2, 4])) == [2, 4]
+        assert ledger.forget("ftp/relation2pubtator3", [3, 5]) == [tmp_path / "3.tsv"]
+        assert list(ledger.pmids("ftp/relation2pubtator3")) == [1]
+
+    # the ledger persists across connections
+    with Ledger(tmp_path / "ledger.sqlite") as ledger:
+        assert list(ledger.pmids("ftp/relation2pubtator3")) == [1]
+
+
+def test_sync_dir(tmp_path):
+    gnorm2 = tmp_path / "local" / "gnorm2"
+    (gnorm2 / "part").mkdir(parents=True)
+    for name in ["1.bioc", "2.bioc", "part/3.bioc", "notes.txt", "x.bioc"]:
+        (gnorm2 / name).touch()
+    stage = get_stage(gnorm2)
+    assert stage == "local/gnorm2"
+
+    with Ledger(tmp_path / "ledger.sqlite") as ledger:
+        assert ledger.sync_dir(stage, gnorm2, ".bioc", recursive=True) == 3
+        assert list(ledger.pmids(stage)) == [1, 2, 3]
+        # unchanged directories are not listed again
+        assert ledger.sync_dir(stage, gnorm2, ".bioc", recursive=True) == 0
+
+        (gnorm2 / "2.bioc").unlink()
+        (gnorm2 / "part" / "4.bioc").touch()
+        for path in [gnorm2, gnorm2 / "part"]:
+            os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+        assert ledger.sync_dir(stage, gnorm2, ".bioc", recursive=True) == 2
+        assert list(ledger.pmids(stage)) == [1, 3, 4]
+        assert ledger.paths(stage)[-1] == gnorm2 / "part" / "4.bioc"
+
+
+def test_adopt_dir(tmp_path):
+    out_dir = tmp_path / "ftp" / "bioconcepts2pubtator3"
+    out_dir.mkdir(parents=True)
+    (out_dir / "1.tsv").touch()
+    with Ledger(tmp_path / "ledger.sqlite") as ledger:
+        ledger.adopt_dir(get_stage(out_dir), out_dir, ".tsv")
+        (out_dir / "2.tsv").touch()
+        ledger.adopt_dir(get_stage(out_dir), out_dir, ".tsv")
+        assert list(ledger.pmids(get_stage(out_dir))) == [1]
+
+
+def test_signatures(tmp_path):
+    with Ledger(tmp_path / "ledger.sqlite") as ledger:
+        ledger.record("local/merged", [(1, tmp_path / "1.bioc", None, '{"aioner": [1, 2]}'), (2, None, "abc")])
+        assert ledger.signatures("local/merged") == {1: '{"aioner": [1, 2]}'}
+        assert ledger.hashes("local/merged") == {1: None, 2: "abc"}
+
+
+def test_signature_column_added(tmp_path):
+    conn = sqlite3.connect(tmp_path / "ledger.sqlite")
+    conn.execute(
+        "CREATE TABLE stages (stage TEXT NOT NULL, pmid INTEGER NOT NULL, status TEXT NOT NULL, path TEXT, "
+        "hash TEXT, updated REAL NOT NULL, PRIMARY KEY (stage, pmid)) WITHOUT ROWID"
+    )
+    conn.execute("INSERT INTO stages VALUES ('local/merged', 1, 'done', NULL, NULL, 0)")
+    conn.commit()
+    conn.close()
+    with Ledger(tmp_path / "ledger.sqlite") as ledger:
+        assert ledger.signatures("local/merged") == {}
+        ledger.record("local/merged", [(1, None, None, "{}")])
+        assert ledger.signatures("local/merged") == {1: "{}"}
@@ -0,0 +1,222 @@
+from functools import partial
+
+from bioc import BioCAnnotation, BioCCollection, BioCDocument, BioCLocation, BioCPassage, biocxml
+
+from annotation_store import AnnotationArray, StringTable
+from merge import (
+    ALIGNMENT_RULES,
+    TOOLS,
+    align_passage,
+    build_entity_index,
+    get_entity_index_path,
+    load_entity_index,
+    load_merged,
+    merge_batch,
+    merge_collections,
+)
+
+
+def make_annotation(offset: int, length: int, **infons):
+    annotation = BioCAnnotation()
+    annotation.infons.update(infons)
+    annotation.add_location(BioCLocation(offset, length))
+    return annotation
+
+
+def make_passage(*annotations):
+    passage = BioCPassage()
+    for annotation in annotations:
+        passage.add_annotation(annotation)
+    return passage
+
+
+def to_arrays(aioner, tools: dict):
+    strings = StringTable()
+    return AnnotationArray.from_annotations(aioner.annotations, strings), {
+        tool: AnnotationArray.from_annotations(passage.annotations, strings) for tool, passage in tools.items()
+    }
+
+
+def test_align_passage():
+    aioner = make_passage(
+        make_annotation(0, 4, type="Gene"),
+        make_annotation(10, 5, type="Species"),
+        make_annotation(20, 3, type="Chemical"),
+        make_annotation(30, 3, type="Chemical"),
+        make_annotation(40, 6, type="Variant"),
+        make_annotation(50, 4, type="Gene"),
+    )
+    tools = {
+        "gnorm2": make_passage(
+            make_annotation(0, 4, type="Gene", **{"NCBI Gene": "1017"}),
+            make_annotation(10, 5, type="Species", **{"NCBI Taxonomy": "9606"}),
+            make_annotation(50, 4, type="Gene"),
+            make_annotation(50, 4, type="Gene", **{"NCBI Gene": "3630"}),
+        ),
+        "nlmchem": make_passage(
+            make_annotation(20, 3, type="Chemical", identifier="-"),
+            make_annotation(30, 3, type="Chemical", identifier="MESH:D008687"),
+        ),
+        "tmvar3": make_passage(make_annotation(40, 6, type="DNAMutation", Identifier="c.35G>A")),
+    }
+    aioner, tools = to_arrays(aioner, tools)
+    align_passage(aioner, tools)
+    assert [annotation.infons.get("identifier") for annotation in aioner] == [
+        "1017",
+        "9606",
+        None,
+        "MESH:D008687",
+        "c.35G>A",
+        "3630",
+    ]
+
+
+def test_align_passage_keeps_match_order():
+    # a tool annotation before the previous match of the same rule is not matched, as with the pointer scans
+    aioner = make_passage(make_annotation(10, 4, type="Disease"), make_annotation(0, 4, type="Disease"))
+    disease = make_passage(
+        make_annotation(0, 4, type="Disease", identifier="MESH:D003920"),
+        make_annotation(10, 4, type="Disease", identifier="MESH:D009369"),
+    )
+    aioner, tools = to_arrays(aioner, {"taggerone-disease": disease})
+    align_passage(aioner, tools)
+    assert [annotation.infons.get("identifier") for annotation in aioner] == ["MESH:D009369", None]
+
+
+def test_merge_collections():
+    collections = {}
+    for tool in TOOLS:
+        document = BioCDocument()
+        document.add_passage(make_passage(make_annotation(0, 4, type="Gene", **{"NCBI Gene": tool})))
+        collections[tool] = BioCCollection.of_documents(document)
+    merged = merge_collections(collections)
+    assert merged is collections["aioner"]
+    assert merged.documents[0].passages[0].annotations[0].infons["identifier"] == "gnorm2"
+    assert {rule.tool for rule in ALIGNMENT_RULES} == set(TOOLS) - {"aioner"}
+
+
+def write_tool_output(local_path, tool, pmid, identifier):
+    document = BioCDocument()
+    document.id = str(pmid)
+    document.add_passage(make_passage(make_annotation(0, 4, type="Gene", **{"NCBI Gene": identifier})))
+    with open(local_path / tool / f"{pmid}{TOOLS[tool]}", "w") as f:
+        biocxml.dump(BioCCollection.of_documents(document), f)
+
+
+def read_identifier(path):
+    with open(path) as f:
+        return biocxml.load(f).documents[0].passages[0].annotations[0].infons.get("identifier")
+
+
+def test_merge_batch(tmp_path):
+    local_path = tmp_path / "local"
+    merged_path = local_path / "merged"
+    merged_path.mkdir(parents=True)
+    for tool in TOOLS:
+        (local_path / tool).mkdir()
+        for pmid in [1, 2, 3]:
+            write_tool_output(local_path, tool, pmid, f"{tool}{pmid}")
+
+    records, parse_times = merge_batch([1, 2, 3], local_path, merged_path)
+    assert [(pmid, path) for pmid, path, _, _ in records] == [(pmid, merged_path / f"{pmid}.bioc") for pmid in [1, 2, 3]]
+    assert set(parse_times) == set(TOOLS)
+    for pmid in [1, 2, 3]:
+        assert read_identifier(merged_path / f"{pmid}.bioc") == f"gnorm2{pmid}"
+
+    # unchanged inputs are skipped, a rerun tool only touches its documents
+    signatures = {pmid: signature for pmid, _, _, signature in records}
+    assert merge_batch([1, 2, 3], local_path, merged_path, signatures)[0] == []
+    # unless their merged document was removed or is asked for in another format
+    (merged_path / "1.bioc").unlink()
+    records, _ = merge_batch([1, 2, 3], local_path, merged_path, signatures)
+    assert [(pmid, path) for pmid, path, _, _ in records] == [(1, merged_path / "1.bioc")]
+    records, _ = merge_batch([3], local_path, merged_path, signatures, output="both")
+    assert [(pmid, path) for pmid, path, _, _ in records] == [(3, merged_path / "3.pickle")]
+    assert merge_batch([3], local_path, merged_path, signatures, output="cache")[0] == []
+    write_tool_output(local_path, "gnorm2", 2, "rerun")
+    records, _ = merge_batch([1, 2, 3], local_path, merged_path, signatures, partial=True)
+    assert [pmid for pmid, _, _, _ in records] == [2]
+    assert read_identifier(merged_path / "2.bioc") == "rerun"
+
+    # a partial merge drops identifiers the rerun tool no longer provides
+    signatures.update({pmid: signature for pmid, _, _, signature in records})
+    (local_path / "gnorm2" / "2.bioc").write_text(
+        '<?xml version="1.0"?><collection><source/><date/><key/>'
+        "<document><id>2</id><passage><offset>0</offset></passage></document></collection>"
+    )
+    records, _ = merge_batch([2], local_path, merged_path, signatures, partial=True)
+    assert [pmid for pmid, _, _, _ in records] == [2]
+    assert read_identifier(merged_path / "2.bioc") is None
+
+
+def test_merge_batch_missing_output(tmp_path):
+    local_path = tmp_path / "local"
+    merged_path = local_path / "merged"
+    merged_path.mkdir(parents=True)
+    for tool in TOOLS:
+        (local_path / tool).mkdir()
+        for pmid in [1, 2]:
+            write_tool_output(local_path, tool, pmid, f"{tool}{pmid}")
+    records, _ = merge_batch([1, 2], local_path, merged_path)
+    signatures = {pmid: signature for pmid, _, _, signature in records}
+
+    # a removed tool output leaves its PMID unmerged instead of failing the batch
+    (local_path / "nlmchem" / "1.bioc").unlink()
+    write_tool_output(local_path, "gnorm2", 2, "rerun")
+    records, _ = merge_batch([1, 2], local_path, merged_path, signatures)
+    assert [pmid for pmid, _, _, _ in records] == [2]
+
+
+def record_export(exports, pmid, collection):
+    exports.append((pmid, collection.documents[0].passages[0].annotations[0].infons.get("identifier")))
+
+
+def test_merge_batch_to_cache(tmp_path):
+    local_path = tmp_path / "local"
+    merged_path = local_path / "merged"
+    merged_path.mkdir(parents=True)
+    for tool in TOOLS:
+        (local_path / tool).mkdir()
+        write_tool_output(local_path, tool, 1, f"{tool}1")
+
+    exports = []
+    records, _ = merge_batch([1], local_path, merged_path, output="cache", export=partial(record_export, exports))
+    assert [(pmid, path) for pmid, path, _, _ in records] == [(1, merged_path / "1.pickle")]
+    assert exports == [(1, "gnorm21")]
+    assert not (merged_path / "1.bioc").exists()
+    collection = load_merged(merged_path, 1)
+    assert collection.documents[0].passages[0].annotations[0].infons["identifier"] == "gnorm21"
+
+    # a partial merge starts from the cached document, and writing XML drops the cache
+    signatures = {pmid: signature for pmid, _, _, signature in records}
+    write_tool_output(local_path, "gnorm2", 1, "rerun")
+    records, _ = merge_batch([1], local_path, merged_path, signatures, partial=True, output="xml")
+    assert [path for _, path, _, _ in records] == [merged_path / "1.bioc"]
+    assert read_identifier(merged_path / "1.bioc") == "rerun"
+    assert not (merged_path / "1.pickle").exists()
+
+
+def test_entity_index(tmp_path):
+    document = BioCDocument()
+    document.add_passage(
+        make_passage(
+            make_annotation(0, 4, type="Gene", identifier="1017"),
+            make_annotation(5, 4, type="Gene", identifier="-"),
+            make_annotation(10, 4, type="Disease"),
+            make_annotation(20, 4, type="Chemical", identifier="MESH:D008687"),
+        )
+    )
+    document.add_passage(make_passage(make_annotation(30, 4, type="Species", identifier="1017")))
+    # mention texts are not keys, and a later concept with the same identifier wins as before
+    index = build_entity_index(BioCCollection.of_documents(document))
+    assert index == {"1017": "Species|1017", "MESH:D008687": "Chemical|MESH:D008687"}
+
+    local_path = tmp_path / "local"
+    merged_path = local_path / "merged"
+    merged_path.mkdir(parents=True)
+    for tool in TOOLS:
+        (local_path / tool).mkdir()
+        write_tool_output(local_path, tool, 1, f"{tool}1")
+    merge_batch([1], local_path, merged_path)
+    assert load_entity_index(get_entity_index_path(merged_path, 1)) == {"gnorm21": "Gene|gnorm21"}
+    assert load_entity_index(get_entity_index_path(merged_path, 2)) is None
@@ -0,0 +1,255 @@
+import gzip
+import io
+import os
+
+from bioc import BioCAnnotation, BioCCollection, BioCDocument, BioCPassage, biocxml
+
+from api_cache import ResponseCache
+from ledger import Ledger, content_hash, get_stage
+from organize import (
+    EntityFixupReader,
+    convert_abstracts,
+    convert_pmc_xml,
+    extract_bioconcepts_range,
+    extract_pmids_indexed_batch,
+    gather_split_pmids,
+    get_relation2pubtator3_df_pmids,
+    get_pubmed_abstract_path,
+    load_quarantine,
+    process_pubtator3_api_response,
+    pull_from_pubtator3_api_batched,
+    rederive_from_pubtator3_api_cache,
+    stage_raw,
+    stage_raw_abstracts,
+)
+from pmid_index import build_pmid_index, split_pmid_aligned
+from pmidset import PMIDSet
+
+
+def test_extract_bioconcepts_range(tmp_path, bioconcepts_dump, bioconcepts_rows):
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    records = [
+        record
+        for start, end in split_pmid_aligned(bioconcepts_dump, 3)
+        for record in extract_bioconcepts_range(bioconcepts_dump, start, end, out_dir, frozenset({1, 3, 4}))
+    ]
+    assert [(pmid, path) for pmid, path, _ in records] == [(1, out_dir / "1.tsv"), (3, out_dir / "3.tsv")]
+    assert records[1][2] == content_hash((out_dir / "3.tsv").read_bytes())
+    assert sorted(path.name for path in out_dir.iterdir()) == ["1.tsv", "3.tsv"]
+    lines = (out_dir / "3.tsv").read_text().splitlines()
+    assert lines[0] == "PMID\tType\tConcept ID\tMentions\tResource"
+    assert lines[1:] == ["\t".join(map(str, row)) for row in bioconcepts_rows if row[0] == 3]
+
+
+def test_extract_bioconcepts_range_non_contiguous(tmp_path):
+    dump = tmp_path / "bioconcepts2pubtator3"
+    rows = ["5\tGene\t1\tA\tGNorm2\n", "2\tGene\t2\tB\tGNorm2\n", "5\tGene\t3\tC\tGNorm2\n"]
+    dump.write_text(rows[0] + "malformed\n" + rows[1] + "\n" + rows[2])
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    # malformed lines are skipped and the rows of a PMID found again later in the range are appended
+    records = extract_bioconcepts_range(dump, 0, dump.stat().st_size, out_dir, frozenset({2, 5}))
+    assert (out_dir / "5.tsv").read_text().splitlines()[1:] == [rows[0].strip(), rows[2].strip()]
+    assert records == [
+        (5, out_dir / "5.tsv", content_hash((out_dir / "5.tsv").read_bytes())),
+        (2, out_dir / "2.tsv", content_hash((out_dir / "2.tsv").read_bytes())),
+    ]
+
+    # a PMID split across ranges is gathered again in one pass over the dump
+    for path in out_dir.iterdir():
+        path.unlink()
+    middle = len(rows[0]) + len("malformed\n") + len(rows[1])
+    ranges = [(0, middle), (middle, dump.stat().st_size)]
+    records = [extract_bioconcepts_range(dump, start, end, out_dir, frozenset({2, 5})) for start, end in ranges]
+    assert (out_dir / "5.tsv").read_text().splitlines()[1:] == [rows[0].strip()]
+    records = [record for range_records in gather_split_pmids(dump, out_dir, records) for record in range_records]
+    assert sorted(pmid for pmid, _, _ in records) == [2, 5]
+    assert (out_dir / "5.tsv").read_text().splitlines()[1:] == [rows[0].strip(), rows[2].strip()]
+
+
+def test_extract_pmids_indexed_batch(tmp_path, bioconcepts_dump):
+    build_pmid_index(bioconcepts_dump, max_workers=2)
+    scanned = tmp_path / "scanned"
+    scanned.mkdir()
+    for start, end in split_pmid_aligned(bioconcepts_dump, 1):
+        extract_bioconcepts_range(bioconcepts_dump, start, end, scanned, frozenset({1, 3, 10}))
+    indexed = tmp_path / "indexed"
+    indexed.mkdir()
+    records = extract_pmids_indexed_batch(bioconcepts_dump, [1, 3, 10], indexed, "bioconcepts2pubtator3")
+    assert [pmid for pmid, _, _ in records] == [1, 3, 10]
+    for path in scanned.iterdir():
+        assert (indexed / path.name).read_bytes() == path.read_bytes()
+
+
+def test_get_relation2pubtator3_df_pmids(tmp_path):
+    dump = tmp_path / "relation2pubtator3"
+    dump.write_text(
+        "1\tassociate\tGene|1017\tDisease|MESH:D003920\n"
+        "2\ttreat\tChemical|MESH:D008687\tDisease|MESH:D003920\n"
+        "2\tassociate\tGene|3630\tDisease|MESH:D003920\n"
+        "5\tcause\tChemical|MESH:D005947\tDisease|MESH:D009369\n"
+    )
+    df, pmids = get_relation2pubtator3_df_pmids(dump, PMIDSet([2, 3, 5]), chunksize=3)
+    assert list(pmids) == [1, 2, 5]
+    assert df["PMID"].tolist() == [2, 2, 5]
+    assert df["1st"].tolist() == ["Chemical|MESH:D008687", "Gene|3630", "Chemical|MESH:D005947"]
+    assert df["Type"].tolist() == ["treat", "associate", "cause"]
+    # the chunks are cast before they are joined, with the union of their categories
+    assert all(df[column].dtype == "category" for column in ["Type", "1st", "2nd"])
+
+
+def test_rederive_from_pubtator3_api_cache(tmp_path):
+    document = BioCDocument()
+    document.id = "PMC1"
+    passage = BioCPassage()
+    passage.offset = 0
+    passage.text = "CDK2 in humans"
+    passage.infons["article-id_pmid"] = "42"
+    annotation = BioCAnnotation()
+    annotation.text = "CDK2"
+    annotation.infons.update({"type": "Gene", "identifier": "1017"})
+    passage.add_annotation(annotation)
+    document.add_passage(passage)
+    text = biocxml.dumps(BioCCollection.of_documents(document))
+
+    fetched = tmp_path / "fetched"
+    fetched.mkdir()
+    process_pubtator3_api_response(text, fetched, fetched)
+    cache = ResponseCache(tmp_path / "cache", {"full": "true"})
+    cache.put([42, 43], text)
+    cache.put([42], text)
+    assert cache.get([42]) == text
+
+    rederived = tmp_path / "rederived"
+    rederived.mkdir()
+    # a PMID in several cached responses is derived once, a PMID that is no longer pending not at all
+    assert len(rederive_from_pubtator3_api_cache(PMIDSet([42, 44]), cache, rederived, rederived)) == 1
+    assert (rederived / "42.tsv").read_text() == (fetched / "42.tsv").read_text()
+    assert not rederive_from_pubtator3_api_cache(PMIDSet([43]), cache, rederived, rederived)
+
+
+def test_pull_from_pubtator3_api_batched_cached(tmp_path):
+    document = BioCDocument()
+    document.id = "42"
+    passage = BioCPassage()
+    passage.offset = 0
+    passage.text = "CDK2"
+    annotation = BioCAnnotation()
+    annotation.text = "CDK2"
+    annotation.infons.update({"type": "Gene", "identifier": "1017"})
+    passage.add_annotation(annotation)
+    document.add_passage(passage)
+    cache = ResponseCache(tmp_path / "cache", {"full": "true"})
+    cache.put([42, 43], biocxml.dumps(BioCCollection.of_documents(document)))
+
+    bioconcepts = tmp_path / "api" / "bioconcepts2pubtator3"
+    relations = tmp_path / "api" / "relation2pubtator3"
+    bioconcepts.mkdir(parents=True)
+    relations.mkdir()
+    with Ledger(tmp_path / "ledger.sqlite") as ledger:
+        # the cached response is used instead of fetching it, and 43, which it has no document for, counts as
+        # fetched in the ledger like in the checkpoint
+        pull_from_pubtator3_api_batched(PMIDSet([42, 43]), bioconcepts, relations, ledger, cache=cache)
+        assert list(ledger.pmids(get_stage(bioconcepts))) == [42, 43]
+    assert (bioconcepts / "42.tsv").read_text().startswith("PMID")
+    assert (bioconcepts / "43.tsv").read_text() == ""
+    assert (tmp_path / "api" / "checkpoint.txt").read_text().split() == ["42", "43"]
+
+
+PUBMED_XML = """<?xml version="1.0"?>
+<PubmedArticleSet>
+<PubmedArticle>
+<MedlineCitation>
+<PMID>42</PMID>
+<Article>
+<Journal><JournalIssue><PubDate><Year>2020</Year></PubDate></JournalIssue><Title>J</Title></Journal>
+<ArticleTitle>Dose of 5 &plusmn; 1 mg</ArticleTitle>
+<Abstract><AbstractText>CDK2 in humans.</AbstractText></Abstract>
+</Article>
+</MedlineCitation>
+</PubmedArticle>
+</PubmedArticleSet>
+"""
+
+
+def test_entity_fixup_reader():
+    text = "a&plusmn;b" * 100 + "&amp;"
+    for size in range(1, 12):
+        reader = EntityFixupReader(io.StringIO(text))
+        chunks = []
+        while chunk := reader.read(size):
+            chunks.append(chunk)
+        assert "".join(chunks) == "a±b" * 100 + "&amp;"
+
+
+def test_convert_abstracts(tmp_path):
+    archive = tmp_path / "archive"
+    for pmid, text in [(42, PUBMED_XML), (43, "<PubmedArticleSet><PubmedArticle>")]:
+        path = get_pubmed_abstract_path(archive, pmid)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(path, "wt") as f:
+            f.write(text)
+    manifest_path = tmp_path / "abstracts.tsv"
+    assert stage_raw_abstracts(archive, manifest_path, PMIDSet([42, 43, 44]), io_workers=2) == [42, 43]
+    bioc = tmp_path / "bioc"
+    quarantine_path = tmp_path / "quarantine.tsv"
+    convert_abstracts(manifest_path, bioc, quarantine_path, max_workers=2)
+
+    with open(bioc / "42.bioc") as f:
+        collection = biocxml.load(f)
+    assert collection.documents[0].passages[0].text == "Dose of 5 ± 1 mg"
+    assert collection.documents[0].passages[0].infons["type"] == "title"
+    assert not (bioc / "43.bioc").exists()
+    assert list(load_quarantine(quarantine_path)) == [str(get_pubmed_abstract_path(archive, 43))]
+
+
+def test_stage_raw(tmp_path):
+    source = tmp_path / "PMC1.xml.gz"
+    with gzip.open(source, "wt") as f:
+        f.write("<article/>")
+    staged = tmp_path / "articles"
+    staged.mkdir()
+    assert stage_raw(source, staged, 7) == staged / "7.xml.gz"
+    assert (staged / "7.xml.gz").read_bytes() == source.read_bytes()
+    assert stage_raw(tmp_path / "missing.xml", staged, 8) is None
+    assert [path.name for path in staged.iterdir()] == ["7.xml.gz"]
+
+
+PMC_XML = """<?xml version="1.0"?>
+<pmc-articleset><article><front><article-meta>
+<title-group><article-title>Title here</article-title></title-group>
+<abstract><p>CDK2 in humans.</p></abstract>
+</article-meta></front></article></pmc-articleset>
+"""
+
+
+def test_convert_pmc_xml(tmp_path):
+    raw = tmp_path / "articles"
+    raw.mkdir()
+    with gzip.open(raw / "7.xml.gz", "wt") as f:
+        f.write(PMC_XML)
+    (raw / "8.xml").write_text("<pmc-articleset><article>")
+    bioc = tmp_path / "bioc"
+    quarantine_path = tmp_path / "quarantine.tsv"
+    convert_pmc_xml(raw, bioc, quarantine_path, max_workers=2)
+
+    with open(bioc / "7.bioc") as f:
+        collection = biocxml.load(f)
+    assert collection.documents[0].id == "7"
+    assert collection.documents[0].passages[0].infons["type"] == "title"
+    assert load_quarantine(quarantine_path) == {str(raw / "8.xml"): (raw / "8.xml").stat().st_mtime_ns}
+
+    # up to date outputs and quarantined sources are not converted again
+    mtime = (bioc / "7.bioc").stat().st_mtime_ns
+    convert_pmc_xml(raw, bioc, quarantine_path, max_workers=2)
+    assert (bioc / "7.bioc").stat().st_mtime_ns == mtime
+    assert len(quarantine_path.read_text().splitlines()) == 1
+
+    # a quarantined source is retried once it is replaced
+    (raw / "8.xml").write_text(PMC_XML)
+    os.utime(raw / "8.xml", ns=(0, load_quarantine(quarantine_path)[str(raw / "8.xml")] + 1))
+    convert_pmc_xml(raw, bioc, quarantine_path, max_workers=2)
+    assert (bioc / "8.bioc").exists()
+    assert len(quarantine_path.read_text().splitlines()) == 1
+
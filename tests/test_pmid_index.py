@@ -0,0 +1,68 @@
+import os
+
+from pmid_index import build_pmid_index, load_pmid_index, split_pmid_aligned
+
+
+def test_split_pmid_aligned(bioconcepts_dump):
+    data = bioconcepts_dump.read_bytes()
+    for n_splits in range(1, 20):
+        ranges = split_pmid_aligned(bioconcepts_dump, n_splits)
+        assert ranges[0][0] == 0
+        assert ranges[-1][1] == len(data)
+        pmids = []
+        for start, end in ranges:
+            lines = [line for line in data[start:end].splitlines() if line]
+            assert lines
+            pmids.append({line.split(b"\t")[0] for line in lines})
+        for a, b in zip(pmids, pmids[1:]):
+            assert not a & b
+
+
+def test_pmid_index(bioconcepts_dump, bioconcepts_rows):
+    build_pmid_index(bioconcepts_dump, max_workers=2)
+    index = load_pmid_index(bioconcepts_dump)
+    assert index.pmids().tolist() == [1, 2, 3, 10]
+    assert 3 in index
+    assert 4 not in index
+    for pmid in (1, 2, 3, 10):
+        expected = "".join("\t".join(map(str, row)) + "\n" for row in bioconcepts_rows if row[0] == pmid)
+        assert index.read(pmid).decode() == expected
+    assert index.read(4) == b""
+    assert index.lookup([10, 1])["pmid"].tolist() == [1, 10]
+
+
+def test_pmid_index_non_contiguous(tmp_path):
+    dump = tmp_path / "relation2pubtator3"
+    dump.write_text(
+        "5\tassociate\tGene|1\tDisease|D1\n2\ttreat\tChemical|C\tDisease|D2\n5\tcause\tGene|2\tDisease|D3\n"
+    )
+    build_pmid_index(dump, max_workers=1)
+    index = load_pmid_index(dump)
+    assert index.pmids().tolist() == [2, 5]
+    assert index.read(5) == b"5\tassociate\tGene|1\tDisease|D1\n5\tcause\tGene|2\tDisease|D3\n"
+
+
+def test_pmid_index_malformed(tmp_path):
+    dump = tmp_path / "relation2pubtator3"
+    dump.write_text(
+        "PMID\tType\t1st\t2nd\n"
+        "5\tassociate\tGene|1\tDisease|D1\n"
+        "truncated\n"
+        "5\tcause\tGene|2\tDisease|D3\n"
+        "99999999999\tcause\n"
+        "2\ttreat\tChemical|C\tDisease|D2\n"
+    )
+    # malformed lines are skipped and end the run before them, so they are never read as rows of a PMID
+    build_pmid_index(dump, max_workers=2)
+    index = load_pmid_index(dump)
+    assert index.pmids().tolist() == [2, 5]
+    assert index.read(5) == b"5\tassociate\tGene|1\tDisease|D1\n5\tcause\tGene|2\tDisease|D3\n"
+    assert index.read(2) == b"2\ttreat\tChemical|C\tDisease|D2\n"
+
+
+def test_stale_pmid_index(tmp_path, bioconcepts_dump):
+    build_pmid_index(bioconcepts_dump, max_workers=1)
+    index_path = tmp_path / "bioconcepts2pubtator3.pmidx.npy"
+    stat = index_path.stat()
+    os.utime(bioconcepts_dump, (stat.st_atime, stat.st_mtime + 10))
+    assert load_pmid_index(bioconcepts_dump) is None
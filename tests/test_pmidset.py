@@ -0,0 +1,48 @@
+import numpy as np
+
+from organize import get_venn3_subsets
+from pmidset import PMIDSet, load_dump_pmids
+
+
+def test_pmidset_algebra():
+    a = PMIDSet([5, 1, 3, 3, 9])
+    b = PMIDSet(np.array([3, 4, 5]))
+    assert list(a) == [1, 3, 5, 9]
+    assert len(a) == 4
+    assert 3 in a
+    assert 4 not in a
+    assert a.max() == 9
+    assert list(a & b) == [3, 5]
+    assert list(a | b) == [1, 3, 4, 5, 9]
+    assert list(a - b) == [1, 9]
+    assert list({1, 4} & a) == [1]
+    assert list({1, 4} - a) == [4]
+    assert a.isin([1, 2, 9]).tolist() == [True, False, True]
+
+
+def test_venn3_subsets():
+    a, b, c = {1, 2, 3, 4}, {3, 4, 5}, {2, 4, 5, 6}
+    expected = (
+        len(a - b - c),
+        len(b - a - c),
+        len(a & b - c),
+        len(c - a - b),
+        len(a & c - b),
+        len(b & c - a),
+        len(a & b & c),
+    )
+    assert get_venn3_subsets(PMIDSet(a), PMIDSet(b), PMIDSet(c)) == expected
+
+
+def test_load_dump_pmids(tmp_path, bioconcepts_dump):
+    pmids = load_dump_pmids(bioconcepts_dump, max_workers=2)
+    assert list(pmids) == [1, 2, 3, 10]
+    assert (tmp_path / "bioconcepts2pubtator3.pmids.npy").exists()
+    assert load_dump_pmids(bioconcepts_dump) == pmids
+
+
+def test_load_dump_pmids_malformed(tmp_path):
+    dump = tmp_path / "relation2pubtator3"
+    dump.write_text("PMID\tType\t1st\t2nd\n7\ttreat\tChemical|C\tDisease|D\ntruncated\n3\tcause\tGene|1\tDisease|D\n")
+    # malformed lines are skipped instead of failing the scan
+    assert list(load_dump_pmids(dump, max_workers=2)) == [3, 7]
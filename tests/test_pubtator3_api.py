@@ -0,0 +1,151 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from api_cache import ResponseCache
+from pmidset import PMIDSet
+from pubtator3_api import Checkpoint, fetch_pubtator3_api
+
+
+@pytest.fixture
+def stub_server():
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            pmids = parse_qs(urlparse(self.path).query)["pmids"][0]
+            requests.append(pmids)
+            if pmids.startswith("3") and requests.count(pmids) == 1:
+                self.send_response(503)
+                self.send_header("Retry-After", "0")
+                self.end_headers()
+                return
+            if pmids.startswith("5"):
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(f"<collection>{pmids}</collection>".encode())
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/export/biocxml", requests
+    server.shutdown()
+
+
+def test_fetch_pubtator3_api(tmp_path, stub_server):
+    url, requests = stub_server
+    checkpoint_path = tmp_path / "checkpoint.txt"
+    responses = []
+    batches = [[1, 2], [3, 4], [5, 6]]
+
+    def process_response(pmids, text):
+        # responses are processed off the event loop
+        assert threading.current_thread() is not threading.main_thread()
+        assert text == f"<collection>{','.join(map(str, pmids))}</collection>"
+        responses.append(text)
+
+    failed = asyncio.run(
+        fetch_pubtator3_api(batches, process_response, checkpoint_path, url=url, rate=100, backoff=0)
+    )
+    assert failed == 1
+    assert sorted(responses) == ["<collection>1,2</collection>", "<collection>3,4</collection>"]
+    assert requests.count("3,4") == 2
+    assert sorted(Checkpoint(checkpoint_path).pmids) == [1, 2, 3, 4]
+
+    requests.clear()
+    responses.clear()
+    asyncio.run(fetch_pubtator3_api(batches, process_response, checkpoint_path, url=url, rate=100, backoff=0))
+    assert requests == ["5,6"]
+    assert responses == []
+
+    # PMIDs that are no longer relevant are dropped from the checkpoint and fetched again once they are
+    requests.clear()
+    relevant_pmids = PMIDSet([3, 4, 5, 6])
+    asyncio.run(
+        fetch_pubtator3_api(
+            [[3, 4]], process_response, checkpoint_path, url=url, rate=100, relevant_pmids=relevant_pmids
+        )
+    )
+    assert requests == [] and sorted(Checkpoint(checkpoint_path).pmids) == [3, 4]
+    asyncio.run(fetch_pubtator3_api([[1, 2]], process_response, checkpoint_path, url=url, rate=100))
+    assert requests == ["1,2"]
+
+
+def test_fetch_pubtator3_api_cached(tmp_path, stub_server):
+    url, requests = stub_server
+    cache = ResponseCache(tmp_path / "cache", {"full": "true"})
+    cache.put([7, 8], "<collection>cached</collection>")
+    responses = []
+    failed = asyncio.run(
+        fetch_pubtator3_api(
+            [[7, 8], [1, 2]],
+            lambda pmids, text: responses.append((pmids, text)),
+            tmp_path / "checkpoint.txt",
+            url=url,
+            rate=100,
+            cache=cache,
+        )
+    )
+    # a cached batch is processed and checkpointed without requesting it
+    assert failed == 0 and requests == ["1,2"]
+    assert sorted(responses) == [([1, 2], "<collection>1,2</collection>"), ([7, 8], "<collection>cached</collection>")]
+    assert sorted(Checkpoint(tmp_path / "checkpoint.txt").pmids) == [1, 2, 7, 8]
+
+
+class CountingCache:
+    # a warm cache that counts the responses read but not yet processed
+    def __init__(self):
+        self.outstanding = 0
+        self.max_outstanding = 0
+
+    def get(self, pmids):
+        self.outstanding += 1
+        self.max_outstanding = max(self.max_outstanding, self.outstanding)
+        return f"<collection>{pmids}</collection>"
+
+
+def test_fetch_pubtator3_api_cached_bounded(tmp_path):
+    cache = CountingCache()
+    processed = []
+
+    def process_response(pmids, text):
+        cache.outstanding -= 1
+        processed.append(pmids)
+
+    batches = [[pmid] for pmid in range(1, 101)]
+    failed = asyncio.run(
+        fetch_pubtator3_api(
+            batches, process_response, tmp_path / "checkpoint.txt", url="http://127.0.0.1:9", concurrency=2, cache=cache
+        )
+    )
+    # a warm cache is worked through a window of batches instead of being read into memory at once
+    assert failed == 0 and sorted(processed) == batches
+    assert cache.max_outstanding <= 2
+
+
+def test_fetch_pubtator3_api_cached_inline(tmp_path):
+    cache = CountingCache()
+    processed = []
+
+    def process_response(pmids, text):
+        cache.outstanding -= 1
+        processed.append(pmids)
+
+    batches = [[pmid] for pmid in range(1, 21)]
+    asyncio.run(
+        fetch_pubtator3_api(
+            batches, process_response, tmp_path / "checkpoint.txt", url="http://127.0.0.1:9", concurrency=4, cache=cache
+        )
+    )
+    # every cached response is processed right after it is read, before the next one is read
+    assert sorted(processed) == batches and cache.max_outstanding == 1
+    assert sorted(Checkpoint(tmp_path / "checkpoint.txt").pmids) == list(range(1, 21))
@@ -0,0 +1,87 @@
+import os
+import uuid
+from contextlib import contextmanager
+
+from runner import get_max_workers, get_pool_shape, run_per_file
+
+
+def double(path, out_dir, chunk_outputs=None):
+    value = int(path.read_text())
+    if value < 0:
+        raise ValueError(f"negative value {value}")
+    (out_dir / path.name).write_text(str(2 * value))
+    if chunk_outputs is not None:
+        chunk_outputs.append(path.name)
+    return path.name, 2 * value
+
+
+@contextmanager
+def open_outputs(out_dir):
+    outputs = []
+    yield outputs
+    (out_dir / f"chunk-{uuid.uuid4().hex}").write_text("\n".join(outputs))
+
+
+def make_inputs(tmp_path, values):
+    in_dir = tmp_path / "in"
+    out_dir = tmp_path / "out"
+    in_dir.mkdir()
+    out_dir.mkdir()
+    paths = []
+    for i, value in enumerate(values):
+        path = in_dir / f"{i}.txt"
+        path.write_text(str(value))
+        paths.append(path)
+    return paths, out_dir
+
+
+def test_run_per_file(tmp_path):
+    paths, out_dir = make_inputs(tmp_path, [1, 2, -3, 4])
+    error_report = tmp_path / "errors.tsv"
+    report = run_per_file(double, paths, args=(out_dir,), max_workers=2, error_report=error_report)
+    assert sorted(report.results) == [("0.txt", 2), ("1.txt", 4), ("3.txt", 8)]
+    assert report.failures == [(str(paths[2]), "ValueError: negative value -3")]
+    assert error_report.read_text() == f"{paths[2]}\tValueError: negative value -3\n"
+
+    # outputs newer than their inputs and dependencies are skipped
+    report = run_per_file(double, paths, args=(out_dir,), get_output=lambda path: out_dir / path.name, max_workers=1)
+    assert report.skipped == 3 and report.failures == [(str(paths[2]), "ValueError: negative value -3")]
+    report = run_per_file(
+        double,
+        paths,
+        args=(out_dir,),
+        get_output=lambda path: out_dir / path.name,
+        get_dependencies=lambda path: [tmp_path / "missing"],
+        max_workers=1,
+    )
+    assert report.skipped == 0 and len(report.results) == 3
+
+
+def test_run_per_file_unavailable(tmp_path):
+    paths, out_dir = make_inputs(tmp_path, [1, 2])
+    paths.append(tmp_path / "in" / "removed.txt")
+    error_report = tmp_path / "errors.tsv"
+    report = run_per_file(double, paths, args=(out_dir,), max_workers=1, error_report=error_report)
+    assert sorted(report.results) == [("0.txt", 2), ("1.txt", 4)]
+    assert [(path, error.split(":")[0]) for path, error in report.failures] == [(str(paths[2]), "FileNotFoundError")]
+    assert error_report.read_text().startswith(f"{paths[2]}\tFileNotFoundError")
+
+
+def test_run_per_file_open_chunk(tmp_path):
+    paths, out_dir = make_inputs(tmp_path, range(10))
+    report = run_per_file(double, paths, args=(out_dir,), open_chunk=lambda: open_outputs(out_dir), max_workers=1)
+    assert len(report.results) == 10
+    chunk_files = list(out_dir.glob("chunk-*"))
+    assert sorted(name for path in chunk_files for name in path.read_text().split()) == sorted(p.name for p in paths)
+
+
+def test_get_max_workers():
+    assert get_max_workers(1) == 1
+    assert 1 <= get_max_workers() <= os.cpu_count()
+    assert get_max_workers(10**6) == get_max_workers()
+
+
+def test_get_pool_shape():
+    assert get_pool_shape([10**6] * 10, 24) == (10, 1)
+    assert get_pool_shape([10**3] * 10**6, 8) == (8, 31250)
+    assert get_pool_shape([10**3] * 10**5, 8, chunk_bytes=10**5) == (8, 100)
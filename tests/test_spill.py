@@ -0,0 +1,67 @@
+import random
+
+import pandas as pd
+
+from ingest import agg_bioconcepts
+from spill import SpillAggregator
+
+KEYS = ["Concept ID", "Type"]
+
+
+def make_batch(rng: random.Random, pmids: list[int]):
+    rows = []
+    for pmid in pmids:
+        for _ in range(rng.randint(0, 5)):
+            rows.append(
+                {
+                    "PMID": str(pmid),
+                    "Type": rng.choice(["Gene", "Disease", "Chemical"]),
+                    "Concept ID": rng.choice([rng.randint(1, 300), str(rng.randint(1, 300))]),
+                    "Mentions": rng.choice(["CDK2", "cyclin E", "a|b"]),
+                    "Resource": "PubTator3",
+                }
+            )
+    return pd.DataFrame(rows, columns=["PMID", "Type", "Concept ID", "Mentions", "Resource"])
+
+
+def collect(frames):
+    return pd.concat(list(frames)).sort_values(KEYS).reset_index(drop=True)
+
+
+def test_matches_in_memory_aggregation(tmp_path):
+    rng = random.Random(0)
+    batches = [make_batch(rng, range(i * 100, (i + 1) * 100)) for i in range(5)]
+    expected = agg_bioconcepts(pd.concat(batches).astype({"Concept ID": str})).sort_values(KEYS)
+    expected = expected.reset_index(drop=True)
+
+    # a budget this small has to split partitions by more bits of the key hash
+    aggregator = SpillAggregator(tmp_path, KEYS, agg_bioconcepts, memory_budget=2**17, partitions=4)
+    for i, df in enumerate(batches):
+        aggregator.add(df, {"ftp/bioconcepts2pubtator3": range(i * 100, (i + 1) * 100)})
+    pd.testing.assert_frame_equal(collect(aggregator.iter_aggregates()), expected)
+    pd.testing.assert_frame_equal(collect(aggregator.compact()), expected)
+    assert all(run["compacted"] for run in aggregator.runs)
+    assert not (tmp_path / "split").exists() or not list((tmp_path / "split").iterdir())
+
+    # a new budget does not change the partitioning of the existing runs
+    aggregator = SpillAggregator(tmp_path, KEYS, agg_bioconcepts, memory_budget=2**30)
+    assert aggregator.partitions == 4 and len(aggregator.get_pmids("ftp/bioconcepts2pubtator3")) == 500
+    pd.testing.assert_frame_equal(collect(aggregator.iter_aggregates()), expected)
+
+
+def test_uncommitted_batch_is_discarded(tmp_path):
+    rng = random.Random(1)
+    aggregator = SpillAggregator(tmp_path, KEYS, agg_bioconcepts, memory_budget=2**30)
+    aggregator.add(make_batch(rng, [1, 2, 3]), {"local/bioconcepts2pubtator3": [1, 2, 3], "dataset": [3]})
+    committed = collect(aggregator.iter_aggregates())
+
+    # a batch that crashed after writing its runs but before replacing the checkpoint
+    aggregator.write_run(make_batch(rng, [4]), 0, False)
+    aggregator.get_pmids("dataset").save(tmp_path / "pmids-dataset-999999.npy")
+
+    aggregator = SpillAggregator(tmp_path, KEYS, agg_bioconcepts, memory_budget=2**30)
+    assert list(aggregator.get_pmids("local/bioconcepts2pubtator3")) == [1, 2, 3]
+    assert list(aggregator.get_pmids("dataset")) == [3] and not len(aggregator.get_pmids("api/bioconcepts2pubtator3"))
+    assert sorted(path.name for path in (tmp_path / "runs").iterdir()) == sorted(run["name"] for run in aggregator.runs)
+    assert len(list(tmp_path.glob("pmids-*.npy"))) == 2
+    pd.testing.assert_frame_equal(collect(aggregator.iter_aggregates()), committed)